@@ -0,0 +1,60 @@
+"""Benchmarks of DataPuller.fetch_df
+
+The online retriever serves the synthetic data from memory so the benchmarks measure
+the puller and storage work rather than the network.
+"""
+import time
+import rba_tools.retriever.database_interface as dbi
+from rba_tools.retriever.retrievers import DatabaseRetriever
+from rba_tools.retriever.get_crypto_data import DataPuller
+from .common import (SIZES, SYMBOL, TIMEFRAME, TIMEOUT, InMemoryRetriever, generate_ohlcv, get_date_strings,
+                     make_directory, remove_directory)
+
+
+class FetchDFSuite:
+    params = SIZES
+    param_names = ['rows']
+    timeout = TIMEOUT
+    number = 1
+    repeat = (1, 5, 600.0)
+
+    def setup(self, rows):
+        self.directory = make_directory()
+        self.online_retriever = InMemoryRetriever(generate_ohlcv(rows))
+        self.from_date_str, self.to_date_str = get_date_strings(rows)
+        self.stored_database = dbi.SQLite3OHLCVDatabase(database_file=str(self.directory / 'stored.db'))
+        self.stored_puller = self.get_puller(self.stored_database)
+        #the first fetch pulls and stores everything so later fetches are served from the database
+        self.stored_puller.fetch_df(SYMBOL, str(TIMEFRAME), self.from_date_str, self.to_date_str)
+        self.pulls = 0
+
+    def teardown(self, rows):
+        self.stored_database.close()
+        remove_directory(self.directory)
+
+    def get_puller(self, database: dbi.SQLite3OHLCVDatabase) -> DataPuller:
+        return DataPuller(stored_retriever=DatabaseRetriever(database), online_retriever=self.online_retriever, database=database)
+
+    def fetch_online(self):
+        """fetch into a new database so all rows are pulled from the online retriever and stored"""
+        self.pulls += 1
+        with dbi.SQLite3OHLCVDatabase(database_file=str(self.directory / f'online_{self.pulls}.db')) as database:
+            self.get_puller(database).fetch_df(SYMBOL, str(TIMEFRAME), self.from_date_str, self.to_date_str)
+
+    def time_fetch_df_online(self, rows):
+        self.fetch_online()
+
+    def peakmem_fetch_df_online(self, rows):
+        self.fetch_online()
+
+    def time_fetch_df_stored(self, rows):
+        self.stored_puller.fetch_df(SYMBOL, str(TIMEFRAME), self.from_date_str, self.to_date_str)
+
+    def peakmem_fetch_df_stored(self, rows):
+        self.stored_puller.fetch_df(SYMBOL, str(TIMEFRAME), self.from_date_str, self.to_date_str)
+
+    def track_fetch_df_online_rows_per_second(self, rows):
+        start = time.perf_counter()
+        self.fetch_online()
+        return rows / (time.perf_counter() - start)
+    track_fetch_df_online_rows_per_second.unit = 'rows/s'
@@ -0,0 +1,76 @@
+"""Benchmarks of the file based retrievers
+
+parse benchmarks include reading the file. cached benchmarks fetch from a retriever
+that already parsed the file, or for Kraken built its memory mapped cache.
+"""
+import time
+from rba_tools.retriever.retrievers import CSVDataRetriever, KrakenOHLCVTZipRetriever
+from .common import (SIZES, SYMBOL, TIMEFRAME, TIMEOUT, generate_ohlcv, get_date_range, write_kraken_zip,
+                     make_directory, remove_directory)
+
+
+class CSVSuite:
+    params = SIZES
+    param_names = ['rows']
+    timeout = TIMEOUT
+
+    def setup(self, rows):
+        self.directory = make_directory()
+        self.file = str(self.directory / 'ohlcv.csv')
+        generate_ohlcv(rows).to_csv(self.file)
+        self.from_date, self.to_date = get_date_range(rows)
+        self.retriever = CSVDataRetriever(self.file)
+        self.retriever.fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+
+    def teardown(self, rows):
+        remove_directory(self.directory)
+
+    def time_fetch_ohlcv_parse(self, rows):
+        CSVDataRetriever(self.file).fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+
+    def peakmem_fetch_ohlcv_parse(self, rows):
+        CSVDataRetriever(self.file).fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+
+    def time_fetch_ohlcv_cached(self, rows):
+        self.retriever.fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+
+    def track_parse_rows_per_second(self, rows):
+        start = time.perf_counter()
+        CSVDataRetriever(self.file).fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+        return rows / (time.perf_counter() - start)
+    track_parse_rows_per_second.unit = 'rows/s'
+
+
+class KrakenZipSuite:
+    params = SIZES
+    param_names = ['rows']
+    timeout = TIMEOUT
+
+    def setup(self, rows):
+        self.directory = make_directory()
+        self.kraken_file = str(self.directory / 'Kraken_OHLCVT.zip')
+        write_kraken_zip(generate_ohlcv(rows), self.kraken_file)
+        self.from_date, self.to_date = get_date_range(rows)
+        self.retriever = KrakenOHLCVTZipRetriever(self.kraken_file)
+        self.retriever.fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+
+    def teardown(self, rows):
+        remove_directory(self.directory)
+
+    def time_fetch_ohlcv_parse(self, rows):
+        KrakenOHLCVTZipRetriever(self.kraken_file, use_cache=False).fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+
+    def peakmem_fetch_ohlcv_parse(self, rows):
+        KrakenOHLCVTZipRetriever(self.kraken_file, use_cache=False).fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+
+    def time_fetch_ohlcv_cached(self, rows):
+        self.retriever.fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+
+    def peakmem_fetch_ohlcv_cached(self, rows):
+        self.retriever.fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+
+    def track_parse_rows_per_second(self, rows):
+        start = time.perf_counter()
+        KrakenOHLCVTZipRetriever(self.kraken_file, use_cache=False).fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+        return rows / (time.perf_counter() - start)
+    track_parse_rows_per_second.unit = 'rows/s'
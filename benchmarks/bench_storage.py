@@ -0,0 +1,80 @@
+"""Benchmarks of the sqlite database and DatabaseRetriever
+
+time_ benchmarks report seconds, peakmem_ benchmarks the peak resident memory of the
+process and track_ benchmarks rows per second of a single run.
+"""
+import time
+import rba_tools.retriever.database_interface as dbi
+from rba_tools.retriever.retrievers import DatabaseRetriever
+from .common import SIZES, SYMBOL, TIMEFRAME, TIMEOUT, generate_ohlcv, get_date_range, make_directory, remove_directory
+
+
+class StoreSuite:
+    """storing rows into an empty database"""
+    params = SIZES
+    param_names = ['rows']
+    timeout = TIMEOUT
+    number = 1
+    repeat = (1, 5, 600.0)
+
+    def setup(self, rows):
+        self.data = generate_ohlcv(rows)
+        self.directory = make_directory()
+        self.stores = 0
+
+    def teardown(self, rows):
+        remove_directory(self.directory)
+
+    def get_empty_database(self) -> dbi.SQLite3OHLCVDatabase:
+        #each call stores into a new file so every run inserts all of its rows
+        self.stores += 1
+        return dbi.SQLite3OHLCVDatabase(database_file=str(self.directory / f'store_{self.stores}.db'))
+
+    def time_store_dataframe(self, rows):
+        with self.get_empty_database() as database:
+            database.store_dataframe(self.data, TIMEFRAME)
+
+    def peakmem_store_dataframe(self, rows):
+        with self.get_empty_database() as database:
+            database.store_dataframe(self.data, TIMEFRAME)
+
+    def track_store_rows_per_second(self, rows):
+        with self.get_empty_database() as database:
+            start = time.perf_counter()
+            database.store_dataframe(self.data, TIMEFRAME)
+            return rows / (time.perf_counter() - start)
+    track_store_rows_per_second.unit = 'rows/s'
+
+
+class QuerySuite:
+    """reading rows back from a database that holds them"""
+    params = SIZES
+    param_names = ['rows']
+    timeout = TIMEOUT
+
+    def setup(self, rows):
+        self.directory = make_directory()
+        self.database = dbi.SQLite3OHLCVDatabase(database_file=str(self.directory / 'query.db'))
+        self.database.store_dataframe(generate_ohlcv(rows), TIMEFRAME)
+        self.from_date, self.to_date = get_date_range(rows)
+        self.query = self.database.get_ohlcv_range_query(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+        self.retriever = DatabaseRetriever(self.database)
+
+    def teardown(self, rows):
+        self.database.close()
+        remove_directory(self.directory)
+
+    def time_get_query_result_as_dataframe(self, rows):
+        self.database.get_query_result_as_dataframe(self.query, TIMEFRAME)
+
+    def peakmem_get_query_result_as_dataframe(self, rows):
+        self.database.get_query_result_as_dataframe(self.query, TIMEFRAME)
+
+    def time_database_retriever_fetch_ohlcv(self, rows):
+        self.retriever.fetch_ohlcv(SYMBOL, TIMEFRAME, self.from_date, self.to_date)
+
+    def track_query_rows_per_second(self, rows):
+        start = time.perf_counter()
+        self.database.get_query_result_as_dataframe(self.query, TIMEFRAME)
+        return rows / (time.perf_counter() - start)
+    track_query_rows_per_second.unit = 'rows/s'
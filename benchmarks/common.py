@@ -0,0 +1,73 @@
+"""Synthetic OHLCV data shared by the benchmarks
+
+Data is a deterministic random walk of 1 minute bars starting 2001-01-01 so every run
+benchmarks the same rows. Sizes are row counts.
+"""
+import shutil
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+from zipfile import ZipFile, ZIP_DEFLATED
+import numpy as np
+import pandas as pd
+from rba_tools.retriever.timeframe import Timeframe
+from rba_tools.retriever.retrievers import OHLCVDataRetriever
+import rba_tools.retriever.constants as constants
+
+SIZES = [10_000, 1_000_000, 10_000_000]
+SYMBOL = 'SYN/USD'
+TIMEFRAME = Timeframe.from_string('1m')
+START_DATE = date(2001, 1, 1)
+#seconds asv waits for one benchmark. Building and storing 10M rows takes minutes
+TIMEOUT = 3600
+
+
+def generate_ohlcv(rows: int, symbol: str=SYMBOL, seed: int=0) -> pd.DataFrame:
+    """random walk OHLCV data with rows 1 minute bars in the standard layout"""
+    random = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(random.normal(0, 0.001, rows)))
+    open_ = np.concatenate(([100.0], close[:-1]))
+    spread = np.abs(random.normal(0, 0.0005, rows)) * close
+    start_ms = constants.datetime_to_epoch_ms(constants.create_midnight_datetime_from_date(START_DATE))
+    data = pd.DataFrame({'Open': open_,
+                         'High': np.maximum(open_, close) + spread,
+                         'Low': np.minimum(open_, close) - spread,
+                         'Close': close,
+                         'Volume': random.gamma(2.0, 50.0, rows)},
+                        index=TIMEFRAME.get_expected_index(start_ms, start_ms + rows * TIMEFRAME.get_bar_ms()))
+    data['Symbol'] = symbol
+    return data
+
+def get_date_range(rows: int) -> tuple:
+    """first and last date that the synthetic data of rows bars spans"""
+    days = -(-rows // 1440)
+    return (START_DATE, START_DATE + timedelta(days=days - 1))
+
+def get_date_strings(rows: int) -> tuple:
+    return tuple(day.isoformat() for day in get_date_range(rows))
+
+def write_kraken_zip(data: pd.DataFrame, kraken_file: Path):
+    """write data as the single member of a Kraken OHLCVT zip"""
+    kraken_rows = data.drop(columns='Symbol')
+    kraken_rows.index = constants.datetime_index_to_epoch_ms(data.index) // 1000
+    kraken_rows['Trades'] = 1
+    member = data['Symbol'].iloc[0].replace('/', '') + '_' + str(int(TIMEFRAME.get_timeframe_seconds() / 60)) + '.csv'
+    with ZipFile(kraken_file, 'w', compression=ZIP_DEFLATED) as kraken_zip:
+        kraken_zip.writestr(member, kraken_rows.to_csv(header=False))
+
+def make_directory() -> Path:
+    return Path(tempfile.mkdtemp(prefix='rba_benchmark_'))
+
+def remove_directory(directory: Path):
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+class InMemoryRetriever(OHLCVDataRetriever):
+    """online retriever stand in that serves slices of a dataframe without any network calls"""
+
+    def __init__(self, data: pd.DataFrame):
+        self.data = data
+
+    def fetch_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date) -> pd.DataFrame:
+        from_datetime, to_datetime = self.get_from_and_to_datetimes(from_date, to_date)
+        return self.data.loc[from_datetime:to_datetime]
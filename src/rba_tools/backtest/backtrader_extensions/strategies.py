@@ -83,7 +83,11 @@ class TestStrategy(bt.Strategy):
         ('period', 5),
         ('threshold',92.5),
         ('debug',True),
-        ('max_drawdown_pct',10)
+        ('max_drawdown_pct',10),
+        #passed to the InTrend indicator the signals are built from
+        ('minimum_bars',2),
+        ('minimum_move_percent',10),
+        ('trend_retrace_percent',85)
         )
 
     def __init__(self):
@@ -91,7 +95,9 @@ class TestStrategy(bt.Strategy):
         #self.maslope = rbsind.Slope(ma)
         #self.lowhigh = rbsind.LowHighRatio(self.data, period=self.p.period, threshold=self.p.threshold)
         #self.con_bars = rbsind.TrendInfo(self.data)
-        self.in_trend = in_trend = rbsind.InTrend(self.data1)
+        self.in_trend = in_trend = rbsind.InTrend(self.data1, minimum_bars=self.p.minimum_bars,
+                                                  minimum_move_percent=self.p.minimum_move_percent,
+                                                  trend_retrace_percent=self.p.trend_retrace_percent)
         self.retrace_percent = rbsind.Retrace_Percent(self.data1)
         self.trend_high = rbsind.Trend_High(self.data1)
         self.trend_open = rbsind.Trend_Open(self.data1)
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""Parameter sweeps of backtrader strategies over a set of symbols
+
+ParameterSweep fetches each symbol's data once and runs every combination of strategy
+parameters against every symbol. With max_workers the runs are spread over a process
+pool. The data is sent to each worker once when the worker starts and each task only
+carries a symbol and a parameter dict, so memory doesn't grow with the number of
+combinations. Results are a tidy dataframe with one row per symbol and combination.
+
+successive_halving searches the same spaces with fewer bar evaluations. Every candidate
+runs on a short prefix of each symbol's data, only the best fraction advance to a longer
+prefix and by default only the best one runs on the full history. A DrawdownPruner can also stop a
+run with cerebro.runstop() once its drawdown passes a limit.
+
+    sweep = ParameterSweep(rba_strategies.TestStrategy, ['ETH/USD'], '1/1/20', '12/31/20', '1h',
+                           add_data=ResampledData(240, 1440), fixed_params={'debug': False},
+                           cerebro_kwargs={'runonce': False}, max_workers=8)
+    results = sweep.run(grid_space({'period': [5, 7, 9], 'max_drawdown_pct': [5, 10, 15]}))
+    search = sweep.successive_halving(grid_space(...), prune_drawdown_pct=lambda params: params['max_drawdown_pct'] * 3)
+"""
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import backtrader as bt
+import pandas as pd
+import rba_tools.retriever.get_crypto_data as gcd
+from rba_tools.backtest.rba_backtrader_set import build_cerebro, add_pandas_data
+
+METRIC_COLUMNS = ['final_value', 'return_pct', 'peak_drawdown_pct', 'trades', 'win_rate_pct', 'bars', 'pruned']
+
+
+def grid_space(param_grid: dict) -> list:
+    """every combination of the values in param_grid, a dict of parameter name to a list of values"""
+    names = list(param_grid)
+    return [dict(zip(names, values)) for values in product(*(param_grid[name] for name in names))]
+
+def random_space(param_distributions: dict, samples: int, seed: int=None) -> list:
+    """samples random combinations. Each value of param_distributions is either a list to choose from
+    or a (low, high) tuple to draw uniformly from, as integers if both bounds are integers"""
+    generator = random.Random(seed)
+    space = []
+    for _ in range(samples):
+        params = {}
+        for name, distribution in param_distributions.items():
+            if isinstance(distribution, tuple):
+                low, high = distribution
+                params[name] = generator.randint(low, high) if isinstance(low, int) and isinstance(high, int) else generator.uniform(low, high)
+            else:
+                params[name] = generator.choice(list(distribution))
+        space.append(params)
+    return space
+
+class DrawdownPruner(bt.Analyzer):
+    """stops the run with cerebro.runstop() when the broker value falls more than max_drawdown_pct
+    below its peak. Analysis is whether the run was pruned and the bar it was pruned on"""
+    params = (('max_drawdown_pct', None),)
+
+    def start(self):
+        self.peak_value = self.strategy.broker.getvalue()
+        self.pruned = False
+        self.pruned_bar = None
+
+    def next(self):
+        if self.pruned or self.p.max_drawdown_pct is None:
+            return
+        value = self.strategy.broker.getvalue()
+        self.peak_value = max(self.peak_value, value)
+        if (1 - value / self.peak_value) * 100 > self.p.max_drawdown_pct:
+            self.pruned = True
+            self.pruned_bar = len(self.strategy)
+            self.strategy.env.runstop()
+
+    def get_analysis(self):
+        return {'pruned': self.pruned, 'bar': self.pruned_bar}
+
+
+def get_run_metrics(strategy: bt.Strategy, starting_cash: float) -> dict:
+    """metrics of a finished run from its DrawDown, TradeAnalyzer and optional DrawdownPruner analyzers"""
+    final_value = strategy.broker.getvalue()
+    trade_analysis = strategy.analyzers.trades.get_analysis()
+    closed_trades = trade_analysis.get('total', {}).get('closed', 0)
+    won_trades = trade_analysis.get('won', {}).get('total', 0)
+    return {'final_value': final_value,
+            'return_pct': (final_value / starting_cash - 1) * 100,
+            'peak_drawdown_pct': strategy.analyzers.drawdown.get_analysis().max.drawdown,
+            'trades': closed_trades,
+            'win_rate_pct': won_trades / closed_trades * 100 if closed_trades else float('nan'),
+            'bars': len(strategy),
+            'pruned': bool(getattr(strategy.analyzers, 'pruner', None) and strategy.analyzers.pruner.get_analysis()['pruned'])}
+
+
+class SweepRunner():
+    """runs one symbol and parameter combination. A process pool worker holds one runner with
+    every symbol's data, set by the pool's initializer"""
+
+    def __init__(self, strategy, ohlcv_dfs: dict, starting_cash: float, sizer=None, sizer_param=None,
+                 add_data=add_pandas_data, fixed_params: dict=None, cerebro_kwargs: dict=None):
+        self.strategy = strategy
+        self.ohlcv_dfs = ohlcv_dfs
+        self.starting_cash = starting_cash
+        self.sizer = sizer
+        self.sizer_param = sizer_param
+        self.add_data = add_data
+        self.fixed_params = fixed_params or {}
+        self.cerebro_kwargs = cerebro_kwargs or {}
+
+    def build_cerebro(self, symbol: str, params: dict, rows: int=None, prune_drawdown_pct: float=None) -> bt.Cerebro:
+        """cerebro for the first rows of the symbol's data, or all of it, with the analyzers get_run_metrics needs.
+        The standard observers are left out because sweeps don't plot"""
+        ohlcv_df = self.ohlcv_dfs[symbol] if rows is None else self.ohlcv_dfs[symbol].iloc[:rows]
+        cerebro_kwargs = {'stdstats': False, **self.cerebro_kwargs}
+        cerebro = build_cerebro(ohlcv_df, self.strategy, self.starting_cash, self.sizer, self.sizer_param, self.add_data,
+                                strategy_params={**self.fixed_params, **params}, **cerebro_kwargs)
+        cerebro.addanalyzer(bt.analyzers.DrawDown, _name='drawdown')
+        cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='trades')
+        if prune_drawdown_pct is not None:
+            cerebro.addanalyzer(DrawdownPruner, _name='pruner', max_drawdown_pct=prune_drawdown_pct)
+        return cerebro
+
+    def run(self, symbol: str, params: dict, rows: int=None, prune_drawdown_pct: float=None) -> dict:
+        """run the symbol with params and return a result row of the parameters and metrics"""
+        strategy = self.build_cerebro(symbol, params, rows, prune_drawdown_pct).run()[0]
+        return {'symbol': symbol, **params, **get_run_metrics(strategy, self.starting_cash)}
+
+
+_worker_runner = None
+
+def _init_worker(runner: SweepRunner):
+    global _worker_runner
+    _worker_runner = runner
+
+def _run_worker_task(task: tuple) -> dict:
+    return _worker_runner.run(*task)
+
+
+class SearchResult():
+    """result of successive_halving. results has a row per run with the rung and the rows of data it ran on"""
+
+    def __init__(self, results: pd.DataFrame, best_params: dict, bar_evaluations: int, full_sweep_bar_evaluations: int):
+        self.results = results
+        self.best_params = best_params
+        self.bar_evaluations = bar_evaluations
+        self.full_sweep_bar_evaluations = full_sweep_bar_evaluations
+
+    def get_bar_evaluation_ratio(self) -> float:
+        """how many times fewer bars were evaluated than running every candidate on the full history"""
+        return self.full_sweep_bar_evaluations / self.bar_evaluations if self.bar_evaluations else float('nan')
+
+    def __str__(self):
+        return (f'best params {self.best_params}, {self.bar_evaluations} bar evaluations instead of '
+                f'{self.full_sweep_bar_evaluations} ({self.get_bar_evaluation_ratio():.1f}x fewer)')
+
+
+class ParameterSweep():
+
+    def __init__(self, strategy, symbols, start_date_str, end_date_str, timeframe_str='1d', datapuller=None, starting_cash=1000.0,
+                 sizer=None, sizer_param=None, add_data=None, fixed_params=None, cerebro_kwargs=None, max_workers=None):
+        """
+        Parameters:
+            strategy (bt.Strategy) -- strategy class whose params are swept
+            symbols (list or str) -- symbols to run every combination over
+            start_date_str (str) -- start date of analysis time period as a string
+            end_date_str (str) -- end date of analysis time period as a string
+            timeframe_str (str) -- timeframe
+            datapuller (DataPuller) -- puller to fetch the data with. Default is DataPuller.kraken_puller()
+            starting_cash (float) -- starting broker cash
+            sizer (bt.sizers.*) -- backtrader sizer to define size of trades
+            sizer_param (any) -- parameter for sizer
+            add_data (callable) -- add_data(cerebro, ohlcv_df) adds the data feeds, e.g. ResampledData. Default is add_pandas_data
+            fixed_params (dict) -- strategy params used in every run, e.g. {'debug': False}
+            cerebro_kwargs (dict) -- arguments for bt.Cerebro, e.g. {'runonce': False}
+            max_workers (int) -- number of processes to run in. Default is to run in this process
+        """
+        if type(symbols) == str:
+            symbols = [symbols]
+        self.symbol_list = symbols
+        self.strategy = strategy
+        self.start_date_str = start_date_str
+        self.end_date_str = end_date_str
+        self.timeframe_str = timeframe_str
+        self.data_puller = datapuller if datapuller else gcd.DataPuller.kraken_puller()
+        self.starting_cash = starting_cash
+        self.sizer = sizer
+        self.sizer_param = sizer_param
+        self.add_data = add_data or add_pandas_data
+        self.fixed_params = fixed_params or {}
+        self.cerebro_kwargs = cerebro_kwargs or {}
+        self.max_workers = max_workers
+        self.ohlcv_dfs = None
+
+    def load_data(self) -> dict:
+        """fetch every symbol once. Later runs reuse the data"""
+        if self.ohlcv_dfs is None:
+            self.ohlcv_dfs = self.data_puller.fetch_many(self.symbol_list, self.timeframe_str, self.start_date_str, self.end_date_str)
+        return self.ohlcv_dfs
+
+    def get_runner(self) -> SweepRunner:
+        return SweepRunner(self.strategy, self.load_data(), self.starting_cash, self.sizer, self.sizer_param,
+                           self.add_data, self.fixed_params, self.cerebro_kwargs)
+
+    def get_executor(self, runner: SweepRunner):
+        """process pool whose workers hold runner, or None to run in this process"""
+        if self.max_workers and self.max_workers > 1:
+            return ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker, initargs=(runner,))
+        return None
+
+    def run_tasks(self, runner: SweepRunner, tasks: list, executor: ProcessPoolExecutor=None) -> list:
+        """run (symbol, params, rows, prune_drawdown_pct) tasks and return their result rows in order"""
+        if executor is None:
+            return [runner.run(*task) for task in tasks]
+        return list(executor.map(_run_worker_task, tasks, chunksize=max(1, len(tasks) // (self.max_workers * 4))))
+
+    def run(self, space: list, prune_drawdown_pct=None) -> pd.DataFrame:
+        """run every parameter dict of space, e.g. from grid_space or random_space, over every symbol.
+        Returns one row per combination and symbol with the parameters followed by the metrics.
+        prune_drawdown_pct stops runs whose drawdown passes it. It may be a function of the params"""
+        space = list(space)
+        tasks = [(symbol, params, None, get_prune_limit(prune_drawdown_pct, params)) for params in space for symbol in self.symbol_list]
+        runner = self.get_runner()
+        executor = self.get_executor(runner)
+        try:
+            rows = self.run_tasks(runner, tasks, executor)
+        finally:
+            if executor:
+                executor.shutdown()
+        return pd.DataFrame(rows, columns=['symbol'] + get_param_names(space) + METRIC_COLUMNS)
+
+    def successive_halving(self, space: list, metric: str='return_pct', eta: int=3, min_fraction: float=None,
+                           min_rows: int=1, prune_drawdown_pct=None, minimize: bool=False) -> SearchResult:
+        """search space by successive halving over data prefixes. Every candidate runs on the first min_fraction
+        of each symbol's data, the best 1/eta by the mean of metric across symbols run on eta times as much
+        data and so on until the remaining candidates run on the full history. Pruned runs never advance.
+        Higher metric values are better unless minimize is True, e.g. for peak_drawdown_pct.
+        min_fraction defaults to eta ** -k for the smallest k with eta ** k >= len(space), which leaves
+        one candidate for the full history. Prefixes have
+        at least min_rows rows, which should cover the strategy's warm up period.
+        prune_drawdown_pct stops runs whose drawdown passes it. It may be a function of the params,
+        e.g. lambda params: params['max_drawdown_pct'] * 3"""
+        candidates = list(space)
+        if min_fraction is None:
+            #counted rather than taken from math.log, which can round e.g. log(27, 3) up past 3
+            halvings = 0
+            while eta ** halvings < len(candidates):
+                halvings += 1
+            min_fraction = eta ** -halvings
+        fractions = []
+        fraction = min_fraction
+        #the tolerance keeps float error from adding a rung just short of the full history
+        while fraction < 1 - 1e-9:
+            fractions.append(fraction)
+            fraction *= eta
+        fractions.append(1.0)
+
+        runner = self.get_runner()
+        symbol_rows = {symbol: len(data) for symbol, data in runner.ohlcv_dfs.items()}
+        executor = self.get_executor(runner)
+        rung_results = []
+        try:
+            for rung, fraction in enumerate(fractions):
+                tasks = [(symbol, params, min(symbol_rows[symbol], max(min_rows, math.ceil(symbol_rows[symbol] * fraction))),
+                          get_prune_limit(prune_drawdown_pct, params))
+                         for params in candidates for symbol in self.symbol_list]
+                results = pd.DataFrame(self.run_tasks(runner, tasks, executor), columns=['symbol'] + get_param_names(candidates) + METRIC_COLUMNS)
+                results.insert(0, 'rung', rung)
+                results.insert(1, 'rows', [task[2] for task in tasks])
+                rung_results.append(results)
+                scores = results.groupby(results.index // len(self.symbol_list)).agg({metric: 'mean', 'pruned': 'any'})
+                scores.loc[scores['pruned'], metric] = math.inf if minimize else -math.inf
+                order = scores[metric].sort_values(ascending=minimize, kind='stable').index
+                if rung < len(fractions) - 1:
+                    candidates = [candidates[position] for position in order[:max(1, math.ceil(len(candidates) / eta))]]
+            best_params = candidates[order[0]]
+        finally:
+            if executor:
+                executor.shutdown()
+
+        all_results = pd.concat(rung_results, ignore_index=True)
+        #bars of a run over the full history, from an unpruned run of the last rung or else the symbol's rows
+        full_runs = rung_results[-1].loc[~rung_results[-1]['pruned']]
+        full_bars = full_runs.groupby('symbol')['bars'].max().to_dict()
+        full_sweep_bars = sum(full_bars.get(symbol, symbol_rows[symbol]) for symbol in self.symbol_list) * len(space)
+        return SearchResult(all_results, best_params, int(all_results['bars'].sum()), int(full_sweep_bars))
+
+    def summarize(self, results: pd.DataFrame, metric: str='return_pct', minimize: bool=False) -> pd.DataFrame:
+        """mean of each metric across symbols for every combination, best metric first. Lower metric
+        values are best if minimize is True"""
+        param_names = [column for column in results.columns if column not in ['symbol', 'rung', 'rows'] + METRIC_COLUMNS]
+        summary = results.groupby(param_names, dropna=False)[METRIC_COLUMNS].mean()
+        return summary.sort_values(metric, ascending=minimize)
+
+
+def get_param_names(space: list) -> list:
+    return list(dict.fromkeys(name for params in space for name in params))
+
+def get_prune_limit(prune_drawdown_pct, params: dict):
+    #resolved before tasks are sent to workers so functions like lambdas never need pickling
+    return prune_drawdown_pct(params) if callable(prune_drawdown_pct) else prune_drawdown_pct
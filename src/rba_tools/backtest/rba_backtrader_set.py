@@ -14,6 +14,9 @@ Created on Sun Feb 21 18:05:42 2021
 
 """
 
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+import threading
 import backtrader as bt
 from backtrader.utils import num2date
 import rba_tools.backtest.backtrader_extensions.strategies as rba_strategies
@@ -42,9 +45,37 @@ class MaCrossStrategy(bt.Strategy):
             self.close()
 
 
+class SymbolRunResult():
+    """the data BacktraderSet uses from one symbol's cerebro run. Unlike the strategy objects
+    returned by cerebro.run() it can be pickled so it can be returned from a worker process"""
+
+    def __init__(self, symbol, datetime_array, ohlcv_data, buy, sell, trades, final_value, analyses):
+        self.symbol = symbol
+        self.datetime_array = datetime_array
+        self.ohlcv_data = ohlcv_data
+        self.buy = buy
+        self.sell = sell
+        self.trades = trades
+        self.final_value = final_value
+        self.analyses = analyses
+
+    @classmethod
+    def from_cerebro_run(cls, symbol, cerebro_run):
+        """extract the results from the strategy list returned by cerebro.run()"""
+        strategy = cerebro_run[0]
+        return cls(symbol=symbol,
+                   datetime_array=get_datetime_array(cerebro_run),
+                   ohlcv_data=get_ohlcv_data_from_cerebro_run(cerebro_run),
+                   buy=np.array(get_buy_sell_from_cerebro_run(cerebro_run, 'buy')),
+                   sell=np.array(get_buy_sell_from_cerebro_run(cerebro_run, 'sell')),
+                   trades=np.array(get_trades_from_cerebro_run(cerebro_run)),
+                   final_value=strategy.broker.getvalue(),
+                   analyses={name: analyzer.get_analysis() for name, analyzer in zip(strategy.analyzers.getnames(), strategy.analyzers)})
+
+
 class BacktraderSet():
 
-    def __init__(self, symbols, strategy, start_date_str, end_date_str, timeframe_str='1d', datapuller=None, starting_cash=1000.0, sizer=None, sizer_param=None):
+    def __init__(self, symbols, strategy, start_date_str, end_date_str, timeframe_str='1d', datapuller=None, starting_cash=1000.0, sizer=None, sizer_param=None, max_workers=None, add_data=None, lazy=False, prefetch=0):
         """
         Creates a backtrader_set instance for retriving, running analysis, and displaying results
         
@@ -58,7 +89,19 @@ class BacktraderSet():
             starting_cash (float) -- starting broker cash
             sizer (bt.sizers.*) -- backtrader sizer to define size of trades. NOT YET IMPLEMENTED
             sizer_param (any) -- parameter for sizer. NOT YET IMPLEMENTED
+            max_workers (int) -- number of processes to run the symbols' backtests in. Default is to run them
+                                 one after another in this process, which also keeps the cerebro objects in cerebro_list.
+                                 Can't be more than 1 when lazy
+            add_data (callable) -- add_data(cerebro, ohlcv_df) adds the symbol's data feeds to its cerebro, e.g. ResampledData
+                                   for strategies that use several timeframes. Default is add_pandas_data
+            lazy (bool) -- fetch and backtest each symbol the first time it's accessed through current_symbol_index and the
+                           get_current_* methods instead of running every symbol in the constructor. Results are kept so each
+                           symbol only runs once. cerebro_list and cerebro_run_return_list stay empty so the run data
+                           methods raise ValueError
+            prefetch (int) -- number of symbols after the current one to fetch and backtest in a background thread when lazy
         """
+        if lazy and max_workers and max_workers > 1:
+            raise ValueError('lazy runs symbols one at a time as they are accessed so max_workers must not be more than 1')
         if type(symbols) == str:
             symbols = [symbols]
         self.symbol_list = symbols
@@ -77,34 +120,128 @@ class BacktraderSet():
 
         self.cerebro_list = []
         self.cerebro_run_return_list = []
-        self.current_symbol_index = 0
+        self.symbol_results = []
+        self._current_symbol_figure = None
 
         self.sizer = sizer
         self.sizer_param = sizer_param
-
-        self.run()
-        
+        self.max_workers = max_workers
+        self.add_data = add_data or add_pandas_data
+
+        self.lazy = lazy
+        self.prefetch = prefetch
+        self._result_futures = {}
+        self._prefetched = set()
+        self._lock = threading.Lock()
+        self._prefetch_executor = None
+
+        if lazy:
+            self.symbol_results = [None] * len(self.symbol_list)
+            self.current_symbol_index = 0
+        else:
+            self._current_symbol_index = 0
+            self.run()
+
+    @property
+    def current_symbol_index(self):
+        return self._current_symbol_index
+
+    @current_symbol_index.setter
+    def current_symbol_index(self, index):
+        #the figure is rebuilt for the new symbol the next time it's accessed
+        self._current_symbol_index = index
+        self._current_symbol_figure = None
+        if self.lazy and self.prefetch:
+            self.prefetch_symbols(range(index + 1, min(index + 1 + self.prefetch, len(self.symbol_list))))
+
+    @property
+    def current_symbol_figure(self):
+        if self._current_symbol_figure is None:
+            self.set_current_symbol_figure()
+        return self._current_symbol_figure
+
+    @current_symbol_figure.setter
+    def current_symbol_figure(self, figure):
+        self._current_symbol_figure = figure
         
     def run(self):
-        """runs strategy over all symbols"""
-        ohlcv_df_list = []
-        for symbol in self.symbol_list:
-            ohlcv_df_list.append(self.data_puller.fetch_df(symbol, self.timeframe_str, self.start_date_str, self.end_date_str))
-        for index in range(len(self.symbol_list)):
-            cerebro = bt.Cerebro()
-            if self.sizer:
-                cerebro.addsizer(self.sizer, self.sizer_param)
-            data = bt.feeds.PandasData(dataname=ohlcv_df_list[index], nocase=True)
-            cerebro.adddata(data)
-            cerebro.addstrategy(self.strategy)
-
-            cerebro.broker.setcash(self.starting_cash)
-
-            self.cerebro_list.append(cerebro)
-            tmp = cerebro.run()
-            self.cerebro_run_return_list.append(tmp)
+        """runs strategy over all symbols. When lazy only the symbols that haven't run yet are run and
+        each result is kept at its symbol's index"""
+        if self.lazy:
+            for index in range(len(self.symbol_list)):
+                self.get_symbol_result(index)
+            self.set_current_symbol_figure()
+            return
+        ohlcv_dfs = self.data_puller.fetch_many(self.symbol_list, self.timeframe_str, self.start_date_str, self.end_date_str)
+        ohlcv_df_list = [ohlcv_dfs[symbol] for symbol in self.symbol_list]
+        self.cerebro_list = []
+        self.cerebro_run_return_list = []
+        self.symbol_results = []
+        if self.max_workers and self.max_workers > 1:
+            self.run_parallel(ohlcv_df_list)
+        else:
+            for symbol, ohlcv_df in zip(self.symbol_list, ohlcv_df_list):
+                cerebro = build_cerebro(ohlcv_df, self.strategy, self.starting_cash, self.sizer, self.sizer_param, self.add_data)
+                self.cerebro_list.append(cerebro)
+                tmp = cerebro.run()
+                self.cerebro_run_return_list.append(tmp)
+                self.symbol_results.append(SymbolRunResult.from_cerebro_run(symbol, tmp))
         self.set_current_symbol_figure()
 
+    def run_parallel(self, ohlcv_df_list):
+        """run each symbol's backtest in a process pool. Only the SymbolRunResults are sent back so
+        cerebro_list and cerebro_run_return_list stay empty"""
+        with ProcessPoolExecutor(max_workers=min(self.max_workers, len(self.symbol_list))) as executor:
+            #map yields results in the order of symbol_list
+            self.symbol_results = list(executor.map(run_symbol_backtest, self.symbol_list, ohlcv_df_list, repeat(self.strategy),
+                                                    repeat(self.starting_cash), repeat(self.sizer), repeat(self.sizer_param),
+                                                    repeat(self.add_data)))
+
+    def run_symbol(self, index):
+        """fetch and backtest the symbol at index in this process and return its SymbolRunResult"""
+        symbol = self.symbol_list[index]
+        ohlcv_df = self.data_puller.fetch_many([symbol], self.timeframe_str, self.start_date_str, self.end_date_str)[symbol]
+        return run_symbol_backtest(symbol, ohlcv_df, self.strategy, self.starting_cash, self.sizer, self.sizer_param, self.add_data)
+
+    def get_symbol_result(self, index):
+        """SymbolRunResult of the symbol at index. When lazy the symbol is run on first access and the result kept.
+        If the symbol is already running in the prefetch thread this waits for it rather than running it again"""
+        if not self.lazy:
+            return self.symbol_results[index]
+        with self._lock:
+            future = self._result_futures.get(index)
+            owner = future is None
+            if owner:
+                future = self._result_futures[index] = Future()
+        if owner:
+            try:
+                result = self.run_symbol(index)
+            except Exception as error:
+                #forget the failure so the next access tries again
+                with self._lock:
+                    del self._result_futures[index]
+                future.set_exception(error)
+                raise
+            self.symbol_results[index] = result
+            future.set_result(result)
+        return future.result()
+
+    def prefetch_symbols(self, indexes):
+        """run the symbols at indexes in the background thread so they're ready when accessed"""
+        with self._lock:
+            indexes = [index for index in indexes if index not in self._prefetched and index not in self._result_futures]
+            self._prefetched.update(indexes)
+            if indexes and self._prefetch_executor is None:
+                self._prefetch_executor = ThreadPoolExecutor(max_workers=1)
+        for index in indexes:
+            self._prefetch_executor.submit(self.get_symbol_result, index)
+
+    def close(self, cancel_prefetch=True):
+        """stop the prefetch thread. Prefetches that haven't started are dropped unless cancel_prefetch is False"""
+        if self._prefetch_executor is not None:
+            self._prefetch_executor.shutdown(wait=True, cancel_futures=cancel_prefetch)
+            self._prefetch_executor = None
+
     def plot_current_symbol(self):
         """returns the current symbol figure for the Single Symbol Performance page"""
         plots = []
@@ -124,17 +261,23 @@ class BacktraderSet():
         self.current_symbol_figure = self.plot_current_symbol()
 
     def get_current_symbol_run_data(self):
-        return self.cerebro_run_return_list[self.current_symbol_index]
+        """strategy list returned by cerebro.run() for the current symbol. Raises ValueError when lazy or when
+        max_workers is more than 1 since the strategies aren't kept then. Use get_current_symbol_result instead"""
+        return self.get_cerebro_run_data(self.current_symbol_index)
+
+    def get_current_symbol_result(self):
+        return self.get_symbol_result(self.current_symbol_index)
 
     def get_current_datetime_array(self):
-        return get_datetime_array(self.get_current_symbol_run_data())
+        return self.get_current_symbol_result().datetime_array
 
     def get_current_ohlcv_graph(self):
         ohlcv_df = self.get_current_ohlcv_data()
         return get_candlestick_plot(ohlcv_df)
 
     def get_current_symbol_buysell_array(self, trade_type='buy'):
-        return get_buy_sell_from_cerebro_run(self.get_current_symbol_run_data(), trade_type)
+        result = self.get_current_symbol_result()
+        return result.buy if trade_type == 'buy' else result.sell
 
     def get_current_symbol_buysell_series(self, trade_type='buy'):
         data = self.get_current_symbol_buysell_array(trade_type)
@@ -153,7 +296,7 @@ class BacktraderSet():
                             )
 
     def get_current_symbol_trades_array(self):
-        return get_trades_from_cerebro_run(self.get_current_symbol_run_data())
+        return self.get_current_symbol_result().trades
 
     def get_current_symbol_trades_series(self):
         trades = self.get_current_symbol_trades_array()
@@ -161,9 +304,13 @@ class BacktraderSet():
         return pd.Series(data=trades,index=index).dropna()
 
     def get_current_ohlcv_data(self):
-        return get_ohlcv_data_from_cerebro_run(self.get_current_symbol_run_data())
+        return self.get_current_symbol_result().ohlcv_data
     
     def get_cerebro_run_data(self, index):
+        """strategy list returned by cerebro.run() for the symbol at index. Raises ValueError when lazy or when
+        max_workers is more than 1 since the strategies aren't kept then. Use get_symbol_result instead"""
+        if self.lazy or (self.max_workers and self.max_workers > 1):
+            raise ValueError('cerebro run data is only kept when symbols are run eagerly in this process')
         return self.cerebro_run_return_list[index]
     
     def get_current_symbol_name(self):
@@ -173,6 +320,42 @@ class BacktraderSet():
         pass
     
 
+def add_pandas_data(cerebro, ohlcv_df):
+    #adds the dataframe as the cerebro's only data feed
+    cerebro.adddata(bt.feeds.PandasData(dataname=ohlcv_df, nocase=True))
+
+
+class ResampledData():
+    """add_data hook that adds the dataframe resampled to each compression, e.g. ResampledData(240, 1440)
+    on 1h data gives data0 of 4h bars and data1 of daily bars like examples/template.py. It's a class
+    rather than a closure so it can be sent to worker processes"""
+
+    def __init__(self, *compressions, timeframe=bt.TimeFrame.Minutes):
+        self.compressions = compressions
+        self.timeframe = timeframe
+
+    def __call__(self, cerebro, ohlcv_df):
+        data = bt.feeds.PandasData(dataname=ohlcv_df, nocase=True)
+        for compression in self.compressions:
+            cerebro.resampledata(data, timeframe=self.timeframe, compression=compression)
+
+
+def build_cerebro(ohlcv_df, strategy, starting_cash, sizer=None, sizer_param=None, add_data=add_pandas_data, strategy_params=None, **cerebro_kwargs):
+    #returns a cerebro with one symbol's data and the strategy added. cerebro_kwargs are passed to bt.Cerebro
+    cerebro = bt.Cerebro(**cerebro_kwargs)
+    if sizer:
+        cerebro.addsizer(sizer, sizer_param)
+    add_data(cerebro, ohlcv_df)
+    cerebro.addstrategy(strategy, **(strategy_params or {}))
+
+    cerebro.broker.setcash(starting_cash)
+    return cerebro
+
+def run_symbol_backtest(symbol, ohlcv_df, strategy, starting_cash, sizer=None, sizer_param=None, add_data=add_pandas_data):
+    #runs one symbol's backtest and returns its picklable SymbolRunResult. Used by the process pool
+    cerebro_run = build_cerebro(ohlcv_df, strategy, starting_cash, sizer, sizer_param, add_data).run()
+    return SymbolRunResult.from_cerebro_run(symbol, cerebro_run)
+
 def get_trades_from_cerebro_run(cerebro_run, index=0):
     #get trades. Arrays of this oberserver are double length for some reason
     array_list = []
@@ -5,4 +5,10 @@ class Error(Exception):
 
 class KrakenFileNotFoundError(Error):
     """Raised when the kraken file cannot be found"""
-    pass
\ No newline at end of file
+    pass
+
+class OHLCVValidationError(Error):
+    """Raised in strict mode when fetched data fails validation"""
+    def __init__(self, report):
+        self.report = report
+        super().__init__(str(report))
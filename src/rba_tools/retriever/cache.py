@@ -0,0 +1,146 @@
+"""In-process cache of fetched OHLCV dataframes
+
+Entries are keyed by (source, symbol, timeframe) and hold the widest range loaded
+so far. Requests for a range inside an entry are served as a slice of the cached
+dataframe without querying the source again. The cache is bounded by a byte budget
+and evicts the least recently used entries first.
+
+A source can report a version that changes whenever its data is written, e.g. by
+another process. check_version drops the source's entries when the version changes.
+"""
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import rba_tools.retriever.constants as constants
+from rba_tools.retriever.merge import merge_ohlcv
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class CacheEntry:
+    """cached data for the interval [start_ms, end_ms) of one series"""
+
+    def __init__(self, data: pd.DataFrame, start_ms: int, end_ms: int):
+        self.data = data
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.timestamps = constants.datetime_index_to_epoch_ms(data.index)
+        self.nbytes = int(data.memory_usage(index=True, deep=True).sum())
+
+    def contains(self, start_ms: int, end_ms: int) -> bool:
+        return self.start_ms <= start_ms and end_ms <= self.end_ms
+
+    def get_slice(self, start_ms: int, end_ms: int) -> pd.DataFrame:
+        """rows in [start_ms, end_ms). A positional slice so no data is copied"""
+        first = np.searchsorted(self.timestamps, start_ms, side='left')
+        last = np.searchsorted(self.timestamps, end_ms, side='left')
+        return self.data.iloc[first:last]
+
+
+class FetchCache:
+    """LRU cache of fetched dataframes bounded by max_bytes.
+
+    Dataframes returned by get share memory with the cache and should be treated as read only."""
+
+    def __init__(self, max_bytes: int=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._source_versions = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple, start_ms: int, end_ms: int):
+        """returns the cached rows of key in [start_ms, end_ms) or None if the range isn't cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.contains(start_ms, end_ms):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.get_slice(start_ms, end_ms)
+
+    def put(self, key: tuple, data: pd.DataFrame, start_ms: int, end_ms: int):
+        """cache data as the complete rows of key in [start_ms, end_ms). A range that overlaps or
+        touches the cached range is merged with it so the entry holds the widest loaded range"""
+        if start_ms >= end_ms:
+            return
+        if not data.index.is_monotonic_increasing:
+            data = data.sort_index(kind='stable')
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.contains(start_ms, end_ms):
+                self._entries.move_to_end(key)
+                return
+            if entry is not None and start_ms <= entry.end_ms and entry.start_ms <= end_ms:
+                data = self._merge(entry, data)
+                start_ms = min(start_ms, entry.start_ms)
+                end_ms = max(end_ms, entry.end_ms)
+            new_entry = CacheEntry(data, start_ms, end_ms)
+            if new_entry.nbytes > self.max_bytes:
+                return
+            self._remove(key)
+            self._entries[key] = new_entry
+            self._bytes += new_entry.nbytes
+            self._evict()
+
+    def invalidate(self, source=None, symbol: str=None, timeframe=None):
+        """drop the entries matching every argument that is given"""
+        with self._lock:
+            for key in list(self._entries):
+                key_source, key_symbol, key_timeframe = key
+                if source is not None and key_source != source:
+                    continue
+                if symbol is not None and key_symbol != symbol:
+                    continue
+                if timeframe is not None and key_timeframe != timeframe:
+                    continue
+                self._remove(key)
+
+    def check_version(self, source, version):
+        """drop the entries of source if its version changed since the last check. A version of None isn't tracked"""
+        if version is None:
+            return
+        with self._lock:
+            if self._source_versions.get(source, version) != version:
+                self._remove_source(source)
+            self._source_versions[source] = version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / requests if requests else 0.0,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'max_bytes': self.max_bytes}
+
+    def _merge(self, entry: CacheEntry, data: pd.DataFrame) -> pd.DataFrame:
+        """combine the cached rows with data, keeping the cached row where both have a bar"""
+        return merge_ohlcv([entry.data, data], keep='first')
+
+    def _remove_source(self, source):
+        for key in [key for key in self._entries if key[0] == source]:
+            self._remove(key)
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.nbytes
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.nbytes
+            self.evictions += 1
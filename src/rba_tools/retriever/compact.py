@@ -0,0 +1,49 @@
+"""Compact in-memory representation of OHLCV dataframes
+
+The standard layout holds a full Symbol string on every row next to float64 prices.
+The compact layout stores Symbol as a categorical, prices as float32 by default and
+optionally the index as int64 epoch milliseconds. Compact frames with a DatetimeIndex
+can be passed to bt.feeds.PandasData as they are.
+"""
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+import rba_tools.retriever.constants as constants
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close']
+
+def to_compact(data: pd.DataFrame, price_dtype=np.float32, volume_dtype=np.float64, epoch_index: bool=False) -> pd.DataFrame:
+    """convert a dataframe in the standard layout to the compact layout. Volume is kept as float64 by default
+    because float32 only holds about 7 significant digits"""
+    compact = pd.DataFrame({column: data[column].to_numpy(dtype=price_dtype) for column in PRICE_COLUMNS}, index=data.index)
+    compact['Volume'] = data['Volume'].to_numpy(dtype=volume_dtype)
+    compact['Symbol'] = data['Symbol'].astype('category')
+    if epoch_index and isinstance(data.index, pd.DatetimeIndex):
+        compact.index = pd.Index(constants.datetime_index_to_epoch_ms(data.index), name=constants.INDEX_HEADER)
+    return compact
+
+def from_compact(data: pd.DataFrame) -> pd.DataFrame:
+    """convert a compact dataframe back to the standard layout"""
+    standard = pd.DataFrame({column: data[column].to_numpy(dtype=np.float64) for column in PRICE_COLUMNS + ['Volume']}, index=data.index)
+    standard['Symbol'] = data['Symbol'].astype(object)
+    if not isinstance(data.index, pd.DatetimeIndex):
+        standard.index = constants.epoch_ms_to_datetime_index(data.index)
+    return standard
+
+def is_compact(data: pd.DataFrame) -> bool:
+    return isinstance(data['Symbol'].dtype, pd.CategoricalDtype)
+
+def concat_compact(frames: list) -> pd.DataFrame:
+    """concatenate compact dataframes keeping Symbol categorical. pd.concat falls back to
+    object strings when the frames' categories differ"""
+    frames = list(frames)
+    if not frames:
+        return to_compact(constants.empty_ohlcv_df_generator())
+    symbols = union_categoricals([frame['Symbol'].astype('category') for frame in frames])
+    result = pd.concat([frame.drop(columns='Symbol') for frame in frames])
+    result['Symbol'] = symbols
+    return result
+
+def get_memory_usage(data: pd.DataFrame) -> int:
+    """bytes used by data including the index and the strings of object columns"""
+    return int(data.memory_usage(index=True, deep=True).sum())
@@ -1,11 +1,28 @@
 from pandas import DataFrame, DatetimeIndex
-from datetime import datetime,date
+from datetime import datetime,date,timezone
+import numpy as np
 DATAFRAME_HEADERS = ['Open', 'High', 'Low', 'Close', 'Volume', 'Symbol']
 INDEX_HEADER = 'Timestamp'
+#default number of rows in each chunk yielded by the iter_ohlcv and iter_df generators
+DEFAULT_CHUNKSIZE = 100000
 
 def empty_ohlcv_df_generator():
     """Generates a new empty "open, high, low, close, volume" dataframe"""
     return DataFrame(columns=DATAFRAME_HEADERS, index=DatetimeIndex([], name=INDEX_HEADER))
 
 def create_midnight_datetime_from_date(_date: date) -> datetime:
-    return datetime.combine(_date, datetime.min.time())
\ No newline at end of file
+    return datetime.combine(_date, datetime.min.time())
+
+def datetime_to_epoch_ms(_datetime: datetime) -> int:
+    """converts a datetime to epoch milliseconds. Naive datetimes are treated as UTC"""
+    if _datetime.tzinfo is None:
+        _datetime = _datetime.replace(tzinfo=timezone.utc)
+    return int(round(_datetime.timestamp() * 1000))
+
+def datetime_index_to_epoch_ms(index: DatetimeIndex) -> np.ndarray:
+    """converts a DatetimeIndex to an int64 array of epoch milliseconds"""
+    return DatetimeIndex(index).values.astype('datetime64[ms]').astype(np.int64)
+
+def epoch_ms_to_datetime_index(values) -> DatetimeIndex:
+    """converts an array of epoch milliseconds to a DatetimeIndex"""
+    return DatetimeIndex(np.asarray(values, dtype=np.int64).astype('datetime64[ms]').astype('datetime64[ns]'), name=INDEX_HEADER)
@@ -0,0 +1,71 @@
+"""Interval helpers for tracking which time ranges of a series are complete
+
+Intervals are (start, end) tuples of epoch milliseconds with end exclusive.
+"""
+from datetime import date, timedelta
+import numpy as np
+from rba_tools.retriever.timeframe import Timeframe
+import rba_tools.retriever.constants as constants
+
+def merge_intervals(intervals: list) -> list:
+    """returns the sorted union of intervals, joining intervals that overlap or touch"""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def subtract_intervals(start: int, end: int, covered: list) -> list:
+    """returns the parts of [start, end) that are not in the covered intervals"""
+    missing = []
+    for covered_start, covered_end in merge_intervals(covered):
+        if covered_end <= start or covered_start >= end:
+            continue
+        if covered_start > start:
+            missing.append((start, covered_start))
+        start = max(start, covered_end)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+def get_data_intervals(timestamps: np.ndarray, bar_ms: int) -> list:
+    """returns the intervals spanned by runs of consecutive bars in an array of epoch millisecond timestamps"""
+    if not len(timestamps):
+        return []
+    timestamps = np.unique(timestamps)
+    breaks = np.flatnonzero(np.diff(timestamps) > bar_ms) + 1
+    starts = timestamps[np.concatenate(([0], breaks))]
+    ends = timestamps[np.concatenate((breaks - 1, [len(timestamps) - 1]))] + bar_ms
+    return list(zip(starts.tolist(), ends.tolist()))
+
+def date_range_to_interval(from_date: date, to_date: date):
+    """returns the interval from the start of from_date through the end of to_date"""
+    from_datetime = constants.create_midnight_datetime_from_date(from_date)
+    to_datetime_plus_1 = constants.create_midnight_datetime_from_date(to_date) + timedelta(days=1)
+    return (constants.datetime_to_epoch_ms(from_datetime), constants.datetime_to_epoch_ms(to_datetime_plus_1))
+
+def epoch_ms_to_date(epoch_ms: int) -> date:
+    return constants.epoch_ms_to_datetime_index([epoch_ms])[0].date()
+
+def get_chunk_date_ranges(from_date: date, to_date: date, timeframe: Timeframe, chunksize: int) -> list:
+    """splits an inclusive date range into ranges of whole days that hold about chunksize bars of timeframe"""
+    days = max(1, int(chunksize * timeframe.get_timeframe_seconds() // 86400))
+    date_ranges = []
+    while from_date <= to_date:
+        date_ranges.append((from_date, min(to_date, from_date + timedelta(days=days - 1))))
+        from_date += timedelta(days=days)
+    return date_ranges
+
+def intervals_to_date_ranges(intervals: list) -> list:
+    """converts intervals to a list of inclusive (from_date, to_date) ranges covering whole days"""
+    date_ranges = []
+    for start, end in intervals:
+        from_date = epoch_ms_to_date(start)
+        to_date = epoch_ms_to_date(end - 1)
+        if date_ranges and from_date <= date_ranges[-1][1] + timedelta(days=1):
+            date_ranges[-1] = (date_ranges[-1][0], max(date_ranges[-1][1], to_date))
+        else:
+            date_ranges.append((from_date, to_date))
+    return date_ranges
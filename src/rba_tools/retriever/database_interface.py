@@ -1,47 +1,293 @@
 from abc import ABC, abstractmethod
+import argparse
+import os
+import shutil
+import threading
+import uuid
+from datetime import date
+from urllib.parse import quote, unquote
+import json
+import numpy as np
 import pandas as pd
 import sqlite3
 from rba_tools.retriever.timeframe import Timeframe
 import rba_tools.retriever.constants as constants
+import rba_tools.retriever.coverage as coverage
+from rba_tools.retriever.instrumentation import NULL_METRICS
 from pathlib import Path
 
+#file in a directory written by write_npy_columns naming the generation directory holding its current columns
+NPY_CURRENT_FILE = 'current'
+
 class OHLCVDatabaseInterface(ABC):
+    #replace with an instrumentation.Metrics to record query and store timings
+    metrics = NULL_METRICS
+    #(FetchCache, source) pairs added with add_cache whose entries are dropped when the database is written or closed
+    caches = ()
+
     @abstractmethod
     def store_dataframe(self, df: pd.DataFrame, timeframe: Timeframe) -> None:
         """stores pandas dataframe data into database"""
 
+    @abstractmethod
+    def bulk_store_dataframe(self, df: pd.DataFrame, timeframe: Timeframe, replace: bool=False) -> int:
+        """stores pandas dataframe data into database in batches. Rows that are already stored
+        are skipped, or overwritten if replace is True. Returns the number of new rows"""
+
     @abstractmethod
     def get_query_result_as_dataframe(self, query: str, timeframe: Timeframe) -> pd.DataFrame:
         """executes an SQL query and returns results in dataframe"""
 
+    @abstractmethod
+    def get_ohlcv_range_as_dataframe(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date) -> pd.DataFrame:
+        """returns the stored data for symbol from the start of from_date through the end of to_date"""
+
+    @abstractmethod
+    def get_last_timestamp(self, symbol: str, timeframe: Timeframe):
+        """returns the epoch millisecond timestamp of the newest stored bar or None if nothing is stored"""
+
+    @abstractmethod
+    def get_stored_series(self) -> list:
+        """returns a (symbol, Timeframe) tuple for every series with stored data"""
+
+    @abstractmethod
+    def get_coverage(self, symbol: str, timeframe: Timeframe) -> list:
+        """returns the sorted [start, end) epoch millisecond intervals known to be completely stored"""
+
+    @abstractmethod
+    def add_coverage(self, symbol: str, timeframe: Timeframe, start_ms: int, end_ms: int) -> None:
+        """records [start_ms, end_ms) as completely stored, merging it with overlapping intervals"""
+
+    def get_ohlcv_ranges_as_dataframes(self, symbols: list, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        """returns a dict of symbol to the stored data for the range. Backends that can read several symbols
+        at once override this"""
+        return {symbol: self.get_ohlcv_range_as_dataframe(symbol, timeframe, from_date, to_date) for symbol in symbols}
+
+    def iter_ohlcv_range(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date, chunksize: int=constants.DEFAULT_CHUNKSIZE):
+        """yields the stored data for the range as time ordered dataframes of at most chunksize rows.
+        By default the range is read in windows of whole days holding about chunksize bars"""
+        for window_from_date, window_to_date in coverage.get_chunk_date_ranges(from_date, to_date, timeframe, chunksize):
+            data = self.get_ohlcv_range_as_dataframe(symbol, timeframe, window_from_date, window_to_date)
+            for first in range(0, len(data), chunksize):
+                yield data.iloc[first:first + chunksize]
+
+    def get_range_epoch_ms(self, from_date: date, to_date: date):
+        """returns the [start, end) epoch millisecond range from the start of from_date through the end of to_date"""
+        return coverage.date_range_to_interval(from_date, to_date)
+
+    def get_cache_source(self):
+        """key of this database's entries in a FetchCache. Backends stored in files return their path so
+        every object opened on the same files shares entries"""
+        return self
+
+    def get_data_version(self):
+        """a value that changes whenever the stored data is written by any object or process, or None if unknown"""
+        return None
+
+    def add_cache(self, cache, source=None):
+        """drop the entries of source, by default get_cache_source(), from cache whenever this database is written or closed"""
+        cache_source = (cache, self.get_cache_source() if source is None else source)
+        if cache_source not in self.caches:
+            self.caches = self.caches + (cache_source,)
+
+    def invalidate_caches(self) -> None:
+        for cache, source in self.caches:
+            cache.invalidate(source)
+
+    def close(self) -> None:
+        """releases any resources held by the database"""
+        self.invalidate_caches()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
 class SQLite3OHLCVDatabase(OHLCVDatabaseInterface):
+    """OHLCV database stored in a local sqlite3 file
 
-    def __init__(self, test=False):
+    A connection is opened once per thread and reused until close() is called.
+    The database is put in WAL mode so readers are not blocked while data is written.
+    Timestamps are stored as integer epoch milliseconds."""
+    BULK_BATCH_SIZE = 100000
+    COVERAGE_TABLE = 'OHLCV_COVERAGE'
+    #kept well under sqlite's limit on query parameters
+    MAX_QUERY_SYMBOLS = 500
+
+    def __init__(self, test=False, database_file: str=None):
         db_file = 'ohlcv_sqlite_test.db' if test else 'ohlcv_sqlite.db'
-        self.database_file = str(Path(__file__).parent) + '\\ohlcv_data\\' + db_file
-        self.connection = None
-        
+        self.database_file = database_file
+        if not self.database_file:
+            self.database_file = str(Path(__file__).parent) + '\\ohlcv_data\\' + db_file
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._existing_tables = set()
+
     def store_dataframe(self, df: pd.DataFrame, timeframe: Timeframe):
+        self.bulk_store_dataframe(df, timeframe)
+
+    def bulk_store_dataframe(self, df: pd.DataFrame, timeframe: Timeframe, replace: bool=False) -> int:
+        if df.empty:
+            return 0
         self.create_OHLCV_table_if_not_exists(timeframe)
-        connection = sqlite3.connect(self.get_database_file())
         table_name = timeframe.get_timeframe_table_name()
-        try:
-            df.to_sql(table_name, connection, if_exists='append')
-        finally:
-            connection.close()
+        columns = [constants.INDEX_HEADER] + constants.DATAFRAME_HEADERS
+        conflict = 'REPLACE' if replace else 'IGNORE'
+        insert = f"""INSERT OR {conflict} INTO {table_name} ({', '.join(columns)})
+                     VALUES ({', '.join('?' * len(columns))})"""
+        column_values = [self._get_stored_timestamps(df.index)]
+        column_values.extend(df[header].to_numpy() for header in constants.DATAFRAME_HEADERS)
+
+        connection = self.get_connection()
+        new_rows = 0
+        with self.metrics.timer('database.store', timeframe=str(timeframe)):
+            for start in range(0, len(df), self.BULK_BATCH_SIZE):
+                batch = [values[start:start + self.BULK_BATCH_SIZE] for values in column_values]
+                rows = zip(*(values.tolist() for values in batch))
+                with connection:
+                    if replace:
+                        #replaced rows count as changes so compare row counts instead
+                        rows_before = self._count_rows(connection, table_name, batch[0], batch[-1])
+                        connection.executemany(insert, rows)
+                        new_rows += self._count_rows(connection, table_name, batch[0], batch[-1]) - rows_before
+                    else:
+                        new_rows += connection.executemany(insert, rows).rowcount
+        self.invalidate_caches()
+        self.metrics.count('database.rows_stored', new_rows, timeframe=str(timeframe))
+        return new_rows
+
+    def _count_rows(self, connection: sqlite3.Connection, table_name: str, timestamps, symbols) -> int:
+        """count stored rows for each symbol within the timestamp range of a batch"""
+        query = f"""SELECT COUNT(*) FROM {table_name}
+                    WHERE Symbol = ? AND {constants.INDEX_HEADER} BETWEEN ? AND ?"""
+        count = 0
+        for symbol in pd.unique(symbols):
+            symbol_timestamps = timestamps[symbols == symbol]
+            params = (symbol, int(symbol_timestamps.min()), int(symbol_timestamps.max()))
+            count += connection.execute(query, params).fetchone()[0]
+        return count
+
+    def _get_stored_timestamps(self, index: pd.DatetimeIndex):
+        """convert a DatetimeIndex to the values stored in the Timestamp column"""
+        return constants.datetime_index_to_epoch_ms(index)
 
     def get_query_result_as_dataframe(self, query: str, timeframe: Timeframe):
         self.create_OHLCV_table_if_not_exists(timeframe)
-        connection = sqlite3.connect(self.get_database_file())
-        result = constants.empty_ohlcv_df_generator()
-        try:
-            result = pd.read_sql_query(query, connection, index_col=constants.INDEX_HEADER, parse_dates=[constants.INDEX_HEADER])
-        finally:
-            connection.close()
+        with self.metrics.timer('database.query', timeframe=str(timeframe)):
+            result = pd.read_sql_query(query, self.get_connection(), index_col=constants.INDEX_HEADER)
+            result.index = constants.epoch_ms_to_datetime_index(result.index)
+        self.metrics.count('database.rows_returned', len(result), timeframe=str(timeframe))
         return result
 
+    def get_ohlcv_range_as_dataframe(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
+        query = self.get_ohlcv_range_query(symbol, timeframe, from_date, to_date)
+        return self.get_query_result_as_dataframe(query, timeframe)
+
+    def iter_ohlcv_range(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date, chunksize: int=constants.DEFAULT_CHUNKSIZE):
+        """streams the range from a single query with read_sql_query's chunksize"""
+        self.create_OHLCV_table_if_not_exists(timeframe)
+        from_ms, to_ms = self.get_range_epoch_ms(from_date, to_date)
+        query = f"""SELECT * FROM {timeframe.get_timeframe_table_name()}
+                    WHERE Symbol = ? AND {constants.INDEX_HEADER} >= ? AND {constants.INDEX_HEADER} < ?
+                    ORDER BY {constants.INDEX_HEADER}"""
+        for chunk in pd.read_sql_query(query, self.get_connection(), index_col=constants.INDEX_HEADER,
+                                       params=(symbol, from_ms, to_ms), chunksize=chunksize):
+            chunk.index = constants.epoch_ms_to_datetime_index(chunk.index)
+            yield chunk
+
+    def get_ohlcv_ranges_as_dataframes(self, symbols: list, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        """reads the range for all symbols with one query per MAX_QUERY_SYMBOLS symbols"""
+        self.create_OHLCV_table_if_not_exists(timeframe)
+        from_ms, to_ms = self.get_range_epoch_ms(from_date, to_date)
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        pieces = []
+        with self.metrics.timer('database.query', timeframe=str(timeframe)):
+            for first in range(0, len(symbols), self.MAX_QUERY_SYMBOLS):
+                query_symbols = symbols[first:first + self.MAX_QUERY_SYMBOLS]
+                query = f"""SELECT * FROM {timeframe.get_timeframe_table_name()}
+                            WHERE Symbol IN ({', '.join('?' * len(query_symbols))})
+                            AND {constants.INDEX_HEADER} >= ? AND {constants.INDEX_HEADER} < ?
+                            ORDER BY Symbol, {constants.INDEX_HEADER}"""
+                pieces.append(pd.read_sql_query(query, self.get_connection(), index_col=constants.INDEX_HEADER,
+                                                params=query_symbols + [from_ms, to_ms]))
+            result = pd.concat(pieces) if len(pieces) > 1 else pieces[0]
+            result.index = constants.epoch_ms_to_datetime_index(result.index)
+        self.metrics.count('database.rows_returned', len(result), timeframe=str(timeframe))
+        frames = {symbol: symbol_data for symbol, symbol_data in result.groupby('Symbol', sort=False)}
+        return {symbol: frames.get(symbol, result.iloc[:0]) for symbol in symbols}
+
+    def get_ohlcv_range_query(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
+        """Generate query for the data of one symbol over a date range"""
+        from_ms, to_ms = self.get_range_epoch_ms(from_date, to_date)
+        symbol_condition = "Symbol = '" + symbol + "'"
+        table_name = timeframe.get_timeframe_table_name()
+        #timestamps are stored as epoch milliseconds so the range can use the primary key index
+        start_condition = f'and {constants.INDEX_HEADER} >= {from_ms}'
+        end_condition = f'and {constants.INDEX_HEADER} < {to_ms}'
+        return f"""SELECT * FROM {table_name} 
+            WHERE {symbol_condition}
+            {start_condition}
+            {end_condition}"""
+
+    def get_last_timestamp(self, symbol: str, timeframe: Timeframe):
+        self.create_OHLCV_table_if_not_exists(timeframe)
+        query = f'SELECT MAX({constants.INDEX_HEADER}) FROM {timeframe.get_timeframe_table_name()} WHERE Symbol = ?'
+        return self.get_connection().execute(query, (symbol,)).fetchone()[0]
+
+    def get_timeframe_table_names(self) -> list:
+        #a prefix check rather than LIKE, whose _ is a wildcard and which ignores case
+        query = "SELECT name FROM sqlite_master WHERE type = 'table'"
+        return [name for (name,) in self.get_connection().execute(query).fetchall() if name.startswith(Timeframe.TABLE_PREFIX)]
+
+    def get_stored_series(self) -> list:
+        series = []
+        for table_name in self.get_timeframe_table_names():
+            timeframe = Timeframe.from_string(table_name[len(Timeframe.TABLE_PREFIX):])
+            symbols = self.get_connection().execute(f'SELECT DISTINCT Symbol FROM {table_name}').fetchall()
+            series.extend((symbol, timeframe) for (symbol,) in symbols)
+        return series
+
+    def get_coverage(self, symbol: str, timeframe: Timeframe) -> list:
+        self.create_coverage_table_if_not_exists()
+        query = f"""SELECT StartTimestamp, EndTimestamp FROM {self.COVERAGE_TABLE}
+                    WHERE Symbol = ? AND Timeframe = ? ORDER BY StartTimestamp"""
+        return [tuple(row) for row in self.get_connection().execute(query, (symbol, str(timeframe)))]
+
+    def add_coverage(self, symbol: str, timeframe: Timeframe, start_ms: int, end_ms: int) -> None:
+        self.create_coverage_table_if_not_exists()
+        overlap_condition = f"""FROM {self.COVERAGE_TABLE} WHERE Symbol = ? AND Timeframe = ?
+                                AND StartTimestamp <= ? AND EndTimestamp >= ?"""
+        params = (symbol, str(timeframe), end_ms, start_ms)
+        connection = self.get_connection()
+        with connection:
+            overlapping = connection.execute('SELECT StartTimestamp, EndTimestamp ' + overlap_condition, params).fetchall()
+            [(start_ms, end_ms)] = coverage.merge_intervals(overlapping + [(start_ms, end_ms)])
+            connection.execute('DELETE ' + overlap_condition, params)
+            connection.execute(f'INSERT INTO {self.COVERAGE_TABLE} VALUES (?, ?, ?, ?)', (symbol, str(timeframe), start_ms, end_ms))
+
+    def create_coverage_table_if_not_exists(self) -> None:
+        if self.COVERAGE_TABLE in self._existing_tables:
+            return
+        sql_create_coverage_table = f""" CREATE TABLE IF NOT EXISTS {self.COVERAGE_TABLE} (
+                                        Symbol string NOT NULL,
+                                        Timeframe string NOT NULL,
+                                        StartTimestamp integer NOT NULL,
+                                        EndTimestamp integer NOT NULL,
+                                        PRIMARY KEY (Symbol, Timeframe, StartTimestamp)
+                                    ); """
+        connection = self.get_connection()
+        with connection:
+            connection.execute(sql_create_coverage_table)
+        self._existing_tables.add(self.COVERAGE_TABLE)
+
     def create_OHLCV_table_if_not_exists(self, timeframe: Timeframe) -> None:
         table_name = timeframe.get_timeframe_table_name()
+        if table_name in self._existing_tables:
+            return
         sql_create_ohlcv_table = f""" CREATE TABLE IF NOT EXISTS {table_name} (
                                         Timestamp integer NOT NULL,
                                         Open real NOT NULL,
@@ -52,23 +298,320 @@ class SQLite3OHLCVDatabase(OHLCVDatabaseInterface):
                                         Symbol string NOT NULL,
                                         PRIMARY KEY (Symbol, Timestamp)
                                     ); """
-        connection = sqlite3.connect(self.get_database_file())
+        connection = self.get_connection()
+        with connection:
+            connection.execute(sql_create_ohlcv_table)
+        self._existing_tables.add(table_name)
+
+    def migrate_timestamps_to_epoch_ms(self) -> dict:
+        """one time conversion of text timestamps written by older versions to epoch milliseconds.
+        Returns the number of rows converted per table"""
+        connection = self.get_connection()
+        table_names = self.get_timeframe_table_names()
+        #julianday handles both whole and fractional second text timestamps
+        epoch_ms = f"CAST(ROUND((julianday({constants.INDEX_HEADER}) - 2440587.5) * 86400000) AS INTEGER)"
+        converted = {}
+        for table_name in table_names:
+            with connection:
+                cursor = connection.execute(f"""UPDATE OR REPLACE {table_name}
+                                                SET {constants.INDEX_HEADER} = {epoch_ms}
+                                                WHERE typeof({constants.INDEX_HEADER}) = 'text'""")
+            converted[table_name] = cursor.rowcount
+        return converted
+
+    def get_connection(self) -> sqlite3.Connection:
+        """returns this thread's connection, opening it on first use"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            #connections are only used by the thread that opened them but may be closed from any thread
+            connection = sqlite3.connect(self.get_database_file(), timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def close(self):
+        """closes every connection opened by this database object"""
+        self.invalidate_caches()
+        self._close_connections()
+
+    def _close_connections(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._local = threading.local()
+        self._existing_tables.clear()
+
+    def __del__(self):
+        #caches aren't touched here since the garbage collector may run while a cache's lock is held
         try:
-            cursor = connection.cursor()
-            cursor.execute(sql_create_ohlcv_table)
-        finally:
-            connection.close()
+            self._close_connections()
+        except Exception:
+            pass
 
     def _execute_query(self, query: str):
         """execute and return data from a query. Meant only for troubleshooting"""
-        connection = sqlite3.connect(self.database_file)
-        cursor = connection.cursor()
+        cursor = self.get_connection().cursor()
         try:
             cursor.execute(query)
             data = cursor.fetchall()
         finally:
-            connection.close()
+            cursor.close()
         return data
 
     def get_database_file(self):
-        return self.database_file
\ No newline at end of file
+        return self.database_file
+
+    def get_cache_source(self):
+        return ('sqlite', os.path.abspath(self.get_database_file()))
+
+    def get_data_version(self):
+        #commits change the -wal file and checkpoints change the database file
+        return tuple(get_file_signature(file) for file in [self.get_database_file(), self.get_database_file() + '-wal'])
+
+
+class NumpyColumnarOHLCVDatabase(OHLCVDatabaseInterface):
+    """OHLCV database stored as one .npy file per column
+
+    Files are laid out as <root>/<timeframe table>/<symbol>/<year>/<generation>/<column>.npy and timestamps are
+    epoch milliseconds sorted ascending. Reads memory map the columns and slice out the requested range
+    so only the pages for that range are read from disk."""
+    COLUMNS = [constants.INDEX_HEADER, 'Open', 'High', 'Low', 'Close', 'Volume']
+    PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close']
+    VERSION_FILE = 'data_version'
+
+    def __init__(self, test=False, root_directory: str=None, price_dtype=np.float64):
+        """price_dtype may be np.float32 to halve the size of the price columns on disk and in memory.
+        Volume is always stored as float64"""
+        directory = 'columnar_test' if test else 'columnar'
+        self.root_directory = Path(root_directory) if root_directory else Path(__file__).parent / 'ohlcv_data' / directory
+        self.price_dtype = price_dtype
+        self._write_lock = threading.Lock()
+
+    def store_dataframe(self, df: pd.DataFrame, timeframe: Timeframe):
+        self.bulk_store_dataframe(df, timeframe)
+
+    def bulk_store_dataframe(self, df: pd.DataFrame, timeframe: Timeframe, replace: bool=False) -> int:
+        if df.empty:
+            return 0
+        timestamps = constants.datetime_index_to_epoch_ms(df.index)
+        years = timestamps.astype('datetime64[ms]').astype('datetime64[Y]').astype(np.int64) + 1970
+        symbols = df['Symbol'].to_numpy()
+        new_rows = 0
+        with self._write_lock, self.metrics.timer('database.store', timeframe=str(timeframe)):
+            for symbol in pd.unique(symbols):
+                for year in np.unique(years[symbols == symbol]):
+                    mask = (symbols == symbol) & (years == year)
+                    columns = {constants.INDEX_HEADER: timestamps[mask]}
+                    columns.update((column, df[column].to_numpy(dtype=self._get_column_dtype(column))[mask]) for column in self.COLUMNS[1:])
+                    new_rows += self._merge_partition(self._get_partition_directory(symbol, timeframe, year), columns, replace)
+            self._write_data_version()
+        self.invalidate_caches()
+        self.metrics.count('database.rows_stored', new_rows, timeframe=str(timeframe))
+        return new_rows
+
+    def get_query_result_as_dataframe(self, query: str, timeframe: Timeframe):
+        """runs the SQL query against an in memory sqlite table laid out like SQLite3OHLCVDatabase's table for
+        timeframe. Every stored series of timeframe is loaded into it so this is meant for ad hoc queries"""
+        table_name = timeframe.get_timeframe_table_name()
+        with self.metrics.timer('database.query', timeframe=str(timeframe)):
+            connection = sqlite3.connect(':memory:')
+            try:
+                self.get_timeframe_as_dataframe(timeframe).to_sql(table_name, connection, index=False)
+                result = pd.read_sql_query(query, connection, index_col=constants.INDEX_HEADER)
+            finally:
+                connection.close()
+            result.index = constants.epoch_ms_to_datetime_index(result.index)
+        self.metrics.count('database.rows_returned', len(result), timeframe=str(timeframe))
+        return result
+
+    def get_timeframe_as_dataframe(self, timeframe: Timeframe) -> pd.DataFrame:
+        """every stored row of timeframe with epoch millisecond timestamps in a column, like a row of an sqlite table"""
+        pieces = []
+        timeframe_directory = self.root_directory / timeframe.get_timeframe_table_name()
+        series_directories = sorted(timeframe_directory.iterdir()) if timeframe_directory.is_dir() else []
+        for series_directory in series_directories:
+            for partition_directory in sorted(series_directory.iterdir()):
+                columns_directory = get_npy_columns_directory(partition_directory) if partition_directory.name.isdigit() else None
+                if columns_directory:
+                    piece = pd.DataFrame(load_npy_columns(columns_directory, self.COLUMNS))
+                    piece['Symbol'] = unquote(series_directory.name)
+                    pieces.append(piece)
+        if not pieces:
+            return pd.DataFrame({column: pd.Series(dtype=np.int64 if column == constants.INDEX_HEADER else np.float64)
+                                 for column in self.COLUMNS}).assign(Symbol=pd.Series(dtype=object))
+        return pd.concat(pieces, ignore_index=True)
+
+    def get_ohlcv_range_as_dataframe(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
+        with self.metrics.timer('database.query', symbol=symbol, timeframe=str(timeframe)):
+            arrays = self.get_ohlcv_range_as_arrays(symbol, timeframe, from_date, to_date)
+            rows = len(arrays[constants.INDEX_HEADER])
+            result = self._arrays_to_dataframe(arrays, symbol) if rows else constants.empty_ohlcv_df_generator()
+        self.metrics.count('database.rows_returned', rows, symbol=symbol, timeframe=str(timeframe))
+        return result
+
+    def iter_ohlcv_range(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date, chunksize: int=constants.DEFAULT_CHUNKSIZE):
+        """yields chunks sliced from the memory mapped year partitions"""
+        for arrays in self._iter_partition_arrays(symbol, timeframe, from_date, to_date):
+            for first in range(0, len(arrays[constants.INDEX_HEADER]), chunksize):
+                yield self._arrays_to_dataframe({column: values[first:first + chunksize] for column, values in arrays.items()}, symbol)
+
+    def get_ohlcv_range_as_arrays(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        """returns a dict of column name to numpy array for the range. When the range falls in a single
+        year the arrays are read only views of the memory mapped files"""
+        pieces = list(self._iter_partition_arrays(symbol, timeframe, from_date, to_date))
+        if len(pieces) == 1:
+            return pieces[0]
+        if not pieces:
+            return {column: np.empty(0, dtype=np.int64 if column == constants.INDEX_HEADER else np.float64) for column in self.COLUMNS}
+        return {column: np.concatenate([piece[column] for piece in pieces]) for column in self.COLUMNS}
+
+    def _iter_partition_arrays(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
+        """yields the memory mapped columns within the range for each year partition that has rows in it"""
+        from_ms, to_ms = self.get_range_epoch_ms(from_date, to_date)
+        for year in range(from_date.year, to_date.year + 1):
+            directory = get_npy_columns_directory(self._get_partition_directory(symbol, timeframe, year))
+            if not directory:
+                continue
+            timestamps = np.load(directory / f'{constants.INDEX_HEADER}.npy', mmap_mode='r')
+            start, end = np.searchsorted(timestamps, [from_ms, to_ms])
+            if start == end:
+                continue
+            columns = load_npy_columns(directory, self.COLUMNS[1:])
+            columns[constants.INDEX_HEADER] = timestamps
+            yield {column: values[start:end] for column, values in columns.items()}
+
+    def _arrays_to_dataframe(self, arrays: dict, symbol: str) -> pd.DataFrame:
+        index = constants.epoch_ms_to_datetime_index(arrays[constants.INDEX_HEADER])
+        df = pd.DataFrame({column: arrays[column] for column in self.COLUMNS[1:]}, index=index)
+        df['Symbol'] = symbol
+        return df
+
+    def get_last_timestamp(self, symbol: str, timeframe: Timeframe):
+        series_directory = self._get_series_directory(symbol, timeframe)
+        years = sorted((int(directory.name) for directory in series_directory.glob('[0-9]*') if directory.is_dir()), reverse=True)
+        for year in years:
+            directory = get_npy_columns_directory(self._get_partition_directory(symbol, timeframe, year))
+            if directory:
+                timestamps = np.load(directory / f'{constants.INDEX_HEADER}.npy', mmap_mode='r')
+                if len(timestamps):
+                    return int(timestamps[-1])
+        return None
+
+    def get_stored_series(self) -> list:
+        series = []
+        for timeframe_directory in sorted(self.root_directory.glob(f'{Timeframe.TABLE_PREFIX}*')):
+            timeframe = Timeframe.from_string(timeframe_directory.name[len(Timeframe.TABLE_PREFIX):])
+            for series_directory in sorted(timeframe_directory.iterdir()):
+                if any(series_directory.glob(f'*/{NPY_CURRENT_FILE}')):
+                    series.append((unquote(series_directory.name), timeframe))
+        return series
+
+    def get_coverage(self, symbol: str, timeframe: Timeframe) -> list:
+        coverage_file = self._get_series_directory(symbol, timeframe) / 'coverage.json'
+        if not coverage_file.is_file():
+            return []
+        with open(coverage_file) as coverage_json:
+            return [tuple(interval) for interval in json.load(coverage_json)]
+
+    def add_coverage(self, symbol: str, timeframe: Timeframe, start_ms: int, end_ms: int) -> None:
+        coverage_file = self._get_series_directory(symbol, timeframe) / 'coverage.json'
+        with self._write_lock:
+            intervals = coverage.merge_intervals(self.get_coverage(symbol, timeframe) + [(start_ms, end_ms)])
+            coverage_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = coverage_file.with_name(coverage_file.name + '.tmp')
+            with open(temp_file, 'w') as coverage_json:
+                json.dump(intervals, coverage_json)
+            os.replace(temp_file, coverage_file)
+
+    def _merge_partition(self, directory: Path, columns: dict, replace: bool) -> int:
+        """merge new rows into a partition and return how many rows were added"""
+        existing_rows = 0
+        existing_directory = get_npy_columns_directory(directory)
+        if existing_directory:
+            existing = load_npy_columns(existing_directory, self.COLUMNS, mmap_mode=None)
+            existing_rows = len(existing[constants.INDEX_HEADER])
+            #np.unique keeps the first occurrence so put the rows that should win first
+            pieces = [columns, existing] if replace else [existing, columns]
+            columns = {column: np.concatenate([piece[column] for piece in pieces]) for column in self.COLUMNS}
+        timestamps, keep = np.unique(columns[constants.INDEX_HEADER], return_index=True)
+        columns = {column: values[keep] for column, values in columns.items()}
+        write_npy_columns(directory, columns)
+        return len(timestamps) - existing_rows
+
+    def _get_column_dtype(self, column: str):
+        return self.price_dtype if column in self.PRICE_COLUMNS else np.float64
+
+    def _get_partition_directory(self, symbol: str, timeframe: Timeframe, year: int) -> Path:
+        return self._get_series_directory(symbol, timeframe) / str(year)
+
+    def _get_series_directory(self, symbol: str, timeframe: Timeframe) -> Path:
+        return self.root_directory / timeframe.get_timeframe_table_name() / quote(symbol, safe='')
+
+    def get_root_directory(self):
+        return self.root_directory
+
+    def get_cache_source(self):
+        return ('npy', os.path.abspath(self.root_directory))
+
+    def get_data_version(self):
+        version_file = self.root_directory / self.VERSION_FILE
+        return version_file.read_text() if version_file.is_file() else ''
+
+    def _write_data_version(self):
+        #a new random version on every store so other objects and processes see the data changed
+        version_file = self.root_directory / self.VERSION_FILE
+        version_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = version_file.with_name(version_file.name + '.tmp')
+        temp_file.write_text(uuid.uuid4().hex)
+        os.replace(temp_file, version_file)
+
+
+def get_file_signature(file):
+    """(modification time, size) of file or None if it doesn't exist"""
+    try:
+        stat = os.stat(file)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def write_npy_columns(directory: Path, columns: dict) -> None:
+    """write each column to <directory>/<generation>/<column>.npy under a new generation and then switch
+    <directory>/current to it so readers never see a partially written set. Nothing that may still be memory
+    mapped is renamed. Older generations are removed if they can be, which on windows waits until their
+    memory maps are released, so any left over are removed by a later write"""
+    directory = Path(directory)
+    generation = uuid.uuid4().hex
+    (directory / generation).mkdir(parents=True)
+    for column, values in columns.items():
+        np.save(directory / generation / f'{column}.npy', values)
+    temp_file = directory / (NPY_CURRENT_FILE + '.tmp')
+    temp_file.write_text(generation)
+    os.replace(temp_file, directory / NPY_CURRENT_FILE)
+    for old_directory in directory.iterdir():
+        if old_directory.is_dir() and old_directory.name != generation:
+            shutil.rmtree(old_directory, ignore_errors=True)
+
+def get_npy_columns_directory(directory: Path):
+    """directory holding the current generation of columns written by write_npy_columns to directory
+    or None if nothing was written to it"""
+    try:
+        generation = (Path(directory) / NPY_CURRENT_FILE).read_text()
+    except FileNotFoundError:
+        return None
+    return Path(directory) / generation
+
+def load_npy_columns(directory: Path, columns: list, mmap_mode: str='r') -> dict:
+    """load columns from a directory returned by get_npy_columns_directory. By default the files are memory mapped read only"""
+    return {column: np.load(Path(directory) / f'{column}.npy', mmap_mode=mmap_mode) for column in columns}
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Convert text timestamps in an ohlcv sqlite database to epoch milliseconds')
+    arg_parser.add_argument('database_file', nargs='?', default=None, help='database to migrate. Default is ohlcv_data/ohlcv_sqlite.db')
+    args = arg_parser.parse_args()
+    with SQLite3OHLCVDatabase(database_file=args.database_file) as database:
+        for table, rows in database.migrate_timestamps_to_epoch_ms().items():
+            print(f'{table}: converted {rows} rows')
@@ -13,15 +13,52 @@ from rba_tools.retriever.timeframe import Timeframe
 import rba_tools.retriever.database_interface as dbi
 import rba_tools.retriever.retrievers as retrievers
 import rba_tools.retriever.constants as constants
+import rba_tools.retriever.coverage as coverage
+import rba_tools.retriever.resample as resample
+from rba_tools.retriever.cache import FetchCache
+from rba_tools.retriever.compact import to_compact, concat_compact
+from rba_tools.retriever.merge import merge_ohlcv
+from rba_tools.retriever.instrumentation import Metrics, NULL_METRICS
+import rba_tools.retriever.validation as validation
+from rba_tools.exceptions import OHLCVValidationError
+import numpy as np
 import pandas as pd
 
 
 class DataPuller:
 
-    def __init__(self, stored_retriever: Type[retrievers.OHLCVDataRetriever]=None, online_retriever: Type[retrievers.OHLCVDataRetriever]=None, database: Type[dbi.OHLCVDatabaseInterface]=None):
+    def __init__(self, stored_retriever: Type[retrievers.OHLCVDataRetriever]=None, online_retriever: Type[retrievers.OHLCVDataRetriever]=None, database: Type[dbi.OHLCVDatabaseInterface]=None, base_timeframes: list=None,
+                 cache: FetchCache=None, cache_source=None, compact: bool=False, strict: bool=False, metrics: Metrics=None):
+        """base_timeframes are timeframe strings, e.g. ['1h'], that any multiple of them is built from locally
+        instead of being pulled from the online retriever.
+        cache is an optional FetchCache of fetched dataframes which may be shared by several pullers. Entries are
+        keyed by cache_source, which defaults to the database's get_cache_source() so pullers reading the same database
+        files share them. Entries are dropped when the database is written to or closed, and when its data version shows
+        it was written by another object or process.
+        compact returns dataframes in the compact layout with a categorical Symbol and float32 prices.
+        strict validates fetched data and raises OHLCVValidationError if it has duplicated, unsorted,
+        misaligned or invalid bars.
+        metrics is an optional instrumentation.Metrics that records the time spent in each stage of a fetch"""
         self.stored_retriever = stored_retriever
         self.online_retriever = online_retriever
         self.database = database
+        self.base_timeframes = [Timeframe.from_string(timeframe) for timeframe in base_timeframes] if base_timeframes else []
+        self.cache = cache
+        if cache_source is None:
+            #without a database the entries belong to this puller alone
+            cache_source = database.get_cache_source() if database else object()
+        self.cache_source = cache_source
+        if cache and database:
+            database.add_cache(cache, cache_source)
+        self.compact = compact
+        self.strict = strict
+        self.metrics = metrics or NULL_METRICS
+
+    def set_metrics(self, metrics: Metrics):
+        """record metrics for this puller, its retrievers and its database"""
+        for component in [self, self.stored_retriever, self.online_retriever, self.database]:
+            if component is not None:
+                component.metrics = metrics
 
     @classmethod
     def binance_and_sqlite_puller(cls):
@@ -38,63 +75,278 @@ class DataPuller:
 
     def fetch_df(self, symbol: str, timeframe_str: str, from_date_str: str, to_date_str: str=None):
         """grabs a pandas dataframe from the stored database if possible and from online otherwise"""
+        timeframe, from_date, to_date = self.parse_fetch_args(timeframe_str, from_date_str, to_date_str)
+        return self.format_output(self.fetch_timeframe_df(symbol, timeframe, from_date, to_date), symbol, timeframe)
+
+    def fetch_many(self, symbols: list, timeframe_str: str, from_date_str: str, to_date_str: str=None, as_frame: bool=False):
+        """fetch_df for several symbols at once. Stored data for every symbol is read with one fetch_many_ohlcv call
+        and symbols missing the same range are pulled together so the online retriever can overlap the pulls.
+        Returns a dict of symbol to dataframe, or one dataframe sorted by symbol then timestamp if as_frame is True"""
+        timeframe, from_date, to_date = self.parse_fetch_args(timeframe_str, from_date_str, to_date_str)
+        frames = {symbol: self.format_output(data, symbol, timeframe) for symbol, data in self.fetch_many_timeframe_df(symbols, timeframe, from_date, to_date).items()}
+        if not as_frame:
+            return frames
+        #each frame is already time ordered so ordering the frames by symbol orders the result
+        ordered_frames = [frames[symbol] for symbol in sorted(frames)]
+        if self.compact:
+            return concat_compact(ordered_frames)
+        return pd.concat(ordered_frames) if ordered_frames else constants.empty_ohlcv_df_generator()
+
+    def format_output(self, data: pd.DataFrame, symbol: str, timeframe: Timeframe) -> pd.DataFrame:
+        """validate data returned to the caller if the puller is strict and convert it to
+        the compact layout if the puller is compact"""
+        if self.strict:
+            report = validation.validate_ohlcv(data, timeframe, symbol=symbol)
+            if not report.is_valid():
+                raise OHLCVValidationError(report)
+        return to_compact(data) if self.compact else data
+
+    def parse_fetch_args(self, timeframe_str: str, from_date_str: str, to_date_str: str=None):
+        """returns the timeframe, from date and to date for fetch string arguments. to_date defaults to yesterday"""
         timeframe = Timeframe.from_string(timeframe_str)
         from_date = parser.parse(from_date_str).date()
         to_date = parser.parse(to_date_str).date() if to_date_str else datetime.utcnow().date() - timedelta(days=1)
+        return (timeframe, from_date, to_date)
+
+    def fetch_timeframe_df(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
+        """fetch_df for an already parsed timeframe and dates"""
+        self.metrics.count('puller.calls', symbol=symbol, timeframe=str(timeframe))
+        with self.metrics.timer('puller.fetch', symbol=symbol, timeframe=str(timeframe)):
+            return self._fetch_timeframe_df(symbol, timeframe, from_date, to_date)
+
+    def _fetch_timeframe_df(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
+        if self.cache:
+            self.check_cache_version()
+            start_ms, end_ms = coverage.date_range_to_interval(from_date, to_date)
+            cached_data = self.cache.get(self.get_cache_key(symbol, timeframe), start_ms, end_ms)
+            if cached_data is not None:
+                self.metrics.count('puller.cache_hits', symbol=symbol, timeframe=str(timeframe))
+                return cached_data
+            self.metrics.count('puller.cache_misses', symbol=symbol, timeframe=str(timeframe))
+
+        all_data = self.fetch_uncached_timeframe_df(symbol, timeframe, from_date, to_date)
+
+        if self.cache:
+            #record the version after our own stores so they don't drop the entry on the next fetch
+            self.check_cache_version()
+            #bars that haven't closed yet may still change so the range after them isn't cached
+            self.cache.put(self.get_cache_key(symbol, timeframe), all_data, start_ms,
+                           min(end_ms, self._get_last_closed_bar_end_ms(timeframe)))
+        return all_data
+
+    def fetch_uncached_timeframe_df(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
+        """fetch_timeframe_df without reading or filling the cache"""
         all_data = constants.empty_ohlcv_df_generator()
 
         #retrieve data from stored database if we have one
         if self.stored_retriever:
-            all_data = self.stored_retriever.fetch_ohlcv(symbol, timeframe, from_date, to_date)
+            with self.metrics.timer('puller.stored_fetch', symbol=symbol, timeframe=str(timeframe)):
+                all_data = self.stored_retriever.fetch_ohlcv(symbol, timeframe, from_date, to_date)
+            self.metrics.count('puller.stored_rows', len(all_data), symbol=symbol, timeframe=str(timeframe))
 
-        all_data = self.pull_missed_data(all_data, symbol, timeframe, from_date, to_date)
+        return self.pull_missed_data(all_data, symbol, timeframe, from_date, to_date)
 
-        return all_data
+    def iter_df(self, symbol: str, timeframe_str: str, from_date_str: str, to_date_str: str=None, chunksize: int=constants.DEFAULT_CHUNKSIZE):
+        """yields the data fetch_df would return as time ordered dataframes of at most chunksize rows.
+        The range is fetched in windows of whole days holding about chunksize bars, pulling and storing missing
+        data one window at a time, so memory use doesn't grow with the length of the range. The cache isn't used
+        so streaming a long range doesn't evict everything else from it"""
+        timeframe, from_date, to_date = self.parse_fetch_args(timeframe_str, from_date_str, to_date_str)
+        for window_from_date, window_to_date in coverage.get_chunk_date_ranges(from_date, to_date, timeframe, chunksize):
+            window_data = self.fetch_uncached_timeframe_df(symbol, timeframe, window_from_date, window_to_date)
+            for chunk in retrievers.iter_row_chunks(window_data, chunksize):
+                yield self.format_output(chunk, symbol, timeframe)
+
+    def fetch_many_timeframe_df(self, symbols: list, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        """fetch_many for an already parsed timeframe and dates"""
+        symbols = list(dict.fromkeys(symbols))
+        for symbol in symbols:
+            self.metrics.count('puller.calls', symbol=symbol, timeframe=str(timeframe))
+        with self.metrics.timer('puller.fetch', timeframe=str(timeframe)):
+            return self._fetch_many_timeframe_df(symbols, timeframe, from_date, to_date)
+
+    def _fetch_many_timeframe_df(self, symbols: list, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        frames = {}
+        if self.cache:
+            self.check_cache_version()
+            start_ms, end_ms = coverage.date_range_to_interval(from_date, to_date)
+            for symbol in symbols:
+                cached_data = self.cache.get(self.get_cache_key(symbol, timeframe), start_ms, end_ms)
+                if cached_data is not None:
+                    frames[symbol] = cached_data
+            self.metrics.count('puller.cache_hits', len(frames), timeframe=str(timeframe))
+            self.metrics.count('puller.cache_misses', len(symbols) - len(frames), timeframe=str(timeframe))
+        fetch_symbols = [symbol for symbol in symbols if symbol not in frames]
+        if not fetch_symbols:
+            return {symbol: frames[symbol] for symbol in symbols}
+
+        if self.stored_retriever:
+            with self.metrics.timer('puller.stored_fetch', timeframe=str(timeframe)):
+                stored_frames = self.stored_retriever.fetch_many_ohlcv(fetch_symbols, timeframe, from_date, to_date)
+            self.metrics.count('puller.stored_rows', sum(len(data) for data in stored_frames.values()), timeframe=str(timeframe))
+        else:
+            stored_frames = {symbol: constants.empty_ohlcv_df_generator() for symbol in fetch_symbols}
+
+        if self.get_base_timeframe(timeframe):
+            #derived bars are built per symbol from the base timeframe
+            for symbol in fetch_symbols:
+                frames[symbol] = self.pull_missed_data(stored_frames[symbol], symbol, timeframe, from_date, to_date)
+        else:
+            pieces = {symbol: [stored_frames[symbol]] for symbol in fetch_symbols}
+            for (missing_from_date, missing_to_date), range_symbols in self.get_many_missing_date_ranges(stored_frames, timeframe, from_date, to_date).items():
+                pulled_frames = self.online_many_pull(range_symbols, timeframe, missing_from_date, missing_to_date)
+                for symbol in range_symbols:
+                    pieces[symbol].append(pulled_frames[symbol])
+            for symbol in fetch_symbols:
+                frames[symbol] = self.merge_pulled_data(pieces[symbol])
+
+        if self.cache:
+            self.check_cache_version()
+            cache_end_ms = min(end_ms, self._get_last_closed_bar_end_ms(timeframe))
+            for symbol in fetch_symbols:
+                self.cache.put(self.get_cache_key(symbol, timeframe), frames[symbol], start_ms, cache_end_ms)
+        return {symbol: frames[symbol] for symbol in symbols}
+
+    def get_cache_key(self, symbol: str, timeframe: Timeframe) -> tuple:
+        return (self.cache_source, symbol, timeframe)
+
+    def check_cache_version(self):
+        """drop the cached entries of the database if another object or process wrote to it since the last check"""
+        if self.database:
+            self.cache.check_version(self.cache_source, self.database.get_data_version())
 
     def pull_missed_data(self, stored_data: pd.DataFrame, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
         """pull any missing data from self.online_retriever"""
-        all_data = stored_data
-        prior_pull_end_date = self._get_new_end_date(all_data, from_date, to_date)
-        if prior_pull_end_date:
-            online_data = self.online_pull(symbol, timeframe, from_date, prior_pull_end_date)
-            all_data = all_data.append(online_data).sort_index()
-
-        post_pull_from_date = self._get_new_from_date(all_data, to_date)
-        if post_pull_from_date:
-            online_data = self.online_pull(symbol, timeframe, post_pull_from_date, to_date)
-            all_data = all_data.append(online_data).sort_index()
-        return all_data
+        pieces = [stored_data]
+        base_timeframe = self.get_base_timeframe(timeframe)
+        for missing_from_date, missing_to_date in self.get_missing_date_ranges(stored_data, symbol, timeframe, from_date, to_date):
+            if base_timeframe:
+                pieces.append(self.derive_pull(symbol, timeframe, base_timeframe, missing_from_date, missing_to_date))
+            else:
+                pieces.append(self.online_pull(symbol, timeframe, missing_from_date, missing_to_date))
+        return self.merge_pulled_data(pieces)
+
+    def merge_pulled_data(self, pieces: list):
+        """combine stored data, which is the first piece, with pulled data"""
+        with self.metrics.timer('puller.merge'):
+            #pulls are made in whole days so they can overlap stored bars. Keep the stored bars
+            return merge_ohlcv(pieces, keep='first')
+
+    def get_many_missing_date_ranges(self, frames: dict, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        """returns a dict of missing (from_date, to_date) range to the symbols of frames that are missing it"""
+        symbols_by_range = {}
+        for symbol, data in frames.items():
+            for date_range in self.get_missing_date_ranges(data, symbol, timeframe, from_date, to_date):
+                symbols_by_range.setdefault(date_range, []).append(symbol)
+        return symbols_by_range
+
+    def get_missing_date_ranges(self, data: pd.DataFrame, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
+        """returns the inclusive (from_date, to_date) ranges that are neither recorded as complete
+        in the database nor spanned by consecutive bars in data"""
+        start_ms, end_ms = coverage.date_range_to_interval(from_date, to_date)
+        bar_ms = timeframe.get_bar_ms()
+        covered = coverage.get_data_intervals(constants.datetime_index_to_epoch_ms(data.index), bar_ms)
+        if self.database:
+            covered.extend(self.database.get_coverage(symbol, timeframe))
+        missing = coverage.subtract_intervals(start_ms, end_ms, covered)
+        return coverage.intervals_to_date_ranges(missing)
 
     def online_pull(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
         """perform a data pull from the online_retriever"""
         if not self.online_retriever:
             return constants.empty_ohlcv_df_generator()
-        online_data = self.online_retriever.fetch_ohlcv(symbol, timeframe, from_date, to_date)
+        with self.metrics.timer('puller.online_pull', symbol=symbol, timeframe=str(timeframe)):
+            online_data = self.online_retriever.fetch_ohlcv(symbol, timeframe, from_date, to_date)
+        self.metrics.count('puller.online_rows', len(online_data), symbol=symbol, timeframe=str(timeframe))
         self.store_dataframe(online_data, timeframe)
+        self.store_coverage(symbol, timeframe, from_date, to_date)
         return online_data
 
+    def online_many_pull(self, symbols: list, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        """perform one pull of several symbols from the online_retriever"""
+        if not self.online_retriever:
+            return {symbol: constants.empty_ohlcv_df_generator() for symbol in symbols}
+        with self.metrics.timer('puller.online_pull', timeframe=str(timeframe)):
+            online_frames = self.online_retriever.fetch_many_ohlcv(symbols, timeframe, from_date, to_date)
+        self.metrics.count('puller.online_rows', sum(len(data) for data in online_frames.values()), timeframe=str(timeframe))
+        for symbol in symbols:
+            self.store_dataframe(online_frames[symbol], timeframe)
+            self.store_coverage(symbol, timeframe, from_date, to_date)
+        return online_frames
+
     def store_dataframe(self, data: pd.DataFrame, timeframe: Timeframe):
+        #the database drops its entries from the cache when it's written
+        if self.database:
+            with self.metrics.timer('puller.store', timeframe=str(timeframe)):
+                self.database.store_dataframe(data, timeframe)
+
+    def store_coverage(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date):
+        """record that the database holds everything the online retriever has for the range.
+        Bars that haven't closed yet are left out so they are pulled again later"""
+        if not self.database:
+            return
+        start_ms, end_ms = coverage.date_range_to_interval(from_date, to_date)
+        end_ms = min(end_ms, self._get_last_closed_bar_end_ms(timeframe))
+        if start_ms < end_ms:
+            self.database.add_coverage(symbol, timeframe, start_ms, end_ms)
+
+    def get_base_timeframe(self, timeframe: Timeframe):
+        """returns the largest base timeframe that timeframe can be built from, or None"""
+        base_timeframes = [base for base in self.base_timeframes if resample.can_derive(timeframe, base)]
+        return max(base_timeframes, key=lambda base: base.get_timeframe_seconds(), default=None)
+
+    def derive_pull(self, symbol: str, timeframe: Timeframe, base_timeframe: Timeframe, from_date: date, to_date: date):
+        """build timeframe bars from base_timeframe bars and store them the same way as an online pull.
+        The base data is fetched with fetch_timeframe_df so it is pulled online and stored if it's missing"""
+        start_ms, end_ms = coverage.date_range_to_interval(from_date, to_date)
+        bar_ms = timeframe.get_bar_ms()
+        #widen the range to whole bars, e.g. whole weeks for weekly bars
+        derive_start_ms = int(timeframe.floor_ms(start_ms))
+        derive_end_ms = int(timeframe.ceil_ms(end_ms))
+        base_data = self.fetch_timeframe_df(symbol, base_timeframe, coverage.epoch_ms_to_date(derive_start_ms),
+                                            coverage.epoch_ms_to_date(derive_end_ms - 1))
+        base_timestamps = constants.datetime_index_to_epoch_ms(base_data.index)
+        in_range = (base_timestamps >= derive_start_ms) & (base_timestamps < derive_end_ms)
+        base_data = base_data.loc[in_range]
+
+        with self.metrics.timer('puller.resample', symbol=symbol, timeframe=str(timeframe)):
+            derived_data = resample.resample_ohlcv(base_data, timeframe)
+        closed_end_ms = min(derive_end_ms, self._get_last_closed_bar_end_ms(timeframe))
+        derived_timestamps = constants.datetime_index_to_epoch_ms(derived_data.index)
+        derived_data = derived_data.loc[derived_timestamps + bar_ms <= closed_end_ms]
+
+        #only bars built from complete base data are stored and covered so the rest are built again as the base grows
+        complete_intervals = self.get_derived_intervals(symbol, timeframe, base_timeframe, base_timestamps[in_range], derive_start_ms, closed_end_ms)
+        derived_timestamps = constants.datetime_index_to_epoch_ms(derived_data.index)
+        is_complete = np.zeros(len(derived_data), dtype=bool)
+        for interval_start_ms, interval_end_ms in complete_intervals:
+            is_complete |= (derived_timestamps >= interval_start_ms) & (derived_timestamps + bar_ms <= interval_end_ms)
+        self.store_dataframe(derived_data.loc[is_complete], timeframe)
         if self.database:
-            self.database.store_dataframe(data, timeframe)
-
-    def _get_new_end_date(self, data: pd.DataFrame, from_date: date, to_date: date):
-        """returns the new end_date if a prior data pull is necessary"""
-        check_date = constants.create_midnight_datetime_from_date(from_date)
-        if data.empty:
-            return to_date
-        if check_date not in data.index:
-            return min(data.index) - timedelta(days=1)
-        return None
-
-
-    def _get_new_from_date(self, data: pd.DataFrame, to_date: date):
-        """returns the new from_date if a post data pull is necessary"""
-        check_date = constants.create_midnight_datetime_from_date(to_date)
-        if data.empty:
-            return None
-        if check_date not in data.index:
-            return max(data.index) + timedelta(days=1)
-        return None
+            for interval_start_ms, interval_end_ms in complete_intervals:
+                self.database.add_coverage(symbol, timeframe, interval_start_ms, interval_end_ms)
+
+        derived_timestamps = constants.datetime_index_to_epoch_ms(derived_data.index)
+        return derived_data.loc[(derived_timestamps >= start_ms) & (derived_timestamps < end_ms)]
+
+    def get_derived_intervals(self, symbol: str, timeframe: Timeframe, base_timeframe: Timeframe, base_timestamps, start_ms: int, end_ms: int) -> list:
+        """returns the intervals within [start_ms, end_ms), cut to whole timeframe bars, that the base timeframe
+        has complete data for, either as consecutive base bars or as recorded base coverage"""
+        base_intervals = coverage.get_data_intervals(base_timestamps, base_timeframe.get_bar_ms())
+        if self.database:
+            base_intervals.extend(self.database.get_coverage(symbol, base_timeframe))
+        derived_intervals = []
+        for interval_start_ms, interval_end_ms in coverage.merge_intervals(base_intervals):
+            interval_start_ms = max(start_ms, int(timeframe.ceil_ms(interval_start_ms)))
+            interval_end_ms = min(end_ms, int(timeframe.floor_ms(interval_end_ms)))
+            if interval_start_ms < interval_end_ms:
+                derived_intervals.append((interval_start_ms, interval_end_ms))
+        return derived_intervals
+
+    def _get_last_closed_bar_end_ms(self, timeframe: Timeframe) -> int:
+        """end of the most recent bar of timeframe that has closed"""
+        now_ms = constants.datetime_to_epoch_ms(datetime.utcnow())
+        return int(timeframe.floor_ms(now_ms))
 
 
 if __name__ == '__main__':
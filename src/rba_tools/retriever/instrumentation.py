@@ -0,0 +1,168 @@
+"""Metrics and timing hooks for retrievers, DataPuller and databases
+
+Retrievers, databases and DataPuller have a metrics attribute that defaults to the disabled
+NULL_METRICS. Replace it with Metrics(sink) to record events. Each event is a dict with a
+name, a kind of 'count' or 'timing', a value (seconds for timings), the epoch time and any
+tags, e.g. {'name': 'retriever.network', 'kind': 'timing', 'value': 0.31, 'time': ..., 'symbol': 'ETH/BTC'}
+
+Events are named <component>.<stage>:
+    retriever.network, retriever.rate_limit_sleep, retriever.parse -- timings
+    retriever.calls, retriever.rows, retriever.requests, retriever.bytes_parsed -- counts
+    database.query, database.store -- timings
+    database.rows_returned, database.rows_stored -- counts
+    puller.fetch, puller.stored_fetch, puller.online_pull, puller.resample, puller.merge, puller.store -- timings
+    puller.calls, puller.cache_hits, puller.cache_misses, puller.stored_rows, puller.online_rows -- counts
+
+retriever.calls counts fetch_ohlcv calls and retriever.requests the requests made to an exchange.
+puller.fetch covers a whole fetch so the other puller stages are part of it, and derived
+timeframes fetch their base timeframe through puller.fetch as well.
+
+    metrics = Metrics(InMemorySink())
+    puller.set_metrics(metrics)
+    puller.fetch_df('ETH/BTC', '1h', '2020-12-1')
+    print(metrics.sink.get_summary())
+"""
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import nullcontext
+from pathlib import Path
+import pandas as pd
+
+_NULL_TIMER = nullcontext()
+
+
+class MetricsSink(ABC):
+    """receives every recorded event"""
+
+    @abstractmethod
+    def record(self, event: dict):
+        """handles one event"""
+
+    def close(self):
+        """releases any resources held by the sink"""
+
+
+class NullSink(MetricsSink):
+    """discards every event"""
+
+    def record(self, event: dict):
+        pass
+
+
+class LoggingSink(MetricsSink):
+    """logs each event as one line"""
+
+    def __init__(self, logger: logging.Logger=None, level: int=logging.INFO):
+        self.logger = logger or logging.getLogger('rba_tools.metrics')
+        self.level = level
+
+    def record(self, event: dict):
+        if self.logger.isEnabledFor(self.level):
+            tags = ' '.join(f'{key}={value}' for key, value in event.items() if key not in ('name', 'kind', 'value', 'time'))
+            self.logger.log(self.level, '%s %s %s %s', event['name'], event['kind'], event['value'], tags)
+
+
+class InMemorySink(MetricsSink):
+    """keeps totals per event name. Counts are summed and timings keep their number, total and maximum"""
+
+    def __init__(self):
+        self.counters = {}
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def record(self, event: dict):
+        name, value = event['name'], event['value']
+        with self._lock:
+            if event['kind'] == 'count':
+                self.counters[name] = self.counters.get(name, 0) + value
+            else:
+                count, total, maximum = self.timings.get(name, (0, 0.0, 0.0))
+                self.timings[name] = (count + 1, total + value, max(maximum, value))
+
+    def get_count(self, name: str):
+        return self.counters.get(name, 0)
+
+    def get_timing(self, name: str) -> dict:
+        count, total, maximum = self.timings.get(name, (0, 0.0, 0.0))
+        return {'count': count, 'total_seconds': total, 'max_seconds': maximum}
+
+    def get_summary(self) -> pd.DataFrame:
+        """dataframe of every timing by name, slowest stage first"""
+        with self._lock:
+            timings = dict(self.timings)
+        summary = pd.DataFrame.from_dict(timings, orient='index', columns=['count', 'total_seconds', 'max_seconds'])
+        summary['mean_seconds'] = summary['total_seconds'] / summary['count']
+        return summary.sort_values('total_seconds', ascending=False)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+
+
+class JSONLinesSink(MetricsSink):
+    """appends each event to a file as a line of json"""
+
+    def __init__(self, file):
+        self.file = Path(file)
+        self._handle = None
+        self._lock = threading.Lock()
+
+    def record(self, event: dict):
+        line = json.dumps(event, default=str) + '\n'
+        with self._lock:
+            if self._handle is None:
+                self._handle = open(self.file, 'a', encoding='utf-8')
+            self._handle.write(line)
+            self._handle.flush()
+
+    def close(self):
+        with self._lock:
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+
+class Metrics:
+    """records counts and timings to a sink. Without a sink nothing is recorded and timer()
+    returns a shared no-op context manager so instrumented code costs a method call"""
+
+    def __init__(self, sink: MetricsSink=None):
+        self.sink = sink
+        self.enabled = sink is not None and not isinstance(sink, NullSink)
+
+    def count(self, name: str, value=1, **tags):
+        if self.enabled:
+            self.sink.record({'name': name, 'kind': 'count', 'value': value, 'time': time.time(), **tags})
+
+    def timing(self, name: str, seconds: float, **tags):
+        if self.enabled:
+            self.sink.record({'name': name, 'kind': 'timing', 'value': seconds, 'time': time.time(), **tags})
+
+    def timer(self, name: str, **tags):
+        """context manager that records the time spent inside it as a timing"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, tags)
+
+
+class _Timer:
+
+    def __init__(self, metrics: Metrics, name: str, tags: dict):
+        self.metrics = metrics
+        self.name = name
+        self.tags = tags
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.timing(self.name, time.perf_counter() - self.start, **self.tags)
+
+
+NULL_METRICS = Metrics()
@@ -0,0 +1,155 @@
+"""Bulk import of Kraken OHLCVT zip archives into an OHLCVDatabaseInterface
+
+Archive members are parsed in a process pool and written by the calling process
+through the database's bulk store. Imported members are recorded in a state file
+by name, CRC and size so an interrupted import can be resumed and Kraken's
+incremental zips only import the members that changed.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from time import perf_counter
+from typing import Type
+from zipfile import ZipFile
+import numpy as np
+import pandas as pd
+from rba_tools.retriever.timeframe import Timeframe
+import rba_tools.retriever.database_interface as dbi
+import rba_tools.retriever.constants as constants
+
+logger = logging.getLogger(__name__)
+
+#checked in order so the longer quotes are matched before USD
+KRAKEN_QUOTE_CURRENCIES = ['USDT', 'USDC', 'USD', 'EUR', 'GBP', 'CAD', 'JPY', 'CHF', 'AUD', 'XBT', 'ETH', 'DAI', 'DOT']
+
+def kraken_pair_to_symbol(pair: str) -> str:
+    """converts a kraken pair like ETHUSD to a symbol like ETH/USD"""
+    for quote in KRAKEN_QUOTE_CURRENCIES:
+        if pair.endswith(quote) and len(pair) > len(quote):
+            return pair[:-len(quote)] + '/' + quote
+    return pair
+
+def parse_kraken_member_name(member_name: str):
+    """returns the (symbol, timeframe) of a member name like ETHUSD_60.csv"""
+    pair, minutes = Path(member_name).stem.rsplit('_', 1)
+    return (kraken_pair_to_symbol(pair), Timeframe.from_seconds(int(minutes) * 60))
+
+def read_kraken_member(kraken_file: str, member_name: str) -> pd.DataFrame:
+    """parse one archive member into the standard ohlcv dataframe format. Runs in worker processes"""
+    symbol, _ = parse_kraken_member_name(member_name)
+    columns = [constants.INDEX_HEADER, 'Open', 'High', 'Low', 'Close', 'Volume']
+    with ZipFile(kraken_file) as kraken_zip_file:
+        data = pd.read_csv(kraken_zip_file.open(member_name), header=None, usecols=range(len(columns)),
+                           names=columns, dtype={constants.INDEX_HEADER: np.int64})
+    data.index = constants.epoch_ms_to_datetime_index(data.pop(constants.INDEX_HEADER).to_numpy() * 1000)
+    data['Symbol'] = symbol
+    return data
+
+
+class KrakenArchiveImporter:
+    """imports every member of a Kraken OHLCVT zip archive into a database"""
+
+    def __init__(self, database: Type[dbi.OHLCVDatabaseInterface], state_file: str, max_workers: int=None, replace: bool=False):
+        """
+        Parameters:
+            database (OHLCVDatabaseInterface) -- database to store the data in
+            state_file (str) -- json file that records which members have been imported
+            max_workers (int) -- number of parsing processes. Default is the number of cpus
+            replace (bool) -- overwrite rows that are already stored instead of skipping them
+        """
+        self.database = database
+        self.state_file = Path(state_file)
+        self.max_workers = max_workers
+        self.replace = replace
+
+    def import_archive(self, kraken_file: str, timeframes: list=None) -> dict:
+        """import all members of kraken_file that haven't been imported yet. timeframes optionally
+        limits the import to a list of timeframe strings. Returns a summary of the import"""
+        imported = self.load_state()
+        pending = self.get_pending_members(kraken_file, imported, timeframes)
+        summary = {'members': 0, 'rows': 0, 'new_rows': 0, 'seconds': 0.0}
+        start_time = perf_counter()
+        if pending:
+            max_workers = self.max_workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                remaining = iter(pending)
+                in_flight = {}
+                while True:
+                    #limit queued results so memory stays bounded when storing is slower than parsing
+                    for member_name, member_key in itertools.islice(remaining, max_workers * 2 - len(in_flight)):
+                        in_flight[executor.submit(read_kraken_member, kraken_file, member_name)] = (member_name, member_key)
+                    if not in_flight:
+                        break
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        member_name, member_key = in_flight.pop(future)
+                        data = future.result()
+                        _, timeframe = parse_kraken_member_name(member_name)
+                        new_rows = self.database.bulk_store_dataframe(data, timeframe, replace=self.replace)
+                        imported[member_key] = len(data)
+                        self.save_state(imported)
+                        summary['members'] += 1
+                        summary['rows'] += len(data)
+                        summary['new_rows'] += new_rows
+                        self.report_progress(summary, len(pending), member_name, start_time)
+        summary['seconds'] = perf_counter() - start_time
+        logger.info('Imported %d members, %d rows (%d new) in %.1fs, %.0f rows/s', summary['members'], summary['rows'],
+                    summary['new_rows'], summary['seconds'], self._rows_per_second(summary['rows'], summary['seconds']))
+        return summary
+
+    def get_pending_members(self, kraken_file: str, imported: dict, timeframes: list=None) -> list:
+        """returns (member name, member key) for csv members that haven't been imported"""
+        timeframes = [Timeframe.from_string(timeframe) for timeframe in timeframes] if timeframes else None
+        pending = []
+        with ZipFile(kraken_file) as kraken_zip_file:
+            for info in kraken_zip_file.infolist():
+                if info.is_dir() or not info.filename.lower().endswith('.csv'):
+                    continue
+                member_key = f'{Path(info.filename).name}:{info.CRC:08x}:{info.file_size}'
+                if member_key in imported:
+                    continue
+                if timeframes and parse_kraken_member_name(info.filename)[1] not in timeframes:
+                    continue
+                pending.append((info.filename, member_key))
+        return pending
+
+    def report_progress(self, summary: dict, total_members: int, member_name: str, start_time: float):
+        elapsed = perf_counter() - start_time
+        logger.info('[%d/%d] %s: %d rows, %.0f rows/s', summary['members'], total_members, member_name,
+                    summary['rows'], self._rows_per_second(summary['rows'], elapsed))
+
+    def load_state(self) -> dict:
+        """map of imported member key to number of rows imported"""
+        if not self.state_file.is_file():
+            return {}
+        with open(self.state_file) as state:
+            return json.load(state)
+
+    def save_state(self, imported: dict):
+        temp_file = self.state_file.with_name(self.state_file.name + '.tmp')
+        with open(temp_file, 'w') as state:
+            json.dump(imported, state)
+        temp_file.replace(self.state_file)
+
+    def _rows_per_second(self, rows: int, seconds: float) -> float:
+        return rows / seconds if seconds else 0.0
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Import a Kraken OHLCVT zip archive into the ohlcv sqlite database')
+    arg_parser.add_argument('kraken_file', help='Kraken OHLCVT zip file. Incremental zips may be imported the same way')
+    arg_parser.add_argument('--database-file', default=None, help='sqlite database file. Default is ohlcv_data/ohlcv_sqlite.db')
+    arg_parser.add_argument('--state-file', default=None, help='import state file. Default is next to the database file')
+    arg_parser.add_argument('--workers', type=int, default=None, help='number of parsing processes')
+    arg_parser.add_argument('--timeframes', nargs='*', default=None, help='only import these timeframes, e.g. 1h 1d')
+    arg_parser.add_argument('--replace', action='store_true', help='overwrite rows that are already stored')
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    with dbi.SQLite3OHLCVDatabase(database_file=args.database_file) as database:
+        state_file = args.state_file or database.get_database_file() + '.kraken_import.json'
+        importer = KrakenArchiveImporter(database, state_file, max_workers=args.workers, replace=args.replace)
+        importer.import_archive(args.kraken_file, args.timeframes)
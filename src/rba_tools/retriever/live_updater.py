@@ -0,0 +1,189 @@
+"""Keeps an OHLCV database current with the newest closed candles of a watchlist
+
+LiveTailUpdater polls the exchange for the candles that closed since the last stored
+bar of each (symbol, timeframe) series and writes every poll's new candles with one
+bulk store per timeframe. The range up to the newest received candle is recorded as
+coverage so DataPuller doesn't pull it again.
+"""
+import argparse
+import logging
+import threading
+import time
+from typing import Type
+import ccxt
+import pandas as pd
+from rba_tools.retriever.timeframe import Timeframe
+import rba_tools.retriever.database_interface as dbi
+import rba_tools.retriever.constants as constants
+
+logger = logging.getLogger(__name__)
+
+
+class LiveTailUpdater:
+    """polls an exchange for newly closed candles and stores them in a database
+
+    run_once() performs a single poll of every series and can be called directly. start() runs
+    it on a background thread until stop() is called."""
+
+    def __init__(self, exchange, database: Type[dbi.OHLCVDatabaseInterface], symbols: list, timeframes: list,
+                 poll_interval: float=None, close_delay: float=5.0, initial_lookback_bars: int=720,
+                 page_limit: int=None, clock=time.time):
+        """
+        Parameters:
+            exchange (str or ccxt.Exchange) -- ccxt exchange id or a synchronous exchange object
+            database (OHLCVDatabaseInterface) -- database to store candles in
+            symbols (list) -- symbols to keep current, e.g. ['ETH/BTC']
+            timeframes (list) -- timeframe strings to keep current, e.g. ['1h', '1d']
+            poll_interval (float) -- seconds between polls. Default is to wait until the next candle closes
+            close_delay (float) -- seconds to wait after a candle closes before polling for it
+            initial_lookback_bars (int) -- bars to pull for a series that has nothing stored yet
+            page_limit (int) -- maximum candles to request per call. Default is the exchange's default
+            clock (callable) -- returns the current epoch seconds. Replaceable for testing
+        """
+        if isinstance(exchange, str):
+            exchange = getattr(ccxt, exchange)({'timeout': 30000, 'enableRateLimit': True})
+        self.exchange = exchange
+        self.database = database
+        self.symbols = list(symbols)
+        self.timeframes = [Timeframe.from_string(timeframe) for timeframe in timeframes]
+        self.poll_interval = poll_interval
+        self.close_delay = close_delay
+        self.initial_lookback_bars = initial_lookback_bars
+        self.page_limit = page_limit
+        self.clock = clock
+        self.last_timestamps = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> int:
+        """poll every series once and store the new closed candles. Returns the number of candles stored"""
+        stored = 0
+        for timeframe in self.timeframes:
+            closed_end_ms = self.get_last_closed_bar_end_ms(timeframe)
+            new_frames = []
+            polled_ranges = []
+            for symbol in self.symbols:
+                start_ms = self.get_next_bar_ms(symbol, timeframe)
+                if start_ms >= closed_end_ms:
+                    continue
+                try:
+                    data = self.fetch_closed_candles(symbol, timeframe, start_ms, closed_end_ms)
+                except ccxt.BaseError as error:
+                    #leave the series where it was so the next poll retries it
+                    logger.warning('Failed to poll %s %s from %s: %s', symbol, timeframe, self.exchange.id, error)
+                    continue
+                if data.empty:
+                    #the exchange hasn't published the candle yet
+                    continue
+                new_frames.append(data)
+                polled_ranges.append((symbol, start_ms, int(constants.datetime_index_to_epoch_ms(data.index[-1:])[0])))
+            if not polled_ranges:
+                continue
+            stored += self.store_candles(new_frames, timeframe)
+            for symbol, start_ms, last_ms in polled_ranges:
+                self.database.add_coverage(symbol, timeframe, start_ms, last_ms + timeframe.get_bar_ms())
+                self.last_timestamps[(symbol, timeframe)] = last_ms
+        return stored
+
+    def fetch_closed_candles(self, symbol: str, timeframe: Timeframe, start_ms: int, closed_end_ms: int) -> pd.DataFrame:
+        """page through the exchange's candles from start_ms keeping the ones that closed before closed_end_ms"""
+        pages = []
+        since = start_ms
+        while since < closed_end_ms:
+            page = self.exchange.fetch_ohlcv(symbol, str(timeframe).lower(), since=since, limit=self.page_limit)
+            page = [row for row in page if since <= row[0] < closed_end_ms]
+            if not page:
+                break
+            pages.extend(page)
+            since = page[-1][0] + timeframe.get_bar_ms()
+        header = [constants.INDEX_HEADER, 'Open', 'High', 'Low', 'Close', 'Volume']
+        data = pd.DataFrame(pages, columns=header)
+        data.index = constants.epoch_ms_to_datetime_index(data.pop(constants.INDEX_HEADER).to_numpy())
+        data['Symbol'] = symbol
+        return data
+
+    def store_candles(self, frames: list, timeframe: Timeframe) -> int:
+        """write the candles of every polled symbol with one bulk store"""
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return 0
+        data = pd.concat(frames)
+        self.database.bulk_store_dataframe(data, timeframe, replace=True)
+        return len(data)
+
+    def get_next_bar_ms(self, symbol: str, timeframe: Timeframe) -> int:
+        """start of the first bar that hasn't been stored, read from the database the first time a series is polled"""
+        bar_ms = timeframe.get_bar_ms()
+        key = (symbol, timeframe)
+        if key not in self.last_timestamps:
+            self.last_timestamps[key] = self.database.get_last_timestamp(symbol, timeframe)
+        if self.last_timestamps[key] is None:
+            return self.get_last_closed_bar_end_ms(timeframe) - self.initial_lookback_bars * bar_ms
+        return self.last_timestamps[key] + bar_ms
+
+    def get_last_closed_bar_end_ms(self, timeframe: Timeframe) -> int:
+        return int(timeframe.floor_ms(int(self.clock() * 1000)))
+
+    def get_seconds_until_next_poll(self) -> float:
+        """poll_interval if one was given, otherwise the time until the next candle of any timeframe closes"""
+        if self.poll_interval is not None:
+            return self.poll_interval
+        now_ms = int(self.clock() * 1000)
+        next_close_ms = min(self.get_last_closed_bar_end_ms(timeframe) + timeframe.get_bar_ms() for timeframe in self.timeframes)
+        return (next_close_ms - now_ms) / 1000 + self.close_delay
+
+    def run(self):
+        """poll until stop() is called"""
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as error:
+                #keep the updater alive through database or unexpected errors and retry on the next poll
+                logger.exception('Live update failed: %r', error)
+            self._stop_event.wait(self.get_seconds_until_next_poll())
+
+    def start(self):
+        """run the updater on a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name='LiveTailUpdater', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float=None):
+        """stop polling and wait for the current poll to finish"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Keep the ohlcv sqlite database current with the newest closed candles')
+    arg_parser.add_argument('exchange', help='ccxt exchange id, e.g. binance')
+    arg_parser.add_argument('--symbols', nargs='+', required=True, help='symbols to keep current, e.g. ETH/BTC')
+    arg_parser.add_argument('--timeframes', nargs='+', default=['1h'], help='timeframes to keep current, e.g. 1h 1d')
+    arg_parser.add_argument('--database-file', default=None, help='sqlite database file. Default is ohlcv_data/ohlcv_sqlite.db')
+    arg_parser.add_argument('--poll-interval', type=float, default=None, help='seconds between polls. Default is each candle close')
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    with dbi.SQLite3OHLCVDatabase(database_file=args.database_file) as database:
+        updater = LiveTailUpdater(args.exchange, database, args.symbols, args.timeframes, poll_interval=args.poll_interval)
+        updater.start()
+        try:
+            while updater.is_running():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            logger.info('Stopping live updates')
+        finally:
+            updater.stop()
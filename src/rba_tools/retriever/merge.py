@@ -0,0 +1,48 @@
+"""Single pass merge of OHLCV pieces
+
+A fetch is assembled from stored data plus the pieces pulled for each gap. merge_ohlcv
+concatenates all of them once. When every piece is sorted and the pieces don't overlap,
+which is the usual case for gap pulls, they are only put in order by their first bar
+and no rows are sorted. Otherwise rows are sorted once by timestamp and bars that appear
+in more than one piece are de-duplicated by piece precedence.
+"""
+import numpy as np
+import pandas as pd
+import rba_tools.retriever.constants as constants
+
+KEEP_OPTIONS = ('first', 'last')
+
+def merge_ohlcv(pieces: list, keep: str='first') -> pd.DataFrame:
+    """merge OHLCV dataframes of one symbol into one dataframe sorted by timestamp with unique bars.
+    keep='first' keeps the bar of the earliest piece where pieces share a timestamp and keep='last'
+    the bar of the latest piece, e.g. pass stored data first and keep='first' to prefer stored bars"""
+    if keep not in KEEP_OPTIONS:
+        raise ValueError(f'keep must be one of {KEEP_OPTIONS}, got {keep!r}')
+    pieces = list(pieces)
+    filled_pieces = [piece for piece in pieces if len(piece)]
+    if not filled_pieces:
+        return pieces[0] if pieces else constants.empty_ohlcv_df_generator()
+    piece_timestamps = [constants.datetime_index_to_epoch_ms(piece.index) for piece in filled_pieces]
+
+    if all(is_strictly_increasing(timestamps) for timestamps in piece_timestamps):
+        if len(filled_pieces) == 1:
+            return filled_pieces[0]
+        order = sorted(range(len(filled_pieces)), key=lambda position: piece_timestamps[position][0])
+        if all(piece_timestamps[previous][-1] < piece_timestamps[position][0] for previous, position in zip(order, order[1:])):
+            return pd.concat([filled_pieces[position] for position in order])
+
+    if keep == 'last':
+        filled_pieces, piece_timestamps = filled_pieces[::-1], piece_timestamps[::-1]
+    merged = pd.concat(filled_pieces)
+    timestamps = np.concatenate(piece_timestamps)
+    #a stable sort keeps rows with the same timestamp in piece order so the first of each is the one to keep
+    rows = np.argsort(timestamps, kind='stable')
+    sorted_timestamps = timestamps[rows]
+    first_of_timestamp = np.empty(len(rows), dtype=bool)
+    first_of_timestamp[:1] = True
+    np.not_equal(sorted_timestamps[1:], sorted_timestamps[:-1], out=first_of_timestamp[1:])
+    return merged.iloc[rows[first_of_timestamp]]
+
+def is_strictly_increasing(timestamps: np.ndarray) -> bool:
+    """True if every timestamp is after the previous one, i.e. sorted without duplicates"""
+    return bool(np.all(timestamps[1:] > timestamps[:-1]))
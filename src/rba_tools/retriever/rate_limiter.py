@@ -0,0 +1,54 @@
+"""Token bucket rate limiting shared by everything that calls the same exchange"""
+import asyncio
+import threading
+from time import monotonic
+from typing import ClassVar
+
+class TokenBucketRateLimiter:
+    """token bucket that holds up to capacity tokens and refills one token every interval seconds.
+
+    acquire() is a coroutine so waiting for a token doesn't block other requests on the event loop.
+    The bucket doesn't belong to an event loop so it can be shared by every asyncio.run call and thread."""
+    _exchange_limiters: ClassVar[dict] = {}
+    _exchange_limiters_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(self, interval: float, capacity: int=1):
+        self.interval = interval
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_exchange(cls, exchange_id: str, rate_limit_ms: float, capacity: int=1):
+        """returns the limiter shared by all requests to exchange_id with the same rate_limit_ms and capacity.
+        rate_limit_ms is ccxt's exchange.rateLimit. Callers passing different settings get separate limiters
+        so a setting is never silently ignored, but their requests aren't limited together"""
+        key = (exchange_id, rate_limit_ms, capacity)
+        with cls._exchange_limiters_lock:
+            if key not in cls._exchange_limiters:
+                cls._exchange_limiters[key] = cls(rate_limit_ms / 1000, capacity)
+            return cls._exchange_limiters[key]
+
+    async def acquire(self) -> float:
+        """waits until a token is available and takes it. Returns the seconds spent waiting"""
+        waited = 0.0
+        while True:
+            wait_time = self.try_acquire()
+            if wait_time == 0:
+                return waited
+            await asyncio.sleep(wait_time)
+            waited += wait_time
+
+    def try_acquire(self) -> float:
+        """takes a token if one is available and returns 0, otherwise returns the seconds until one is"""
+        with self._lock:
+            now = monotonic()
+            if self.interval <= 0:
+                return 0
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) / self.interval)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) * self.interval
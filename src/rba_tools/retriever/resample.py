@@ -0,0 +1,33 @@
+"""Builds higher timeframe OHLCV bars from lower timeframe bars
+
+Bars are aligned to UTC boundaries by Timeframe.floor_ms: every timeframe is aligned to
+the unix epoch except multiples of a week which start on Monday 00:00 UTC.
+"""
+import numpy as np
+import pandas as pd
+from rba_tools.retriever.timeframe import Timeframe
+import rba_tools.retriever.constants as constants
+
+def can_derive(timeframe: Timeframe, base_timeframe: Timeframe) -> bool:
+    """True if bars of timeframe are made of a whole number of base_timeframe bars"""
+    seconds = timeframe.get_timeframe_seconds()
+    base_seconds = base_timeframe.get_timeframe_seconds()
+    return seconds > base_seconds and seconds % base_seconds == 0
+
+def resample_ohlcv(data: pd.DataFrame, timeframe: Timeframe) -> pd.DataFrame:
+    """aggregate the bars of one symbol into timeframe bars"""
+    if data.empty:
+        return constants.empty_ohlcv_df_generator()
+    if not data.index.is_monotonic_increasing:
+        data = data.sort_index(kind='stable')
+    bar_starts = timeframe.floor_ms(constants.datetime_index_to_epoch_ms(data.index))
+    group_starts = np.flatnonzero(np.concatenate(([True], bar_starts[1:] != bar_starts[:-1])))
+    group_ends = np.concatenate((group_starts[1:], [len(bar_starts)]))
+    return pd.DataFrame({
+        'Open': data['Open'].to_numpy()[group_starts],
+        'High': np.maximum.reduceat(data['High'].to_numpy(), group_starts),
+        'Low': np.minimum.reduceat(data['Low'].to_numpy(), group_starts),
+        'Close': data['Close'].to_numpy()[group_ends - 1],
+        'Volume': np.add.reduceat(data['Volume'].to_numpy(), group_starts),
+        'Symbol': data['Symbol'].to_numpy()[group_starts],
+        }, index=constants.epoch_ms_to_datetime_index(bar_starts[group_starts]))
@@ -2,24 +2,79 @@ from abc import ABC, abstractmethod
 from typing import Type
 import pandas as pd
 import numpy as np
+import shutil
+import threading
 from time import sleep
 from datetime import datetime, date, timedelta
 from dateutil import tz
 from pathlib import Path
 from zipfile import ZipFile
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
 import ccxt
+import ccxt.async_support as ccxt_async
 from rba_tools.retriever.timeframe import Timeframe
 import rba_tools.retriever.database_interface as dbi
 import rba_tools.retriever.constants as constants
+import rba_tools.retriever.coverage as coverage
+from rba_tools.retriever.rate_limiter import TokenBucketRateLimiter
+from rba_tools.retriever.instrumentation import NULL_METRICS
 from rba_tools.exceptions import KrakenFileNotFoundError
 
+logger = logging.getLogger(__name__)
+
+def stitch_ccxt_pages(pages: list, from_date_ms: int, to_date_ms: int) -> np.ndarray:
+    """concatenate arrays of ccxt ohlcv rows into one array sorted by timestamp, keeping the first
+    row for each timestamp and only rows within [from_date_ms, to_date_ms]"""
+    if not pages:
+        return np.empty((0, 6))
+    data = np.concatenate(pages)
+    timestamps = data[:, 0].astype(np.int64)
+    in_range = (timestamps >= from_date_ms) & (timestamps <= to_date_ms)
+    _, first_rows = np.unique(timestamps[in_range], return_index=True)
+    return data[in_range][first_rows]
+
+def iter_row_chunks(data: pd.DataFrame, chunksize: int):
+    """yields consecutive slices of data with at most chunksize rows. Nothing is yielded for empty data"""
+    for first in range(0, len(data), chunksize):
+        yield data.iloc[first:first + chunksize]
+
 class OHLCVDataRetriever(ABC):
     "pulls OHLCV data for a specific symbol, timeframe, and date range"
 
+    #number of threads fetch_many_ohlcv fetches symbols with
+    FETCH_MANY_WORKERS = 8
+    #replace with an instrumentation.Metrics to record calls, rows and stage timings
+    metrics = NULL_METRICS
+
     @abstractmethod
     def fetch_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date) -> pd.DataFrame:
         """obtains OHLCV data"""
 
+    def fetch_many_ohlcv(self, symbols: list, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        """fetch several symbols and return a dict of symbol to dataframe. Symbols are fetched
+        in a thread pool unless the retriever overrides this with a batched fetch"""
+        symbols = list(dict.fromkeys(symbols))
+        if len(symbols) <= 1 or self.FETCH_MANY_WORKERS <= 1:
+            return {symbol: self.fetch_ohlcv(symbol, timeframe, from_date, to_date) for symbol in symbols}
+        with ThreadPoolExecutor(max_workers=min(self.FETCH_MANY_WORKERS, len(symbols))) as executor:
+            results = executor.map(lambda symbol: self.fetch_ohlcv(symbol, timeframe, from_date, to_date), symbols)
+            return dict(zip(symbols, results))
+
+    def iter_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date, chunksize: int=constants.DEFAULT_CHUNKSIZE):
+        """yields time ordered dataframes of at most chunksize rows for the range. By default the range
+        is fetched in windows of whole days that hold about chunksize bars so memory use stays bounded"""
+        for window_from_date, window_to_date in coverage.get_chunk_date_ranges(from_date, to_date, timeframe, chunksize):
+            yield from iter_row_chunks(self.fetch_ohlcv(symbol, timeframe, window_from_date, window_to_date), chunksize)
+
+    def record_fetch(self, symbol: str, data: pd.DataFrame) -> pd.DataFrame:
+        """count a fetch and the rows it returned. Returns data"""
+        if self.metrics.enabled:
+            self.metrics.count('retriever.calls', retriever=type(self).__name__, symbol=symbol)
+            self.metrics.count('retriever.rows', len(data), retriever=type(self).__name__, symbol=symbol)
+        return data
+
     def get_from_and_to_datetimes(self, from_date: date, to_date: date):
         from_datetime = constants.create_midnight_datetime_from_date(from_date)
         #add one day minus 1 second to get all the data from the end_date. Need for timeframes < 1 day
@@ -27,6 +82,8 @@ class OHLCVDataRetriever(ABC):
         return (from_datetime, to_datetime)
 
 class CCXTDataRetriever(OHLCVDataRetriever):
+    #the synchronous exchange throttles itself per call so symbols are fetched one at a time
+    FETCH_MANY_WORKERS = 1
 
     def __init__(self, exchange: str):
         exchange_class = getattr(ccxt, exchange)
@@ -40,7 +97,7 @@ class CCXTDataRetriever(OHLCVDataRetriever):
         from_date_ms = self._convert_datetime_to_UTC_Ms(from_datetime)
         to_date_ms = self._convert_datetime_to_UTC_Ms(to_datetime)
         data = self.get_all_ccxt_data(symbol, timeframe, from_date_ms, to_date_ms)
-        return self.format_ccxt_returned_data(data, symbol, to_datetime)
+        return self.record_fetch(symbol, self.format_ccxt_returned_data(data, symbol, to_datetime))
 
     def format_ccxt_returned_data(self, data, symbol, to_date) -> pd.DataFrame:
         """formats the data pulled from ccxt into the expected format"""
@@ -52,48 +109,269 @@ class CCXTDataRetriever(OHLCVDataRetriever):
         df['Symbol'] = symbol
         return df.loc[:to_date].copy()
 
+    def iter_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date, chunksize: int=constants.DEFAULT_CHUNKSIZE):
+        """yields each page pulled from the exchange as it arrives, split into chunks of at most chunksize rows"""
+        from_datetime, to_datetime = self.get_from_and_to_datetimes(from_date, to_date)
+        from_date_ms = self._convert_datetime_to_UTC_Ms(from_datetime)
+        to_date_ms = self._convert_datetime_to_UTC_Ms(to_datetime)
+        for page in self.iter_ccxt_pages(symbol, timeframe, from_date_ms, to_date_ms):
+            yield from iter_row_chunks(self.format_ccxt_returned_data(page, symbol, to_datetime), chunksize)
+
     def get_all_ccxt_data(self, symbol: str, timeframe: Timeframe, from_date_ms: int, to_date_ms: int):
         """pull ccxt data repeatedly until we have all data"""
-        call_count = 1
         return_data = None
-        to_date_is_found_or_passed = False
-        while not to_date_is_found_or_passed:
-            print(f'Fetching {symbol} market data from {self.exchange}. call #{call_count}')
-            ccxt_timeframe = self._ccxt_timeframe_format(timeframe)
-            data = self.exchange.fetch_ohlcv(symbol, ccxt_timeframe, since=from_date_ms)
-            sleep(self.exchange.rateLimit / 1000)
-            if not data: #handle when we don't get any data by returning what we have so far
-                return return_data
-            call_count += 1
+        for data in self.iter_ccxt_pages(symbol, timeframe, from_date_ms, to_date_ms):
             if return_data:
                 return_data.extend(data)
             else:
                 return_data = data
-            to_date_is_found_or_passed = any(to_date_ms == row[0] or to_date_ms < row[0] for row in data)
-            last_end_timestamp_ms = data[len(data) - 1][0]
-            from_date_ms = last_end_timestamp_ms + 1 #add one to not grab same time twice
         return return_data
 
+    def iter_ccxt_pages(self, symbol: str, timeframe: Timeframe, from_date_ms: int, to_date_ms: int):
+        """yields pages of ccxt data until a page reaches to_date_ms or the exchange has no more data"""
+        call_count = 1
+        to_date_is_found_or_passed = False
+        while not to_date_is_found_or_passed:
+            logger.debug('Fetching %s market data from %s. call #%d', symbol, self.exchange, call_count)
+            ccxt_timeframe = self._ccxt_timeframe_format(timeframe)
+            with self.metrics.timer('retriever.network', retriever=type(self).__name__, symbol=symbol):
+                data = self.exchange.fetch_ohlcv(symbol, ccxt_timeframe, since=from_date_ms)
+            self.metrics.count('retriever.requests', retriever=type(self).__name__, symbol=symbol)
+            with self.metrics.timer('retriever.rate_limit_sleep', retriever=type(self).__name__):
+                sleep(self.exchange.rateLimit / 1000)
+            if not data: #handle when we don't get any data by stopping with what we have so far
+                return
+            call_count += 1
+            yield data
+            last_end_timestamp_ms = data[-1][0]
+            to_date_is_found_or_passed = last_end_timestamp_ms >= to_date_ms #rows are sorted so only the last one needs checking
+            from_date_ms = last_end_timestamp_ms + 1 #add one to not grab same time twice
+
     def _ccxt_timeframe_format(self, timeframe: Timeframe):
         return str(timeframe).lower()
 
     def _convert_datetime_to_UTC_Ms(self,input_datetime=None):
         return int(round(input_datetime.replace(tzinfo = tz.tzutc()).timestamp() * 1000))
 
+class AsyncCCXTDataRetriever(CCXTDataRetriever):
+    """pulls data with ccxt.async_support so many symbols can be fetched concurrently
+
+    Every request to an exchange waits on one token bucket per exchange that allows a
+    request each exchange.rateLimit milliseconds. exchange is either a ccxt exchange id
+    or an already created async exchange object.
+
+    When the exchange's page limit is known, from ccxt's features or the page_limit argument,
+    the range is split into windows of page_limit bars up front and the windows are fetched
+    concurrently instead of walking forward one page at a time.
+
+    The synchronous methods run on an event loop in a daemon thread that the retriever keeps
+    for its lifetime, so the exchange's http session is reused by every call. Call close() when
+    done to close the exchange and stop the thread. Callers awaiting the async_ methods on their
+    own event loop close the exchange themselves"""
+
+    def __init__(self, exchange, max_concurrency: int=10, page_limit: int=None):
+        if isinstance(exchange, str):
+            exchange_class = getattr(ccxt_async, exchange)
+            #requests are throttled by our own limiter so it can be shared across symbols
+            exchange = exchange_class({
+                            'timeout': 30000,
+                            'enableRateLimit': False,
+                            })
+        self.exchange = exchange
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenBucketRateLimiter.for_exchange(exchange.id, exchange.rateLimit)
+        self.page_limit = page_limit or self._get_exchange_page_limit()
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+
+    def fetch_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date) -> pd.DataFrame:
+        return self.fetch_many_ohlcv([symbol], timeframe, from_date, to_date)[symbol]
+
+    #pages are fetched concurrently so the range is streamed in windows instead of page by page
+    iter_ohlcv = OHLCVDataRetriever.iter_ohlcv
+
+    def fetch_many_ohlcv(self, symbols: list, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        """fetch several symbols concurrently and return a dict of symbol to dataframe"""
+        coroutine = self.async_fetch_many_ohlcv(symbols, timeframe, from_date, to_date)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.get_event_loop()).result()
+
+    async def async_fetch_many_ohlcv(self, symbols: list, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(*(self.async_fetch_ohlcv(symbol, timeframe, from_date, to_date, semaphore) for symbol in symbols))
+        return dict(zip(symbols, results))
+
+    def get_event_loop(self) -> asyncio.AbstractEventLoop:
+        """the event loop the synchronous methods run on, started in a daemon thread on first use.
+        The exchange's http session belongs to this loop so it's kept until close()"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name=f'{self.exchange.id}-retriever', daemon=True)
+                self._loop_thread.start()
+            return self._loop
+
+    def close(self):
+        """close the exchange and stop the event loop thread. The exchange can't be used afterwards"""
+        with self._loop_lock:
+            loop, loop_thread = self._loop, self._loop_thread
+            self._loop = self._loop_thread = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.exchange.close(), loop).result()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+            loop.close()
+
+    async def async_fetch_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date, semaphore: asyncio.Semaphore=None) -> pd.DataFrame:
+        from_datetime, to_datetime = self.get_from_and_to_datetimes(from_date, to_date)
+        from_date_ms = self._convert_datetime_to_UTC_Ms(from_datetime)
+        to_date_ms = self._convert_datetime_to_UTC_Ms(to_datetime)
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        if self.page_limit:
+            data = await self.async_get_windowed_ccxt_data(symbol, timeframe, from_date_ms, to_date_ms, semaphore)
+            return self.record_fetch(symbol, self.format_ccxt_array(data, symbol))
+        data = await self.async_get_all_ccxt_data(symbol, timeframe, from_date_ms, to_date_ms, semaphore)
+        return self.record_fetch(symbol, self.format_ccxt_returned_data(data, symbol, to_datetime))
+
+    async def async_get_windowed_ccxt_data(self, symbol: str, timeframe: Timeframe, from_date_ms: int, to_date_ms: int, semaphore: asyncio.Semaphore) -> np.ndarray:
+        """fetch [from_date_ms, to_date_ms] as concurrent windows of page_limit bars and stitch them together"""
+        window_ms = self.page_limit * int(timeframe.get_timeframe_seconds() * 1000)
+        window_starts = range(from_date_ms, to_date_ms + 1, window_ms)
+        windows = await asyncio.gather(*(self.async_get_window(symbol, timeframe, start, min(start + window_ms, to_date_ms + 1), semaphore)
+                                         for start in window_starts))
+        return stitch_ccxt_pages([page for window in windows for page in window], from_date_ms, to_date_ms)
+
+    async def async_get_window(self, symbol: str, timeframe: Timeframe, start_ms: int, end_ms: int, semaphore: asyncio.Semaphore) -> list:
+        """fetch the pages of [start_ms, end_ms). Usually this is one request but if the exchange returns
+        fewer bars than requested the rest of the window is paged through"""
+        bar_ms = int(timeframe.get_timeframe_seconds() * 1000)
+        ccxt_timeframe = self._ccxt_timeframe_format(timeframe)
+        pages = []
+        since = start_ms
+        while since < end_ms:
+            async with semaphore:
+                data = await self.async_request_ohlcv(symbol, ccxt_timeframe, since, self.page_limit)
+            if not data:
+                break
+            page = np.array(data, dtype=np.float64)
+            pages.append(page)
+            last_timestamp_ms = int(page[-1, 0])
+            #stop when the window is filled or the exchange ignored since
+            if last_timestamp_ms + bar_ms >= end_ms or last_timestamp_ms < since:
+                break
+            since = last_timestamp_ms + 1
+        return pages
+
+    async def async_request_ohlcv(self, symbol: str, ccxt_timeframe: str, since: int, limit: int=None) -> list:
+        """make one fetch_ohlcv request once the rate limiter allows it"""
+        waited = await self.rate_limiter.acquire()
+        self.metrics.timing('retriever.rate_limit_sleep', waited, retriever=type(self).__name__)
+        with self.metrics.timer('retriever.network', retriever=type(self).__name__, symbol=symbol):
+            data = await self.exchange.fetch_ohlcv(symbol, ccxt_timeframe, since=since, limit=limit)
+        self.metrics.count('retriever.requests', retriever=type(self).__name__, symbol=symbol)
+        return data
+
+    def format_ccxt_array(self, data: np.ndarray, symbol: str) -> pd.DataFrame:
+        """formats an array of stitched ccxt rows into the expected format"""
+        if not len(data):
+            return constants.empty_ohlcv_df_generator()
+        index = constants.epoch_ms_to_datetime_index(data[:, 0].astype(np.int64))
+        df = pd.DataFrame(data[:, 1:], columns=['Open', 'High', 'Low', 'Close', 'Volume'], index=index)
+        df['Symbol'] = symbol
+        return df
+
+    def _get_exchange_page_limit(self):
+        """the maximum bars per fetch_ohlcv request if ccxt knows it for this exchange"""
+        features = getattr(self.exchange, 'features', None) or {}
+        return (features.get('spot') or {}).get('fetchOHLCV', {}).get('limit')
+
+    async def async_get_all_ccxt_data(self, symbol: str, timeframe: Timeframe, from_date_ms: int, to_date_ms: int, semaphore: asyncio.Semaphore):
+        """pull ccxt data page by page until we have all data"""
+        return_data = []
+        ccxt_timeframe = self._ccxt_timeframe_format(timeframe)
+        while True:
+            async with semaphore:
+                data = await self.async_request_ohlcv(symbol, ccxt_timeframe, from_date_ms)
+            if not data: #handle when we don't get any data by returning what we have so far
+                break
+            return_data.extend(data)
+            last_end_timestamp_ms = data[-1][0]
+            if last_end_timestamp_ms >= to_date_ms:
+                break
+            from_date_ms = last_end_timestamp_ms + 1 #add one to not grab same time twice
+        return return_data
+
 class CSVDataRetriever(OHLCVDataRetriever):
+    """pulls data from a csv file with a Timestamp index and a Symbol column
 
-    def __init__(self, file):
+    The file is parsed once and split into a sorted dataframe per symbol which is reused
+    until the file's modification time or size changes. Files too large to keep in memory
+    can be read in chunks of chunksize rows on every fetch instead"""
+
+    def __init__(self, file, chunksize: int=None):
         self.file = file
+        self.chunksize = chunksize
+        self._symbol_data = None
+        self._empty_data = None
+        self._file_signature = None
+        self._parse_lock = threading.Lock()
         
     def fetch_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: datetime, to_date: datetime) -> pd.DataFrame:
         from_datetime, to_datetime = self.get_from_and_to_datetimes(from_date, to_date)
-        data = pd.read_csv(self.file, index_col=constants.INDEX_HEADER, parse_dates=True)
-        return self.format_csv_data(data, symbol, from_datetime, to_datetime)
+        if self.chunksize:
+            return self.record_fetch(symbol, self.fetch_chunked_ohlcv(symbol, from_datetime, to_datetime))
+        symbol_data, empty_data = self.get_symbol_data()
+        data = symbol_data.get(symbol, empty_data)
+        return self.record_fetch(symbol, data.loc[from_datetime:to_datetime].copy())
+
+    def iter_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date, chunksize: int=constants.DEFAULT_CHUNKSIZE):
+        """yields the range in chunks of at most chunksize rows. When the retriever reads the file in chunks
+        the file is streamed, which requires its rows to be in timestamp order"""
+        from_datetime, to_datetime = self.get_from_and_to_datetimes(from_date, to_date)
+        if not self.chunksize:
+            symbol_data, empty_data = self.get_symbol_data()
+            yield from iter_row_chunks(symbol_data.get(symbol, empty_data).loc[from_datetime:to_datetime], chunksize)
+            return
+        for chunk in pd.read_csv(self.file, index_col=constants.INDEX_HEADER, parse_dates=True, chunksize=self.chunksize):
+            in_range = (chunk['Symbol'] == symbol) & (chunk.index >= from_datetime) & (chunk.index <= to_datetime)
+            yield from iter_row_chunks(chunk.loc[in_range], chunksize)
 
     def format_csv_data(self, data, symbol: str, from_date: datetime, to_date: datetime):
         df = data.loc[data['Symbol'] == symbol]
         return df.loc[from_date:to_date].copy()
 
+    def get_symbol_data(self):
+        """returns a dict of symbol to sorted dataframe and an empty dataframe for missing symbols,
+        parsing the file if it changed since it was last parsed"""
+        stat = Path(self.file).stat()
+        file_signature = (stat.st_mtime_ns, stat.st_size)
+        with self._parse_lock:
+            if self._file_signature != file_signature:
+                with self.metrics.timer('retriever.parse', retriever=type(self).__name__):
+                    data = pd.read_csv(self.file, index_col=constants.INDEX_HEADER, parse_dates=True)
+                self.metrics.count('retriever.bytes_parsed', stat.st_size, retriever=type(self).__name__)
+                self._symbol_data = {symbol: symbol_data.sort_index(kind='stable')
+                                     for symbol, symbol_data in data.groupby('Symbol', sort=False)}
+                self._empty_data = data.iloc[:0]
+                self._file_signature = file_signature
+            return self._symbol_data, self._empty_data
+
+    def fetch_chunked_ohlcv(self, symbol: str, from_datetime: datetime, to_datetime: datetime) -> pd.DataFrame:
+        """read the file chunksize rows at a time keeping only the rows for symbol within the range"""
+        pieces = []
+        with self.metrics.timer('retriever.parse', retriever=type(self).__name__):
+            for chunk in pd.read_csv(self.file, index_col=constants.INDEX_HEADER, parse_dates=True, chunksize=self.chunksize):
+                in_range = (chunk['Symbol'] == symbol) & (chunk.index >= from_datetime) & (chunk.index <= to_datetime)
+                pieces.append(chunk.loc[in_range])
+        if self.metrics.enabled:
+            self.metrics.count('retriever.bytes_parsed', Path(self.file).stat().st_size, retriever=type(self).__name__)
+        if not pieces:
+            return constants.empty_ohlcv_df_generator()
+        return pd.concat(pieces).sort_index(kind='stable')
+
 class DatabaseRetriever(OHLCVDataRetriever):
     """pulls data from a OHLCVDatabase database"""
     
@@ -101,54 +379,141 @@ class DatabaseRetriever(OHLCVDataRetriever):
         self.database = database
 
     def fetch_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: datetime, to_date: datetime) -> pd.DataFrame:
-        query = self.get_query(symbol, timeframe, from_date, to_date)
-        query_result = self.database.get_query_result_as_dataframe(query, timeframe)
-        return self.format_database_data(query_result)
+        query_result = self.database.get_ohlcv_range_as_dataframe(symbol, timeframe, from_date, to_date)
+        return self.record_fetch(symbol, self.format_database_data(query_result))
+
+    def fetch_many_ohlcv(self, symbols: list, timeframe: Timeframe, from_date: date, to_date: date) -> dict:
+        query_results = self.database.get_ohlcv_ranges_as_dataframes(symbols, timeframe, from_date, to_date)
+        return {symbol: self.record_fetch(symbol, self.format_database_data(data)) for symbol, data in query_results.items()}
+
+    def iter_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date, chunksize: int=constants.DEFAULT_CHUNKSIZE):
+        for data in self.database.iter_ohlcv_range(symbol, timeframe, from_date, to_date, chunksize):
+            yield self.format_database_data(data)
 
     def format_database_data(self, data: pd.DataFrame):
         if data.empty:
             return data
         return data
 
-    def get_query(self, symbol: str, timeframe: Timeframe, from_date: datetime, to_date: datetime):
-        """Generate query based on fetch_ohlcv parameters"""
-        to_date_plus_1 = to_date + timedelta(days=1)
-        symbol_condition = "Symbol = '" + symbol + "'"
-        table_name = timeframe.get_timeframe_table_name()
-        start_condition = f'and {constants.INDEX_HEADER} >= "{from_date}"'
-        end_condition = f'and {constants.INDEX_HEADER} < "{to_date_plus_1}"'
-        return f"""SELECT * FROM {table_name} 
-            WHERE {symbol_condition}
-            {start_condition}
-            {end_condition}"""
-
 class KrakenOHLCVTZipRetriever(OHLCVDataRetriever):
-    """pulls data from a Kraken OHLCVT Zip file downloaded from thier webiste"""
+    """pulls data from a Kraken OHLCVT Zip file downloaded from thier webiste
+
+    The first fetch of a zip member converts it to memory mapped .npy columns in cache_directory.
+    Cached members are keyed by the member's CRC and size so they are rebuilt when the zip changes
+    and later fetches only read the bytes for the requested range."""
+    CACHE_COLUMNS = [constants.INDEX_HEADER, 'Open', 'High', 'Low', 'Close', 'Volume']
     
-    def __init__(self, kraken_file: str=None):
+    def __init__(self, kraken_file: str=None, cache_directory: str=None, use_cache: bool=True):
         """defualt expectation is that file is in ohlcv_data directory and is named 'Kraken_OHLCVT.zip'
-        but file location may be overridden"""
+        but file location may be overridden. The cache defaults to a directory next to the zip file"""
         self.kraken_file = kraken_file
         if not self.kraken_file:
             self.kraken_file = str(Path(__file__).parent) + r'\ohlcv_data\Kraken_OHLCVT.zip'
         if not Path(self.kraken_file).is_file():
             raise KrakenFileNotFoundError
-        
+        self.cache_directory = None
+        if use_cache:
+            self.cache_directory = Path(cache_directory) if cache_directory else Path(self.kraken_file).with_suffix('.cache')
+        self._member_info = None
+        self._member_info_stat = None
+        self._cache_lock = threading.Lock()
 
     def fetch_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: datetime, to_date: datetime) -> pd.DataFrame:
         from_datetime, to_datetime = self.get_from_and_to_datetimes(from_date, to_date)
+        kraken_csv_file = self._get_kraken_csv_file(symbol, timeframe)
+        if self.cache_directory:
+            return self.record_fetch(symbol, self.fetch_cached_ohlcv(kraken_csv_file, symbol, from_datetime, to_datetime))
         krakenk_zip_file = ZipFile(self.kraken_file)
         kraken_headers = [constants.INDEX_HEADER]
         kraken_headers.extend(constants.DATAFRAME_HEADERS)
-        kraken_csv_file = self._get_kraken_csv_file(symbol, timeframe)
-        result = pd.read_csv(krakenk_zip_file.open(kraken_csv_file), index_col=0, names=kraken_headers)
-        return self.format_kraken_data(result, symbol, from_datetime, to_datetime)
+        with self.metrics.timer('retriever.parse', retriever=type(self).__name__):
+            result = pd.read_csv(krakenk_zip_file.open(kraken_csv_file), index_col=0, names=kraken_headers)
+        self.metrics.count('retriever.bytes_parsed', krakenk_zip_file.getinfo(kraken_csv_file).file_size, retriever=type(self).__name__)
+        return self.record_fetch(symbol, self.format_kraken_data(result, symbol, from_datetime, to_datetime))
 
     def format_kraken_data(self, data: pd.DataFrame, symbol: str, from_date: datetime, to_date: datetime):
         data.index = pd.to_datetime(data.index, unit='s')
         data['Symbol'] = symbol
         return data.loc[from_date:to_date]
 
+    def iter_ohlcv(self, symbol: str, timeframe: Timeframe, from_date: date, to_date: date, chunksize: int=constants.DEFAULT_CHUNKSIZE):
+        """yields the range in chunks of at most chunksize rows, read from the memory mapped cache
+        or streamed from the zip member when the cache isn't used"""
+        from_datetime, to_datetime = self.get_from_and_to_datetimes(from_date, to_date)
+        kraken_csv_file = self._get_kraken_csv_file(symbol, timeframe)
+        if self.cache_directory:
+            columns, start, end = self._get_cached_range(kraken_csv_file, from_datetime, to_datetime)
+            for first in range(start, end, chunksize):
+                yield self._cached_columns_to_dataframe(columns, symbol, first, min(end, first + chunksize))
+            return
+        kraken_headers = [constants.INDEX_HEADER]
+        kraken_headers.extend(constants.DATAFRAME_HEADERS)
+        with ZipFile(self.kraken_file) as kraken_zip_file:
+            for chunk in pd.read_csv(kraken_zip_file.open(kraken_csv_file), index_col=0, names=kraken_headers, chunksize=chunksize):
+                data = self.format_kraken_data(chunk, symbol, from_datetime, to_datetime)
+                if not data.empty:
+                    yield data
+
+    def fetch_cached_ohlcv(self, kraken_csv_file: str, symbol: str, from_datetime: datetime, to_datetime: datetime) -> pd.DataFrame:
+        """fetch a range of a zip member through the .npy cache, building the cache first if needed"""
+        columns, start, end = self._get_cached_range(kraken_csv_file, from_datetime, to_datetime)
+        return self._cached_columns_to_dataframe(columns, symbol, start, end)
+
+    def _get_cached_range(self, kraken_csv_file: str, from_datetime: datetime, to_datetime: datetime):
+        """returns the memory mapped cache columns of a zip member and the [start, end) rows within the range"""
+        columns = dbi.load_npy_columns(self.get_member_cache_directory(kraken_csv_file), self.CACHE_COLUMNS)
+        from_seconds = constants.datetime_to_epoch_ms(from_datetime) // 1000
+        to_seconds = constants.datetime_to_epoch_ms(to_datetime) // 1000
+        start = np.searchsorted(columns[constants.INDEX_HEADER], from_seconds, side='left')
+        end = np.searchsorted(columns[constants.INDEX_HEADER], to_seconds, side='right')
+        return (columns, start, end)
+
+    def _cached_columns_to_dataframe(self, columns: dict, symbol: str, start: int, end: int) -> pd.DataFrame:
+        index = constants.epoch_ms_to_datetime_index(columns[constants.INDEX_HEADER][start:end] * 1000)
+        data = pd.DataFrame({column: columns[column][start:end] for column in self.CACHE_COLUMNS[1:]}, index=index)
+        data['Symbol'] = symbol
+        return data
+
+    def get_member_cache_directory(self, kraken_csv_file: str) -> Path:
+        """returns the directory of a zip member's cached columns, converting the member if it isn't cached yet"""
+        member_info = self._get_member_info()
+        if kraken_csv_file not in member_info:
+            raise KeyError(f"There is no item named '{kraken_csv_file}' in the archive")
+        crc, file_size = member_info[kraken_csv_file]
+        member_name = Path(kraken_csv_file).stem
+        directory = self.cache_directory / f'{member_name}_{crc:08x}_{file_size}'
+        columns_directory = dbi.get_npy_columns_directory(directory)
+        if columns_directory:
+            return columns_directory
+        with self._cache_lock:
+            if not dbi.get_npy_columns_directory(directory):
+                with ZipFile(self.kraken_file) as kraken_zip_file:
+                    columns = self._read_member_columns(kraken_zip_file, kraken_csv_file)
+                for stale_directory in self.cache_directory.glob(f'{member_name}_*_*'):
+                    shutil.rmtree(stale_directory, ignore_errors=True)
+                dbi.write_npy_columns(directory, columns)
+        return dbi.get_npy_columns_directory(directory)
+
+    def _read_member_columns(self, kraken_zip_file: ZipFile, kraken_csv_file: str) -> dict:
+        """parse a zip member into sorted numpy columns with epoch second timestamps"""
+        with self.metrics.timer('retriever.parse', retriever=type(self).__name__):
+            data = pd.read_csv(kraken_zip_file.open(kraken_csv_file), header=None, usecols=range(len(self.CACHE_COLUMNS)),
+                               names=self.CACHE_COLUMNS, dtype={constants.INDEX_HEADER: np.int64})
+        self.metrics.count('retriever.bytes_parsed', kraken_zip_file.getinfo(kraken_csv_file).file_size, retriever=type(self).__name__)
+        data = data.sort_values(constants.INDEX_HEADER, kind='stable')
+        return {column: data[column].to_numpy(dtype=np.int64 if column == constants.INDEX_HEADER else np.float64)
+                for column in self.CACHE_COLUMNS}
+
+    def _get_member_info(self) -> dict:
+        """map of member name to (CRC, size), re-read only when the zip file changes"""
+        stat = Path(self.kraken_file).stat()
+        zip_stat = (stat.st_mtime_ns, stat.st_size)
+        if self._member_info is None or self._member_info_stat != zip_stat:
+            with ZipFile(self.kraken_file) as kraken_zip_file:
+                self._member_info = {info.filename: (info.CRC, info.file_size) for info in kraken_zip_file.infolist()}
+            self._member_info_stat = zip_stat
+        return self._member_info
+
     def _get_kraken_csv_file(self, symbol: str, timeframe: Timeframe):
         """get kraken csv file name"""
         kraken_symbol = symbol.replace('/','')
@@ -157,6 +522,5 @@ class KrakenOHLCVTZipRetriever(OHLCVDataRetriever):
 
 
 
-
 if __name__ == '__main__':
     print(str(Path(__file__).parent) + r'\ohlcv_data\Kraken_OHLCVT.zip')
\ No newline at end of file
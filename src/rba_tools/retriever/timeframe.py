@@ -7,11 +7,20 @@ Created on Sat Nov 01 2021
 
 """
 
+import threading
 from typing import ClassVar
 from datetime import timedelta
+import numpy as np
+from pandas import DatetimeIndex
+import rba_tools.retriever.constants as constants
 
 class Timeframe:
-    """timedelta with more convenient initialization and __str__ methods"""
+    """timedelta with more convenient initialization and __str__ methods
+
+    Timeframes are immutable and interned so there is one instance per length of time.
+    They can be used as dict keys and compared by identity. Bars are aligned to the unix epoch
+    except multiples of a week which start on Monday 00:00 UTC"""
+    __slots__ = ('timeframe', '_seconds', '_bar_ms', '_origin_ms', '_str')
     timeframe: timedelta
     TIMEFRAME_MAP_SEC: ClassVar[dict[str, int]] = {
         'S': 1,
@@ -20,15 +29,38 @@ class Timeframe:
         'D': 86400,
         'W': 86400*7
     }
+    TABLE_PREFIX: ClassVar[str] = 'TIMEFRAME_'
+    #1970-01-05 was the first Monday after the epoch
+    WEEK_ORIGIN_MS: ClassVar[int] = 4 * 86400 * 1000
+    _instances: ClassVar[dict] = {}
+    _string_instances: ClassVar[dict] = {}
+    _instances_lock: ClassVar[threading.Lock] = threading.Lock()
 
-    def __init__(self, timeframe: timedelta):
-        self.timeframe = timeframe
+    def __new__(cls, timeframe: timedelta):
+        instance = cls._instances.get(timeframe)
+        if instance is not None:
+            return instance
+        with cls._instances_lock:
+            instance = cls._instances.get(timeframe)
+            if instance is None:
+                instance = super().__new__(cls)
+                seconds = timeframe.total_seconds()
+                object.__setattr__(instance, 'timeframe', timeframe)
+                object.__setattr__(instance, '_seconds', seconds)
+                object.__setattr__(instance, '_bar_ms', int(round(seconds * 1000)))
+                object.__setattr__(instance, '_origin_ms', cls.WEEK_ORIGIN_MS if seconds % cls.TIMEFRAME_MAP_SEC['W'] == 0 else 0)
+                object.__setattr__(instance, '_str', None)
+                cls._instances[timeframe] = instance
+            return instance
 
     @classmethod
     def from_string(cls, timeframe: str):
         """create timeframe from a string, e.g. 5m for 5 minutes"""
-        timeframe = timedelta(seconds=cls.convert_timeframe_string_to_sec(timeframe))
-        return cls(timeframe)
+        instance = cls._string_instances.get(timeframe)
+        if instance is None:
+            instance = cls(timedelta(seconds=cls.convert_timeframe_string_to_sec(timeframe)))
+            cls._string_instances[timeframe] = instance
+        return instance
 
     @classmethod
     def from_seconds(cls, seconds: int):
@@ -48,11 +80,19 @@ class Timeframe:
 
     def get_timeframe_seconds(self):
         """Retreieve number of seconds in timeframe"""
-        return self.timeframe.total_seconds()
+        return self._seconds
+
+    def get_bar_ms(self) -> int:
+        """length of a bar in milliseconds"""
+        return self._bar_ms
+
+    def get_origin_ms(self) -> int:
+        """epoch millisecond that bars are aligned to"""
+        return self._origin_ms
 
     def get_timeframe_table_name(self):
         """Converts a timeframe string to a the highest time increment"""
-        return 'TIMEFRAME_' + str(self)
+        return self.TABLE_PREFIX + str(self)
 
     def get_highest_time_increment_symbol(self) -> str:
         """Rerieves the highest timeframe that the seconds can be divided into"""
@@ -62,17 +102,63 @@ class Timeframe:
         if seconds % self.TIMEFRAME_MAP_SEC['M'] == 0: return 'M'
         else: raise ValueError(f"timeframe value of {seconds} seconds is invalid")
 
+    def floor_ms(self, timestamps_ms):
+        """floor epoch millisecond timestamps, a scalar or an array, to the start of their bar"""
+        timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+        return (timestamps_ms - self._origin_ms) // self._bar_ms * self._bar_ms + self._origin_ms
+
+    def ceil_ms(self, timestamps_ms):
+        """ceil epoch millisecond timestamps, a scalar or an array, to the next bar boundary"""
+        timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+        return -((self._origin_ms - timestamps_ms) // self._bar_ms) * self._bar_ms + self._origin_ms
+
+    def count_bars(self, start_ms: int, end_ms: int) -> int:
+        """number of bars that start in [start_ms, end_ms)"""
+        return max(0, int((self.ceil_ms(end_ms) - self.ceil_ms(start_ms)) // self._bar_ms))
+
+    def get_expected_timestamps_ms(self, start_ms: int, end_ms: int) -> np.ndarray:
+        """epoch millisecond start of every bar that starts in [start_ms, end_ms)"""
+        first_ms = int(self.ceil_ms(start_ms))
+        return np.arange(first_ms, first_ms + self.count_bars(start_ms, end_ms) * self._bar_ms, self._bar_ms, dtype=np.int64)
+
+    def get_expected_index(self, start_ms: int, end_ms: int) -> DatetimeIndex:
+        """DatetimeIndex of every bar that starts in [start_ms, end_ms)"""
+        return constants.epoch_ms_to_datetime_index(self.get_expected_timestamps_ms(start_ms, end_ms))
+
     def __str__(self):
         """
         Converts a timeframe to a name with the highest increment
         and number of increments like 4H
         """
-        increment_symbol = self.get_highest_time_increment_symbol()
-        increments = int(self.get_timeframe_seconds() / self.TIMEFRAME_MAP_SEC[increment_symbol])
-        return str(increments) + increment_symbol
+        if self._str is None:
+            increment_symbol = self.get_highest_time_increment_symbol()
+            increments = int(self.get_timeframe_seconds() / self.TIMEFRAME_MAP_SEC[increment_symbol])
+            object.__setattr__(self, '_str', str(increments) + increment_symbol)
+        return self._str
+
+    def __repr__(self):
+        return f'Timeframe({self.timeframe!r})'
 
     def __eq__(self, other):
         if type(other) is type(self):
             return self.timeframe == other.timeframe
         return False
-    
\ No newline at end of file
+
+    def __hash__(self):
+        return hash(self.timeframe)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self):
+        #unpickling goes through __new__ so the instance is interned in the receiving process
+        return (type(self), (self.timeframe,))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
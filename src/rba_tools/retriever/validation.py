@@ -0,0 +1,140 @@
+"""Vectorized integrity checks for OHLCV data
+
+validate_ohlcv compares one symbol's bars with the Timeframe's expected bar grid and
+reports gaps, duplicate timestamps, unsorted rows, timestamps off the grid and bars
+whose prices are impossible, e.g. High below Low. validate_database runs the same
+checks over every stored series.
+"""
+import argparse
+import sys
+from datetime import date, datetime
+from typing import Type
+import numpy as np
+import pandas as pd
+from rba_tools.retriever.timeframe import Timeframe
+import rba_tools.retriever.database_interface as dbi
+import rba_tools.retriever.constants as constants
+
+
+class ValidationReport:
+    """result of validating the bars of one symbol. Timestamps are epoch milliseconds and
+    gaps are [start, end) intervals of bars missing from the expected grid"""
+
+    def __init__(self, symbol: str, timeframe: Timeframe, rows: int, expected_bars: int, gaps: list,
+                 duplicates: np.ndarray, unsorted_rows: int, misaligned: np.ndarray, invalid_bars: np.ndarray):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.rows = rows
+        self.expected_bars = expected_bars
+        self.gaps = gaps
+        self.duplicates = duplicates
+        self.unsorted_rows = unsorted_rows
+        self.misaligned = misaligned
+        self.invalid_bars = invalid_bars
+
+    def get_missing_bars(self) -> int:
+        bar_ms = self.timeframe.get_bar_ms()
+        return sum((end - start) // bar_ms for start, end in self.gaps)
+
+    def is_valid(self, allow_gaps: bool=True) -> bool:
+        """True if no bar is duplicated, out of order, off the grid or invalid. Exchanges skip bars without
+        trades so gaps are allowed unless allow_gaps is False"""
+        if not allow_gaps and self.gaps:
+            return False
+        return not (len(self.duplicates) or self.unsorted_rows or len(self.misaligned) or len(self.invalid_bars))
+
+    def to_dict(self) -> dict:
+        return {'symbol': self.symbol,
+                'timeframe': str(self.timeframe),
+                'rows': self.rows,
+                'expected_bars': self.expected_bars,
+                'missing_bars': self.get_missing_bars(),
+                'gaps': len(self.gaps),
+                'duplicates': len(self.duplicates),
+                'unsorted_rows': self.unsorted_rows,
+                'misaligned': len(self.misaligned),
+                'invalid_bars': len(self.invalid_bars)}
+
+    def __str__(self):
+        report = self.to_dict()
+        details = ', '.join(f'{key}={value}' for key, value in report.items() if key not in ['symbol', 'timeframe'])
+        return f"{report['symbol']} {report['timeframe']}: {'ok' if self.is_valid() else 'INVALID'} ({details})"
+
+
+def validate_ohlcv(data: pd.DataFrame, timeframe: Timeframe, start_ms: int=None, end_ms: int=None, symbol: str=None) -> ValidationReport:
+    """validate the bars of one symbol against the expected grid of [start_ms, end_ms). The range
+    defaults to the first through the last bar of data"""
+    timestamps = constants.datetime_index_to_epoch_ms(data.index)
+    if symbol is None:
+        symbol = data['Symbol'].iloc[0] if len(data) else None
+    bar_ms = timeframe.get_bar_ms()
+
+    unsorted_rows = int(np.count_nonzero(np.diff(timestamps) < 0))
+    order = np.argsort(timestamps, kind='stable') if unsorted_rows else slice(None)
+    sorted_timestamps = timestamps[order]
+    repeated = sorted_timestamps[1:] == sorted_timestamps[:-1]
+    duplicates = np.unique(sorted_timestamps[1:][repeated])
+    misaligned = timestamps[timeframe.floor_ms(timestamps) != timestamps]
+    invalid_bars = timestamps[get_invalid_bar_mask(data)]
+
+    unique_timestamps = np.unique(sorted_timestamps)
+    if start_ms is None:
+        start_ms = int(unique_timestamps[0]) if len(unique_timestamps) else 0
+    if end_ms is None:
+        end_ms = int(unique_timestamps[-1]) + bar_ms if len(unique_timestamps) else start_ms
+    grid_timestamps = timeframe.floor_ms(unique_timestamps)
+    grid_timestamps = np.unique(grid_timestamps[(grid_timestamps >= start_ms) & (grid_timestamps < end_ms)])
+    gaps = get_gaps(grid_timestamps, timeframe, start_ms, end_ms)
+
+    return ValidationReport(symbol, timeframe, len(data), timeframe.count_bars(start_ms, end_ms), gaps,
+                            duplicates, unsorted_rows, misaligned, invalid_bars)
+
+def get_invalid_bar_mask(data: pd.DataFrame) -> np.ndarray:
+    """True for bars with a missing or negative value or a High or Low that doesn't contain the Open and Close"""
+    open_, high, low, close, volume = (data[column].to_numpy(dtype=np.float64) for column in ['Open', 'High', 'Low', 'Close', 'Volume'])
+    with np.errstate(invalid='ignore'):
+        return (np.isnan(open_) | np.isnan(high) | np.isnan(low) | np.isnan(close) | np.isnan(volume)
+                | (high < low) | (high < np.maximum(open_, close)) | (low > np.minimum(open_, close))
+                | (low < 0) | (volume < 0))
+
+def get_gaps(grid_timestamps: np.ndarray, timeframe: Timeframe, start_ms: int, end_ms: int) -> list:
+    """returns the [start, end) intervals of the expected grid of [start_ms, end_ms) that have no bar.
+    grid_timestamps must be sorted, unique and aligned to the grid"""
+    bar_ms = timeframe.get_bar_ms()
+    first_ms = int(timeframe.ceil_ms(start_ms))
+    last_end_ms = int(timeframe.ceil_ms(end_ms))
+    if not len(grid_timestamps):
+        return [(first_ms, last_end_ms)] if first_ms < last_end_ms else []
+    bounds = np.concatenate(([first_ms - bar_ms], grid_timestamps, [last_end_ms]))
+    breaks = np.flatnonzero(np.diff(bounds) > bar_ms)
+    return list(zip((bounds[breaks] + bar_ms).tolist(), bounds[breaks + 1].tolist()))
+
+def validate_database(database: Type[dbi.OHLCVDatabaseInterface], timeframes: list=None, symbols: list=None) -> list:
+    """validate every stored series, optionally limited to timeframe strings and symbols. Each series is read
+    from its first to its last stored bar so gaps before or after the stored data aren't reported"""
+    timeframes = [Timeframe.from_string(timeframe) for timeframe in timeframes] if timeframes else None
+    reports = []
+    for symbol, timeframe in database.get_stored_series():
+        if (timeframes and timeframe not in timeframes) or (symbols and symbol not in symbols):
+            continue
+        last_ms = database.get_last_timestamp(symbol, timeframe)
+        to_date = datetime.utcfromtimestamp(last_ms / 1000).date()
+        data = database.get_ohlcv_range_as_dataframe(symbol, timeframe, date(1970, 1, 1), to_date)
+        reports.append(validate_ohlcv(data, timeframe, symbol=symbol))
+    return reports
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Validate every series stored in the ohlcv sqlite database')
+    arg_parser.add_argument('--database-file', default=None, help='sqlite database file. Default is ohlcv_data/ohlcv_sqlite.db')
+    arg_parser.add_argument('--timeframes', nargs='*', default=None, help='only validate these timeframes, e.g. 1h 1d')
+    arg_parser.add_argument('--symbols', nargs='*', default=None, help='only validate these symbols')
+    arg_parser.add_argument('--strict-gaps', action='store_true', help='treat gaps in the bar grid as invalid')
+    args = arg_parser.parse_args()
+    with dbi.SQLite3OHLCVDatabase(database_file=args.database_file) as database:
+        database_reports = validate_database(database, args.timeframes, args.symbols)
+    for database_report in database_reports:
+        print(database_report)
+    invalid_reports = [report for report in database_reports if not report.is_valid(allow_gaps=not args.strict_gaps)]
+    print(f'{len(database_reports)} series validated, {len(invalid_reports)} invalid')
+    sys.exit(1 if invalid_reports else 0)
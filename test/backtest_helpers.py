@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""Shared fixtures for the backtest tests"""
+from pathlib import Path
+import pandas as pd
+
+SYMBOLS = ['ETH/BTC', 'LTC/BTC', 'XRP/BTC']
+
+
+class FakeDataPuller:
+    """serves every symbol of SYMBOLS from the 1h test file, starting each symbol 24 bars later than the one before"""
+
+    def __init__(self):
+        self.data = pd.read_csv(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv', parse_dates=True, index_col='Timestamp')
+        self.fetched = []
+
+    def fetch_many(self, symbols, timeframe_str, start_date_str, end_date_str=None):
+        self.fetched.extend(symbols)
+        return {symbol: self.data.iloc[SYMBOLS.index(symbol) * 24:].assign(Symbol=symbol) for symbol in symbols}
@@ -4,9 +4,76 @@ import pandas as pd
 import numpy as np
 import os
 import rba_tools.backtest.rba_backtrader_set as rbs
+import rba_tools.backtest.backtrader_extensions.strategies as rba_strategies
+from .backtest_helpers import FakeDataPuller, SYMBOLS
 
 
 class Testrbs(unittest.TestCase):
 
     def test_TrailingStopStrategy(self):
-        pass
\ No newline at end of file
+        pass
+
+    def test_parallel_run_matches_serial(self):
+        """verify running symbols in a process pool gives the same results in the same order"""
+        symbols = SYMBOLS
+        serial = rbs.BacktraderSet(symbols, rba_strategies.MaCrossStrategy, '2020-12-1', '2020-12-20', '1h', FakeDataPuller())
+        parallel = rbs.BacktraderSet(symbols, rba_strategies.MaCrossStrategy, '2020-12-1', '2020-12-20', '1h', FakeDataPuller(), max_workers=2)
+
+        self.assertEqual(symbols, [result.symbol for result in parallel.symbol_results])
+        self.assertEqual([], parallel.cerebro_run_return_list)
+        with self.assertRaises(ValueError):
+            parallel.get_cerebro_run_data(0)
+        for index in range(len(symbols)):
+            serial.current_symbol_index = parallel.current_symbol_index = index
+            self.assertEqual(serial.get_current_symbol_name(), parallel.get_current_symbol_name())
+            np.testing.assert_array_equal(serial.get_current_datetime_array(), parallel.get_current_datetime_array())
+            pd.testing.assert_frame_equal(serial.get_current_ohlcv_data(), parallel.get_current_ohlcv_data())
+            pd.testing.assert_series_equal(serial.get_current_symbol_buysell_series('buy'), parallel.get_current_symbol_buysell_series('buy'))
+            pd.testing.assert_series_equal(serial.get_current_symbol_trades_series(), parallel.get_current_symbol_trades_series())
+            self.assertEqual(serial.get_current_symbol_result().final_value, parallel.get_current_symbol_result().final_value)
+        self.assertEqual(len(serial.get_current_ohlcv_data()), len(FakeDataPuller().data) - 48)
+
+    def test_lazy_run(self):
+        """verify a lazy set only runs symbols as they're accessed, keeps their results and matches an eager set"""
+        puller = FakeDataPuller()
+        eager = rbs.BacktraderSet(SYMBOLS, rba_strategies.MaCrossStrategy, '2020-12-1', '2020-12-20', '1h', FakeDataPuller())
+        lazy = rbs.BacktraderSet(SYMBOLS, rba_strategies.MaCrossStrategy, '2020-12-1', '2020-12-20', '1h', puller, lazy=True)
+        self.assertEqual([], puller.fetched)
+        self.assertEqual([None] * len(SYMBOLS), lazy.symbol_results)
+
+        lazy.current_symbol_index = eager.current_symbol_index = 1
+        self.assertEqual('LTC/BTC', lazy.current_symbol_figure.layout.title.text)
+        pd.testing.assert_frame_equal(eager.get_current_ohlcv_data(), lazy.get_current_ohlcv_data())
+        pd.testing.assert_series_equal(eager.get_current_symbol_trades_series(), lazy.get_current_symbol_trades_series())
+        self.assertEqual(eager.get_current_symbol_result().final_value, lazy.get_current_symbol_result().final_value)
+        self.assertEqual(['LTC/BTC'], puller.fetched)
+        self.assertIsNone(lazy.symbol_results[0])
+
+        lazy.run()
+        self.assertEqual(SYMBOLS, [result.symbol for result in lazy.symbol_results])
+        self.assertEqual(['LTC/BTC', 'ETH/BTC', 'XRP/BTC'], puller.fetched)
+        self.assertEqual([result.final_value for result in eager.symbol_results], [result.final_value for result in lazy.symbol_results])
+        eager.run()
+        self.assertEqual(SYMBOLS, [result.symbol for result in eager.symbol_results])
+        self.assertEqual(len(SYMBOLS), len(eager.cerebro_run_return_list))
+        self.assertIs(eager.cerebro_run_return_list[1], eager.get_current_symbol_run_data())
+        with self.assertRaises(ValueError):
+            lazy.get_current_symbol_run_data()
+
+    def test_lazy_rejects_max_workers(self):
+        """verify lazy can't be combined with running symbols in a process pool"""
+        puller = FakeDataPuller()
+        with self.assertRaises(ValueError):
+            rbs.BacktraderSet(SYMBOLS, rba_strategies.MaCrossStrategy, '2020-12-1', '2020-12-20', '1h', puller, max_workers=2, lazy=True)
+        self.assertEqual([], puller.fetched)
+
+    def test_lazy_prefetch(self):
+        """verify the symbols after the current one are run in the background and not run again on access"""
+        puller = FakeDataPuller()
+        backtrader_set = rbs.BacktraderSet(SYMBOLS, rba_strategies.MaCrossStrategy, '2020-12-1', '2020-12-20', '1h', puller, lazy=True, prefetch=1)
+        backtrader_set.get_current_symbol_result()
+        backtrader_set.current_symbol_index = 1
+        backtrader_set.get_current_symbol_result()
+        backtrader_set.close(cancel_prefetch=False)
+        self.assertEqual(SYMBOLS, sorted(puller.fetched))
+        self.assertEqual(SYMBOLS, [result.symbol for result in backtrader_set.symbol_results])
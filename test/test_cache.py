@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Tests for cache"""
+import unittest
+from pathlib import Path
+import pandas as pd
+import rba_tools.retriever.constants as constants
+from rba_tools.retriever.cache import FetchCache
+
+
+def get_interval(data: pd.DataFrame, first: int, last: int):
+    """interval from the start of bar first through the end of bar last"""
+    timestamps = constants.datetime_index_to_epoch_ms(data.index)
+    return (int(timestamps[first]), int(timestamps[last]) + 3600000)
+
+
+class TestFetchCache(unittest.TestCase):
+    """class for testing FetchCache"""
+
+    def setUp(self):
+        self.data = pd.read_csv(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv', parse_dates=True, index_col='Timestamp')
+        self.key = ('test', 'ETH/BTC', '1H')
+
+    def test_superset_slice(self):
+        """verify a range inside the cached range is served as a slice and other ranges miss"""
+        cache = FetchCache()
+        cache.put(self.key, self.data.iloc[24:200], *get_interval(self.data, 24, 199))
+
+        result = cache.get(self.key, *get_interval(self.data, 48, 71))
+        missed = cache.get(self.key, *get_interval(self.data, 0, 71))
+
+        pd.testing.assert_frame_equal(self.data.iloc[48:72], result)
+        self.assertIsNone(missed)
+        self.assertEqual({'hits': 1, 'misses': 1}, {stat: cache.get_stats()[stat] for stat in ['hits', 'misses']})
+
+    def test_merge_overlapping_ranges(self):
+        """verify overlapping puts widen the cached range"""
+        cache = FetchCache()
+        cache.put(self.key, self.data.iloc[:100], *get_interval(self.data, 0, 99))
+        cache.put(self.key, self.data.iloc[80:200], *get_interval(self.data, 80, 199))
+
+        result = cache.get(self.key, *get_interval(self.data, 0, 199))
+        pd.testing.assert_frame_equal(self.data.iloc[:200], result)
+        self.assertEqual(1, cache.get_stats()['entries'])
+
+    def test_lru_eviction(self):
+        """verify the least recently used entry is evicted when over the byte budget"""
+        entry_bytes = int(self.data.memory_usage(index=True, deep=True).sum())
+        cache = FetchCache(max_bytes=entry_bytes * 2)
+        interval = get_interval(self.data, 0, len(self.data) - 1)
+        for symbol in ['A', 'B']:
+            cache.put(('test', symbol, '1H'), self.data, *interval)
+        cache.get(('test', 'A', '1H'), *interval)
+        cache.put(('test', 'C', '1H'), self.data, *interval)
+
+        self.assertIsNotNone(cache.get(('test', 'A', '1H'), *interval))
+        self.assertIsNone(cache.get(('test', 'B', '1H'), *interval))
+        self.assertEqual(1, cache.get_stats()['evictions'])
+        self.assertLessEqual(cache.get_stats()['bytes'], entry_bytes * 2)
+
+    def test_invalidate(self):
+        cache = FetchCache()
+        interval = get_interval(self.data, 0, 23)
+        cache.put(self.key, self.data.iloc[:24], *interval)
+        cache.put(('test', 'ETH/BTC', '1D'), self.data.iloc[:24], *interval)
+        cache.invalidate('test', 'ETH/BTC', '1H')
+
+        self.assertIsNone(cache.get(self.key, *interval))
+        self.assertIsNotNone(cache.get(('test', 'ETH/BTC', '1D'), *interval))
+
+    def test_check_version(self):
+        """verify a source's entries are dropped only when its version changes"""
+        cache = FetchCache()
+        interval = get_interval(self.data, 0, 23)
+        cache.put(self.key, self.data.iloc[:24], *interval)
+        cache.put(('other', 'ETH/BTC', '1H'), self.data.iloc[:24], *interval)
+
+        cache.check_version('test', 1)
+        cache.check_version('test', 1)
+        cache.check_version('test', None)
+        self.assertIsNotNone(cache.get(self.key, *interval))
+        cache.check_version('test', 2)
+        self.assertIsNone(cache.get(self.key, *interval))
+        self.assertIsNotNone(cache.get(('other', 'ETH/BTC', '1H'), *interval))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Tests for compact"""
+import unittest
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import backtrader as bt
+import rba_tools.retriever.compact as compact
+
+
+class TestCompact(unittest.TestCase):
+    """class for testing the compact ohlcv layout"""
+
+    def setUp(self):
+        self.data = pd.read_csv(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv', parse_dates=True, index_col='Timestamp')
+        self.multi_symbol_data = pd.concat([self.data, self.data.assign(Symbol='LTC/BTC'), self.data.assign(Symbol='XRP/BTC')])
+
+    def test_round_trip(self):
+        """verify converting to compact and back only loses float32 precision"""
+        compact_data = compact.to_compact(self.data, epoch_index=True)
+        result = compact.from_compact(compact_data)
+
+        self.assertTrue(compact.is_compact(compact_data))
+        self.assertEqual(np.float32, compact_data['Close'].dtype)
+        self.assertEqual(np.int64, compact_data.index.dtype)
+        pd.testing.assert_frame_equal(self.data, result, check_exact=False, rtol=1e-6, check_freq=False)
+
+    def test_memory_halved(self):
+        """verify a multi-symbol load takes at most half the memory in the compact layout"""
+        compact_data = compact.to_compact(self.multi_symbol_data)
+        self.assertLessEqual(compact.get_memory_usage(compact_data), compact.get_memory_usage(self.multi_symbol_data) / 2)
+
+    def test_concat_compact(self):
+        """verify concatenating frames with different symbols keeps Symbol categorical"""
+        frames = [compact.to_compact(self.data), compact.to_compact(self.data.assign(Symbol='LTC/BTC'))]
+        result = compact.concat_compact(frames)
+        self.assertTrue(compact.is_compact(result))
+        self.assertEqual(['ETH/BTC', 'LTC/BTC'], sorted(result['Symbol'].cat.categories))
+        self.assertEqual(len(self.data) * 2, len(result))
+
+    def test_backtrader_feed(self):
+        """verify compact frames can be run through bt.feeds.PandasData"""
+        cerebro = bt.Cerebro()
+        cerebro.adddata(bt.feeds.PandasData(dataname=compact.to_compact(self.data), nocase=True))
+        cerebro.addstrategy(bt.Strategy)
+        strategy = cerebro.run()[0]
+        self.assertEqual(len(self.data), len(strategy.data))
+        self.assertAlmostEqual(self.data['Close'].iloc[-1], strategy.data.close[0], places=6)
+
+
+if __name__ == "__main__":
+    unittest.main()
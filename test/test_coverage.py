@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Tests for coverage"""
+import unittest
+from datetime import date
+import numpy as np
+import rba_tools.retriever.coverage as coverage
+
+
+class TestCoverage(unittest.TestCase):
+    """class for testing coverage interval helpers"""
+
+    def test_merge_intervals(self):
+        """test overlapping and touching intervals are joined"""
+        result = coverage.merge_intervals([(5, 8), (0, 2), (2, 3), (6, 10)])
+        self.assertEqual([(0, 3), (5, 10)], result)
+
+    def test_subtract_intervals(self):
+        """test finding the parts of a range that aren't covered"""
+        self.assertEqual([(0, 10)], coverage.subtract_intervals(0, 10, []))
+        self.assertEqual([(0, 2), (4, 6), (8, 10)], coverage.subtract_intervals(0, 10, [(2, 4), (6, 8)]))
+        self.assertEqual([], coverage.subtract_intervals(3, 5, [(0, 10)]))
+
+    def test_get_data_intervals(self):
+        """test runs of consecutive bars become intervals"""
+        timestamps = np.array([0, 10, 20, 50, 60, 90])
+        result = coverage.get_data_intervals(timestamps, 10)
+        self.assertEqual([(0, 30), (50, 70), (90, 100)], result)
+        self.assertEqual([], coverage.get_data_intervals(np.array([], dtype=np.int64), 10))
+
+    def test_intervals_to_date_ranges(self):
+        """test intervals are widened to whole days and ranges on neighbouring days are joined"""
+        day_ms = 86400000
+        intervals = [(day_ms + 3600000, day_ms + 7200000), (2 * day_ms, 3 * day_ms), (5 * day_ms, 5 * day_ms + 1)]
+        result = coverage.intervals_to_date_ranges(intervals)
+        self.assertEqual([(date(1970, 1, 2), date(1970, 1, 3)), (date(1970, 1, 6), date(1970, 1, 6))], result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,9 +7,13 @@ Created on Sat Nov 01 2021
 
 """
 import os
+import shutil
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 from datetime import datetime
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from rba_tools.retriever.timeframe import Timeframe
 import rba_tools.retriever.retrievers as retrievers
@@ -27,8 +31,10 @@ class TestDatabaseInterface(unittest.TestCase):
     def setUp(self):
         """clear out test data if it exists"""
         database = dbi.SQLite3OHLCVDatabase(test=True)
-        if os.path.exists(database.get_database_file()):
-            os.remove(database.get_database_file())
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(database.get_database_file() + suffix):
+                os.remove(database.get_database_file() + suffix)
+        shutil.rmtree(dbi.NumpyColumnarOHLCVDatabase(test=True).get_root_directory(), ignore_errors=True)
 
     def test_sqlite3_blank_retrieval(self):
         """verify retrieving from blank database returns empty df"""
@@ -66,5 +72,240 @@ class TestDatabaseInterface(unittest.TestCase):
 
         pd.testing.assert_frame_equal(csv_result, db_retriever_result)
 
+    def test_sqlite3_bulk_store_overlap(self):
+        """verify overlapping bulk stores skip or replace existing rows and report new rows"""
+        csv_file = str(Path(__file__).parent) + '\\ETH_BTC_1D_12-1-20_to-12-3-20.csv'
+        csv_result = retrievers.CSVDataRetriever(csv_file).fetch_ohlcv('ETH/BTC', Timeframe.from_string('1D'), datetime(2020, 12, 1), datetime(2020, 12, 3))
+        timeframe = Timeframe.from_string('1D')
+        changed = csv_result.copy()
+        changed['Close'] = changed['Close'] * 2
+
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db:
+            self.assertEqual(2, sqlite3_db.bulk_store_dataframe(csv_result.iloc[:2], timeframe))
+            self.assertEqual(1, sqlite3_db.bulk_store_dataframe(changed, timeframe))
+            self.assertEqual(0, sqlite3_db.bulk_store_dataframe(changed, timeframe, replace=True))
+            #store_dataframe must not fail on rows that are already stored
+            sqlite3_db.store_dataframe(csv_result, timeframe)
+            db_retriever = retrievers.DatabaseRetriever(sqlite3_db)
+            result = db_retriever.fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 3))
+
+        pd.testing.assert_frame_equal(changed, result)
+
+    def test_sqlite3_multiple_symbol_retrieval(self):
+        """verify several symbols are read with one query and missing symbols are empty"""
+        timeframe = Timeframe.from_string('1D')
+        csv_file = str(Path(__file__).parent / 'ETH_BTC_1D_12-1-20_to-12-3-20.csv')
+        eth_result = retrievers.CSVDataRetriever(csv_file).fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 3))
+        ltc_result = eth_result.assign(Symbol='LTC/BTC', Close=eth_result['Close'] * 2)
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db:
+            sqlite3_db.store_dataframe(pd.concat([eth_result, ltc_result]), timeframe)
+            result = sqlite3_db.get_ohlcv_ranges_as_dataframes(['LTC/BTC', 'ETH/BTC', 'XRP/BTC'], timeframe, datetime(2020, 12, 1), datetime(2020, 12, 3))
+
+        self.assertEqual(['LTC/BTC', 'ETH/BTC', 'XRP/BTC'], list(result))
+        pd.testing.assert_frame_equal(eth_result, result['ETH/BTC'])
+        pd.testing.assert_frame_equal(ltc_result, result['LTC/BTC'])
+        self.assertTrue(result['XRP/BTC'].empty)
+
+    def test_sqlite3_timestamps_stored_as_epoch_ms(self):
+        """verify timestamps are stored as integer epoch milliseconds"""
+        timeframe = Timeframe.from_string('1D')
+        csv_file = str(Path(__file__).parent) + '\\ETH_BTC_1D_12-1-20_to-12-3-20.csv'
+        csv_result = retrievers.CSVDataRetriever(csv_file).fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 3))
+
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db:
+            sqlite3_db.store_dataframe(csv_result, timeframe)
+            result = sqlite3_db._execute_query('SELECT typeof(Timestamp), Timestamp FROM TIMEFRAME_1D ORDER BY Timestamp LIMIT 1')
+
+        self.assertEqual([('integer', 1606780800000)], result)
+
+    def test_sqlite3_migrate_text_timestamps(self):
+        """verify text timestamps written by older versions are migrated to epoch milliseconds"""
+        timeframe = Timeframe.from_string('1D')
+        from_date = datetime(2020, 12, 1)
+        to_date = datetime(2020, 12, 3)
+        csv_file = str(Path(__file__).parent) + '\\ETH_BTC_1D_12-1-20_to-12-3-20.csv'
+        csv_result = retrievers.CSVDataRetriever(csv_file).fetch_ohlcv('ETH/BTC', timeframe, from_date, to_date)
+
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db:
+            #write the table the way older versions did
+            sqlite3_db.create_OHLCV_table_if_not_exists(timeframe)
+            csv_result.to_sql(timeframe.get_timeframe_table_name(), sqlite3_db.get_connection(), if_exists='append')
+            db_retriever = retrievers.DatabaseRetriever(sqlite3_db)
+            self.assertTrue(db_retriever.fetch_ohlcv('ETH/BTC', timeframe, from_date, to_date).empty)
+
+            self.assertEqual({'TIMEFRAME_1D': 3}, sqlite3_db.migrate_timestamps_to_epoch_ms())
+            result = db_retriever.fetch_ohlcv('ETH/BTC', timeframe, from_date, to_date)
+
+        pd.testing.assert_frame_equal(csv_result, result)
+
+    def test_sqlite3_stored_series(self):
+        """verify only timeframe tables are listed, not tables that match TIMEFRAME_% as a LIKE pattern"""
+        csv_file = str(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv')
+        data = pd.read_csv(csv_file, parse_dates=True, index_col='Timestamp')
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db:
+            sqlite3_db.store_dataframe(data, Timeframe.from_string('1H'))
+            with sqlite3_db.get_connection() as connection:
+                for table_name in ['TIMEFRAMEX1H', 'timeframe_backup']:
+                    connection.execute(f'CREATE TABLE {table_name} (Symbol string)')
+                    connection.execute(f"INSERT INTO {table_name} VALUES ('ETH/USD')")
+            self.assertEqual([('ETH/BTC', Timeframe.from_string('1H'))], sqlite3_db.get_stored_series())
+            self.assertEqual(['TIMEFRAME_1H'], list(sqlite3_db.migrate_timestamps_to_epoch_ms()))
+
+    def test_sqlite3_connection_reused(self):
+        """verify a single connection is opened per thread and reused across calls"""
+        timeframe = Timeframe.from_string('1D')
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db:
+            connection = sqlite3_db.get_connection()
+            sqlite3_db.store_dataframe(empty_ohlcv_df_generator(), timeframe)
+            sqlite3_db.get_query_result_as_dataframe('SELECT * FROM TIMEFRAME_1D', timeframe)
+            self.assertIs(connection, sqlite3_db.get_connection())
+            self.assertIn(timeframe.get_timeframe_table_name(), sqlite3_db._existing_tables)
+
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                thread_connection = executor.submit(sqlite3_db.get_connection).result()
+            self.assertIsNot(connection, thread_connection)
+            self.assertEqual(2, len(sqlite3_db._connections))
+        self.assertEqual([], sqlite3_db._connections)
+
+    def test_sqlite3_wal_mode(self):
+        """verify the database is opened with WAL journaling"""
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db:
+            result = sqlite3_db._execute_query('PRAGMA journal_mode')
+        self.assertEqual([('wal',)], result)
+
+    def test_columnar_csv_store_and_retrieve(self):
+        """verify retriving from the columnar database matches csv result and overlapping stores are merged"""
+        csv_file = str(Path(__file__).parent) + '\\ETH_BTC_1H_2020-12-1_to_2020-12-20.csv'
+        retriever = retrievers.CSVDataRetriever(csv_file)
+        symbol = 'ETH/BTC'
+        timeframe = Timeframe.from_string('1H')
+        from_date = datetime(2020, 12, 1)
+        to_date = datetime(2020, 12, 20)
+        csv_result = retriever.fetch_ohlcv(symbol, timeframe, from_date, to_date)
+
+        columnar_db = dbi.NumpyColumnarOHLCVDatabase(test=True)
+        self.assertEqual(240, columnar_db.bulk_store_dataframe(csv_result.iloc[:240], timeframe))
+        self.assertEqual(len(csv_result) - 240, columnar_db.bulk_store_dataframe(csv_result.iloc[200:], timeframe))
+
+        db_retriever = retrievers.DatabaseRetriever(columnar_db)
+        result = db_retriever.fetch_ohlcv(symbol, timeframe, from_date, to_date)
+        pd.testing.assert_frame_equal(csv_result, result, check_freq=False)
+
+        partial_result = db_retriever.fetch_ohlcv(symbol, timeframe, datetime(2020, 12, 5), datetime(2020, 12, 6))
+        pd.testing.assert_frame_equal(csv_result.loc['2020-12-05':'2020-12-06'], partial_result, check_freq=False)
+
+    def test_columnar_query(self):
+        """verify SQL queries on the columnar database match the same queries on sqlite"""
+        timeframe = Timeframe.from_string('1H')
+        csv_file = str(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv')
+        data = pd.read_csv(csv_file, parse_dates=True, index_col='Timestamp')
+        data = pd.concat([data, data.iloc[:48].assign(Symbol='ETH/USD')])
+        query = f"""SELECT * FROM TIMEFRAME_1H WHERE Symbol = 'ETH/USD' OR Timestamp >= {1608249600000} ORDER BY Symbol, Timestamp"""
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db, dbi.NumpyColumnarOHLCVDatabase(True) as columnar_db:
+            self.assertTrue(columnar_db.get_query_result_as_dataframe(query, timeframe).empty)
+            sqlite3_db.store_dataframe(data, timeframe)
+            columnar_db.store_dataframe(data, timeframe)
+            expected = sqlite3_db.get_query_result_as_dataframe(query, timeframe)
+            result = columnar_db.get_query_result_as_dataframe(query, timeframe)
+        self.assertEqual(48 + 72, len(result))
+        pd.testing.assert_frame_equal(expected, result, check_dtype=False)
+
+    def test_iter_ohlcv_range(self):
+        """verify both databases stream the range in bounded chunks that match a full read"""
+        timeframe = Timeframe.from_string('1H')
+        csv_file = str(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv')
+        csv_result = retrievers.CSVDataRetriever(csv_file).fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 20))
+        from_date, to_date = datetime(2020, 12, 3), datetime(2020, 12, 8)
+        expected = csv_result.loc['2020-12-03':'2020-12-08']
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db, dbi.NumpyColumnarOHLCVDatabase(True) as columnar_db:
+            for database in [sqlite3_db, columnar_db]:
+                database.store_dataframe(csv_result, timeframe)
+                chunks = list(retrievers.DatabaseRetriever(database).iter_ohlcv('ETH/BTC', timeframe, from_date, to_date, chunksize=40))
+                self.assertTrue(all(len(chunk) <= 40 for chunk in chunks))
+                pd.testing.assert_frame_equal(expected, pd.concat(chunks), check_freq=False)
+
+    def test_columnar_float32_prices(self):
+        """verify the columnar database can store prices as float32"""
+        timeframe = Timeframe.from_string('1H')
+        csv_file = str(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv')
+        csv_result = retrievers.CSVDataRetriever(csv_file).fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 20))
+        with dbi.NumpyColumnarOHLCVDatabase(True, price_dtype=np.float32) as columnar_db:
+            columnar_db.store_dataframe(csv_result, timeframe)
+            result = columnar_db.get_ohlcv_range_as_dataframe('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 20))
+
+        self.assertEqual(np.float32, result['Close'].dtype)
+        self.assertEqual(np.float64, result['Volume'].dtype)
+        pd.testing.assert_frame_equal(csv_result, result, check_dtype=False, check_exact=False, rtol=1e-6, check_freq=False)
+
+    def test_columnar_year_partitions(self):
+        """verify ranges spanning several year partitions are stitched together"""
+        timeframe = Timeframe.from_string('1D')
+        index = pd.date_range('2019-12-25', '2021-01-05', freq='D', name='Timestamp')
+        data = pd.DataFrame({'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': 1.5, 'Volume': 10.0, 'Symbol': 'ETH/BTC'}, index=index)
+
+        columnar_db = dbi.NumpyColumnarOHLCVDatabase(test=True)
+        columnar_db.store_dataframe(data, timeframe)
+        single_year = columnar_db.get_ohlcv_range_as_arrays('ETH/BTC', timeframe, datetime(2020, 3, 1), datetime(2020, 3, 31))
+        result = columnar_db.get_ohlcv_range_as_dataframe('ETH/BTC', timeframe, datetime(2019, 12, 30), datetime(2021, 1, 2))
+
+        self.assertIsInstance(single_year['Close'], np.memmap)
+        self.assertEqual(31, len(single_year['Close']))
+        pd.testing.assert_frame_equal(data.loc['2019-12-30':'2021-01-02'], result, check_freq=False)
+        self.assertTrue(columnar_db.get_ohlcv_range_as_dataframe('ETH/USD', timeframe, datetime(2020, 1, 1), datetime(2020, 1, 2)).empty)
+
+    def test_columnar_store_while_mapped(self):
+        """verify storing over a partition that is still memory mapped by a loaded frame doesn't rename
+        anything mapped, which windows refuses, and leaves the loaded frame intact"""
+        timeframe = Timeframe.from_string('1D')
+        index = pd.date_range('2020-01-01', '2020-01-10', freq='D', name='Timestamp')
+        data = pd.DataFrame({'Open': 1.0, 'High': 2.0, 'Low': 0.5, 'Close': 1.5, 'Volume': 10.0, 'Symbol': 'ETH/BTC'}, index=index)
+        new_data = data.assign(Close=3.0)
+        replace = os.replace
+
+        def replace_files_only(source, destination):
+            if os.path.isdir(source):
+                raise PermissionError('directory is in use')
+            replace(source, destination)
+
+        columnar_db = dbi.NumpyColumnarOHLCVDatabase(test=True)
+        columnar_db.store_dataframe(data, timeframe)
+        loaded = columnar_db.get_ohlcv_range_as_dataframe('ETH/BTC', timeframe, datetime(2020, 1, 1), datetime(2020, 1, 10))
+        mapped = columnar_db.get_ohlcv_range_as_arrays('ETH/BTC', timeframe, datetime(2020, 1, 1), datetime(2020, 1, 10))
+        with patch.object(dbi.os, 'replace', side_effect=replace_files_only):
+            columnar_db.bulk_store_dataframe(new_data, timeframe, replace=True)
+        result = columnar_db.get_ohlcv_range_as_dataframe('ETH/BTC', timeframe, datetime(2020, 1, 1), datetime(2020, 1, 10))
+
+        pd.testing.assert_frame_equal(data, loaded, check_freq=False)
+        np.testing.assert_array_equal(data['Close'].to_numpy(), mapped['Close'])
+        pd.testing.assert_frame_equal(new_data, result, check_freq=False)
+        partition_directory = columnar_db.get_root_directory() / 'TIMEFRAME_1D' / 'ETH%2FBTC' / '2020'
+        self.assertEqual([dbi.get_npy_columns_directory(partition_directory)], [path for path in partition_directory.iterdir() if path.is_dir()])
+
+    def test_coverage(self):
+        """verify coverage intervals are merged when they overlap or touch for both databases"""
+        timeframe = Timeframe.from_string('1H')
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db:
+            for database in [sqlite3_db, dbi.NumpyColumnarOHLCVDatabase(test=True)]:
+                database.add_coverage('ETH/BTC', timeframe, 100, 200)
+                database.add_coverage('ETH/BTC', timeframe, 300, 400)
+                database.add_coverage('ETH/USD', timeframe, 0, 1000)
+                self.assertEqual([(100, 200), (300, 400)], database.get_coverage('ETH/BTC', timeframe))
+                database.add_coverage('ETH/BTC', timeframe, 150, 300)
+                self.assertEqual([(100, 400)], database.get_coverage('ETH/BTC', timeframe))
+                self.assertEqual([], database.get_coverage('ETH/BTC', Timeframe.from_string('1D')))
+
+    def test_cache_source_and_data_version(self):
+        """verify objects on the same files share a cache source and see each other's writes in the data version"""
+        csv_file = str(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv')
+        data = pd.read_csv(csv_file, parse_dates=True, index_col='Timestamp')
+        timeframe = Timeframe.from_string('1H')
+        with dbi.SQLite3OHLCVDatabase(True) as sqlite3_db, dbi.SQLite3OHLCVDatabase(True) as other_sqlite3_db:
+            for database, other_database in [(sqlite3_db, other_sqlite3_db), (dbi.NumpyColumnarOHLCVDatabase(True), dbi.NumpyColumnarOHLCVDatabase(True))]:
+                self.assertEqual(database.get_cache_source(), other_database.get_cache_source())
+                version = database.get_data_version()
+                other_database.store_dataframe(data.iloc[:24], timeframe)
+                self.assertNotEqual(version, database.get_data_version())
+                self.assertEqual(database.get_data_version(), database.get_data_version())
+
 if __name__ == "__main__":
     unittest.main()
@@ -7,6 +7,7 @@ Created on Sat Nov 01 2021
 
 """
 import os
+import tempfile
 import unittest
 from unittest.mock import patch
 import pandas as pd
@@ -16,6 +17,8 @@ import rba_tools.retriever.constants as constants
 import rba_tools.retriever.get_crypto_data as gcd
 import rba_tools.retriever.retrievers as retrievers
 import rba_tools.retriever.database_interface as dbi
+from rba_tools.retriever.cache import FetchCache
+import rba_tools.retriever.compact as compact
 from dateutil import parser
 from pathlib import Path
 from unittest.mock import MagicMock
@@ -30,8 +33,9 @@ class TestMain(unittest.TestCase):
     def setUp(self):
         self.sqlite_database = dbi.SQLite3OHLCVDatabase(test=True)
         self.sqlite_database = dbi.SQLite3OHLCVDatabase(test=True)
-        if os.path.exists(self.sqlite_database.get_database_file()):
-            os.remove(self.sqlite_database.get_database_file())
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.sqlite_database.get_database_file() + suffix):
+                os.remove(self.sqlite_database.get_database_file() + suffix)
 
         self.sqlite_retriever = retrievers.DatabaseRetriever(self.sqlite_database)
         self.ccxt_retriever = retrievers.CCXTDataRetriever('kraken')
@@ -39,6 +43,9 @@ class TestMain(unittest.TestCase):
         self.csv_retriver_1h = retrievers.CSVDataRetriever(self.file_path_1h)
         self.file_path_1d = str(Path(__file__).parent) + r'\ETH_BTC_1D_2020-12-1_to_2020-12-20.csv'
         self.csv_retriver_1d = retrievers.CSVDataRetriever(self.file_path_1d)
+
+    def tearDown(self):
+        self.sqlite_database.close()
     
     def test_main_online(self):
         """test pulling data from online source"""
@@ -160,6 +167,214 @@ class TestMain(unittest.TestCase):
         puller.online_pull.assert_any_call(symbol, tf, full_from_date, partial_from_date)
         puller.online_pull.assert_called_with(symbol, tf, partial_to_date, full_to_date)
 
+    def test_main_interior_gap_pull(self):
+        """verify only a missing range in the middle of the stored data is pulled and that it is pulled once"""
+        csv_puller = gcd.DataPuller(online_retriever=self.csv_retriver_1h, database=self.sqlite_database)
+        puller = gcd.DataPuller(online_retriever=self.csv_retriver_1h,
+                                       stored_retriever=self.sqlite_retriever,
+                                       database=self.sqlite_database)
+        symbol = 'ETH/BTC'
+        timeframe_str = '1h'
+        tf = Timeframe.from_string(timeframe_str)
+
+        csv_puller.fetch_df(symbol, timeframe_str, '12-1-2020', '12-4-2020')
+        csv_puller.fetch_df(symbol, timeframe_str, '12-10-2020', '12-20-2020')
+        puller.online_pull = MagicMock(wraps=puller.online_pull)
+        result = puller.fetch_df(symbol, timeframe_str, '12-1-2020', '12-20-2020')
+        puller.online_pull.assert_called_once_with(symbol, tf, parser.parse('12-5-2020').date(), parser.parse('12-9-2020').date())
+
+        puller.online_pull.reset_mock()
+        repeat_result = puller.fetch_df(symbol, timeframe_str, '12-1-2020', '12-20-2020')
+        puller.online_pull.assert_not_called()
+
+        expected = pd.read_csv(self.file_path_1h, parse_dates=True, index_col='Timestamp')
+        pd.testing.assert_frame_equal(expected, result)
+        pd.testing.assert_frame_equal(expected, repeat_result)
+
+    def test_get_missing_date_ranges(self):
+        """verify missing ranges come from both stored bars and recorded coverage"""
+        puller = gcd.DataPuller(database=self.sqlite_database)
+        tf = Timeframe.from_string('1h')
+        data = pd.read_csv(self.file_path_1h, parse_dates=True, index_col='Timestamp')
+        data = data.drop(data.loc['2020-12-08 05:00':'2020-12-08 07:00'].index)
+        day = lambda day_of_month: parser.parse(f'12-{day_of_month}-2020').date()
+
+        result = puller.get_missing_date_ranges(data, 'ETH/BTC', tf, day(1), day(22))
+        self.assertEqual([(day(8), day(8)), (day(21), day(22))], result)
+
+        self.sqlite_database.add_coverage('ETH/BTC', tf, 1607385600000, 1607472000000) #12-8-2020 through 12-8-2020
+        result = puller.get_missing_date_ranges(data, 'ETH/BTC', tf, day(1), day(22))
+        self.assertEqual([(day(21), day(22))], result)
+
+    def test_main_derived_timeframes(self):
+        """verify 4h and 1d bars are built from the 1h bars and stored so they aren't built again"""
+        puller = gcd.DataPuller(online_retriever=self.csv_retriver_1h,
+                                stored_retriever=self.sqlite_retriever,
+                                database=self.sqlite_database,
+                                base_timeframes=['1h'])
+        symbol = 'ETH/BTC'
+        puller.online_pull = MagicMock(wraps=puller.online_pull)
+
+        result_4h = puller.fetch_df(symbol, '4h', '12-1-2020', '12-3-2020')
+        result_1d = puller.fetch_df(symbol, '1d', '12-1-2020', '12-20-2020')
+        for call in puller.online_pull.call_args_list:
+            self.assertEqual(Timeframe.from_string('1h'), call.args[1])
+
+        puller.online_pull.reset_mock()
+        puller.derive_pull = MagicMock(wraps=puller.derive_pull)
+        repeat_result_1d = puller.fetch_df(symbol, '1d', '12-1-2020', '12-20-2020')
+        puller.online_pull.assert_not_called()
+        puller.derive_pull.assert_not_called()
+
+        expected_4h = pd.read_csv(str(Path(__file__).parent / 'ETH_BTC_4h_12-1-20_to_12-3-20.csv'), parse_dates=True, index_col='Timestamp')
+        expected_1d = pd.read_csv(self.file_path_1d, parse_dates=True, index_col='Timestamp')
+        #the 4h file ends at the first bar of 12-3
+        self.assertEqual(18, len(result_4h))
+        pd.testing.assert_frame_equal(expected_4h, result_4h.iloc[:len(expected_4h)], check_freq=False)
+        pd.testing.assert_frame_equal(expected_1d, result_1d, check_freq=False)
+        pd.testing.assert_frame_equal(expected_1d, repeat_result_1d, check_freq=False)
+
+    def test_main_derived_timeframes_base_grows(self):
+        """verify derived bars are only recorded as complete where base bars exist so they're rebuilt as the base grows"""
+        puller = gcd.DataPuller(stored_retriever=self.sqlite_retriever, database=self.sqlite_database, base_timeframes=['1h'])
+        symbol = 'ETH/BTC'
+        data_1h = pd.read_csv(self.file_path_1h, parse_dates=True, index_col='Timestamp')
+        self.sqlite_database.store_dataframe(data_1h.loc[:'2020-12-10'], Timeframe.from_string('1h'))
+
+        partial_result = puller.fetch_df(symbol, '4h', '12-1-2020', '12-20-2020')
+        self.assertEqual(pd.Timestamp('2020-12-10 20:00'), partial_result.index[-1])
+        self.assertEqual([(1606780800000, 1607644800000)], self.sqlite_database.get_coverage(symbol, Timeframe.from_string('4h'))) #12-1-2020 through 12-10-2020
+
+        self.sqlite_database.store_dataframe(data_1h, Timeframe.from_string('1h'))
+        result = puller.fetch_df(symbol, '4h', '12-1-2020', '12-20-2020')
+        pd.testing.assert_frame_equal(partial_result, result.loc[:'2020-12-10'])
+        self.assertEqual(pd.Timestamp('2020-12-20 20:00'), result.index[-1])
+        self.assertEqual(20 * 6, len(result))
+
+    def test_main_fetch_cache(self):
+        """verify sub-ranges of a cached fetch don't query the database and stored data invalidates the cache"""
+        fetch_cache = FetchCache()
+        puller = gcd.DataPuller(online_retriever=self.csv_retriver_1h,
+                                stored_retriever=self.sqlite_retriever,
+                                database=self.sqlite_database,
+                                cache=fetch_cache)
+        symbol = 'ETH/BTC'
+        timeframe_str = '1h'
+        expected = pd.read_csv(self.file_path_1h, parse_dates=True, index_col='Timestamp')
+
+        result = puller.fetch_df(symbol, timeframe_str, '12-1-2020', '12-20-2020')
+        with patch('rba_tools.retriever.get_crypto_data.retrievers.DatabaseRetriever.fetch_ohlcv') as stored_fetch:
+            partial_result = puller.fetch_df(symbol, timeframe_str, '12-5-2020', '12-10-2020')
+            stored_fetch.assert_not_called()
+
+        puller.store_dataframe(expected.iloc[:1], Timeframe.from_string(timeframe_str))
+        self.assertEqual(0, fetch_cache.get_stats()['entries'])
+
+        pd.testing.assert_frame_equal(expected, result)
+        pd.testing.assert_frame_equal(expected.loc['2020-12-05':'2020-12-10'], partial_result)
+        self.assertEqual(1, fetch_cache.get_stats()['hits'])
+
+    def test_main_fetch_cache_shared_database(self):
+        """verify pullers on the same database file share entries and writes through any object drop them"""
+        fetch_cache = FetchCache()
+        expected = pd.read_csv(self.file_path_1h, parse_dates=True, index_col='Timestamp')
+        timeframe = Timeframe.from_string('1h')
+        self.sqlite_database.store_dataframe(expected.loc[:'2020-12-10'], timeframe)
+        puller = gcd.DataPuller(stored_retriever=self.sqlite_retriever, database=self.sqlite_database, cache=fetch_cache)
+        other_database = dbi.SQLite3OHLCVDatabase(test=True)
+        other_puller = gcd.DataPuller(stored_retriever=retrievers.DatabaseRetriever(other_database), database=other_database, cache=fetch_cache)
+        self.assertEqual(puller.cache_source, other_puller.cache_source)
+
+        puller.fetch_df('ETH/BTC', '1h', '12-1-2020', '12-5-2020')
+        other_puller.fetch_df('ETH/BTC', '1h', '12-2-2020', '12-3-2020')
+        self.assertEqual(1, fetch_cache.get_stats()['hits'])
+
+        #a write through a database object the cache doesn't know about is seen through the file's version
+        with dbi.SQLite3OHLCVDatabase(test=True) as writer:
+            writer.bulk_store_dataframe(expected.loc['2020-12-03':'2020-12-03 05:00'].assign(Close=1.0), timeframe, replace=True)
+        result = puller.fetch_df('ETH/BTC', '1h', '12-2-2020', '12-3-2020')
+        self.assertEqual(1, fetch_cache.get_stats()['hits'])
+        self.assertTrue((result.loc['2020-12-03':'2020-12-03 05:00', 'Close'] == 1.0).all())
+
+        other_database.close()
+        self.assertEqual(0, fetch_cache.get_stats()['entries'])
+
+    def test_main_fetch_many(self):
+        """verify fetch_many matches fetch_df, reads stored data in one call and pulls shared ranges together"""
+        data = pd.read_csv(self.file_path_1h, parse_dates=True, index_col='Timestamp')
+        symbols = ['ETH/BTC', 'LTC/BTC']
+        with tempfile.TemporaryDirectory() as directory:
+            csv_file = str(Path(directory) / 'two_symbols.csv')
+            pd.concat([data, data.assign(Symbol='LTC/BTC')]).to_csv(csv_file)
+            csv_retriever = retrievers.CSVDataRetriever(csv_file)
+            puller = gcd.DataPuller(online_retriever=csv_retriever,
+                                    stored_retriever=self.sqlite_retriever,
+                                    database=self.sqlite_database)
+            puller.fetch_df('ETH/BTC', '1h', '12-1-2020', '12-10-2020')
+            puller.fetch_df('LTC/BTC', '1h', '12-1-2020', '12-10-2020')
+
+            csv_retriever.fetch_many_ohlcv = MagicMock(wraps=csv_retriever.fetch_many_ohlcv)
+            result = puller.fetch_many(symbols, '1h', '12-1-2020', '12-20-2020')
+            csv_retriever.fetch_many_ohlcv.assert_called_once_with(['ETH/BTC', 'LTC/BTC'], Timeframe.from_string('1h'),
+                                                                   parser.parse('12-11-2020').date(), parser.parse('12-20-2020').date())
+
+            with patch.object(self.sqlite_database, 'get_ohlcv_range_as_dataframe') as single_query:
+                stored_result = puller.fetch_many(symbols, '1h', '12-1-2020', '12-20-2020', as_frame=True)
+                single_query.assert_not_called()
+
+        self.assertEqual(symbols, list(result))
+        pd.testing.assert_frame_equal(data, result['ETH/BTC'])
+        pd.testing.assert_frame_equal(data.assign(Symbol='LTC/BTC'), result['LTC/BTC'])
+        pd.testing.assert_frame_equal(pd.concat([result['ETH/BTC'], result['LTC/BTC']]), stored_result)
+
+    def test_main_fetch_many_as_frame_order(self):
+        """verify as_frame results are ordered by symbol then timestamp whatever order the symbols are given in"""
+        data = pd.read_csv(self.file_path_1h, parse_dates=True, index_col='Timestamp')
+        with tempfile.TemporaryDirectory() as directory:
+            csv_file = str(Path(directory) / 'three_symbols.csv')
+            pd.concat([data, data.assign(Symbol='LTC/BTC'), data.assign(Symbol='ADA/BTC')]).to_csv(csv_file)
+            csv_retriever = retrievers.CSVDataRetriever(csv_file)
+            puller = gcd.DataPuller(online_retriever=csv_retriever, stored_retriever=self.sqlite_retriever,
+                                    database=self.sqlite_database)
+            compact_puller = gcd.DataPuller(online_retriever=csv_retriever, stored_retriever=self.sqlite_retriever,
+                                            database=self.sqlite_database, compact=True)
+            symbols = ['LTC/BTC', 'ETH/BTC', 'ADA/BTC']
+            result = puller.fetch_many(symbols, '1h', '12-1-2020', '12-20-2020', as_frame=True)
+            compact_result = compact_puller.fetch_many(symbols, '1h', '12-1-2020', '12-20-2020', as_frame=True)
+
+        expected = pd.concat([data.assign(Symbol='ADA/BTC'), data, data.assign(Symbol='LTC/BTC')])
+        pd.testing.assert_frame_equal(expected, result)
+        pd.testing.assert_frame_equal(expected, compact.from_compact(compact_result), check_exact=False, rtol=1e-6)
+
+    def test_main_iter_df(self):
+        """verify streamed chunks are bounded, match fetch_df and are stored as they are pulled"""
+        puller = gcd.DataPuller(online_retriever=self.csv_retriver_1h,
+                                stored_retriever=self.sqlite_retriever,
+                                database=self.sqlite_database)
+        symbol = 'ETH/BTC'
+        chunks = list(puller.iter_df(symbol, '1h', '12-1-2020', '12-20-2020', chunksize=50))
+
+        with patch('rba_tools.retriever.get_crypto_data.retrievers.CSVDataRetriever.fetch_ohlcv') as online_fetch:
+            stored_result = puller.fetch_df(symbol, '1h', '12-1-2020', '12-20-2020')
+            online_fetch.assert_not_called()
+
+        expected = pd.read_csv(self.file_path_1h, parse_dates=True, index_col='Timestamp')
+        self.assertTrue(all(len(chunk) <= 50 for chunk in chunks))
+        pd.testing.assert_frame_equal(expected, pd.concat(chunks))
+        pd.testing.assert_frame_equal(expected, stored_result)
+
+    def test_main_compact(self):
+        """verify a compact puller returns the compact layout for single and multiple symbol fetches"""
+        puller = gcd.DataPuller(online_retriever=self.csv_retriver_1h, database=self.sqlite_database, compact=True)
+        expected = pd.read_csv(self.file_path_1h, parse_dates=True, index_col='Timestamp')
+
+        result = puller.fetch_df('ETH/BTC', '1h', '12-1-2020', '12-20-2020')
+        many_result = puller.fetch_many(['ETH/BTC'], '1h', '12-1-2020', '12-20-2020', as_frame=True)
+
+        self.assertTrue(compact.is_compact(result))
+        self.assertTrue(compact.is_compact(many_result))
+        pd.testing.assert_frame_equal(expected, compact.from_compact(result), check_exact=False, rtol=1e-6)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
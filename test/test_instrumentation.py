@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Tests for instrumentation"""
+import json
+import logging
+import tempfile
+import unittest
+from pathlib import Path
+import rba_tools.retriever.get_crypto_data as gcd
+import rba_tools.retriever.retrievers as retrievers
+import rba_tools.retriever.database_interface as dbi
+from rba_tools.retriever.cache import FetchCache
+from rba_tools.retriever.instrumentation import Metrics, MetricsSink, InMemorySink, JSONLinesSink, LoggingSink, NullSink, NULL_METRICS
+
+
+class TestInstrumentation(unittest.TestCase):
+    """class for testing instrumentation"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = dbi.SQLite3OHLCVDatabase(database_file=str(Path(self.directory.name) / 'ohlcv.db'))
+        self.online_retriever = retrievers.CSVDataRetriever(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv')
+        self.puller = gcd.DataPuller(stored_retriever=retrievers.DatabaseRetriever(self.database),
+                                     online_retriever=self.online_retriever, database=self.database, cache=FetchCache())
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_disabled_by_default(self):
+        """verify components use the shared disabled metrics and timers record nothing"""
+        self.assertIs(NULL_METRICS, self.puller.metrics)
+        self.assertIs(NULL_METRICS, self.database.metrics)
+        self.assertIs(NULL_METRICS, self.online_retriever.metrics)
+        self.assertFalse(Metrics(NullSink()).enabled)
+        self.assertIs(NULL_METRICS.timer('puller.fetch'), NULL_METRICS.timer('puller.store'))
+
+    def test_fetch_stages(self):
+        """verify a fetch records the stages of the puller, retrievers and database"""
+        metrics = Metrics(InMemorySink())
+        self.puller.set_metrics(metrics)
+        self.assertIs(metrics, self.database.metrics)
+
+        result = self.puller.fetch_df('ETH/BTC', '1h', '2020-12-1', '2020-12-5')
+        self.puller.fetch_df('ETH/BTC', '1h', '2020-12-2', '2020-12-3')
+
+        sink = metrics.sink
+        self.assertEqual(2, sink.get_count('puller.calls'))
+        self.assertEqual(1, sink.get_count('puller.cache_hits'))
+        self.assertEqual(1, sink.get_count('puller.cache_misses'))
+        self.assertEqual(len(result), sink.get_count('puller.online_rows'))
+        self.assertEqual(len(result), sink.get_count('database.rows_stored'))
+        self.assertEqual(2, sink.get_count('retriever.calls'))
+        self.assertGreater(sink.get_count('retriever.bytes_parsed'), 0)
+        self.assertEqual(2, sink.get_timing('puller.fetch')['count'])
+        for stage in ['puller.stored_fetch', 'puller.online_pull', 'puller.store', 'database.query', 'database.store', 'retriever.parse']:
+            self.assertEqual(1, sink.get_timing(stage)['count'], stage)
+        self.assertEqual('puller.fetch', sink.get_summary().index[0])
+
+    def test_fetch_many_stages(self):
+        """verify a batched fetch records the rows read from the database for each symbol"""
+        self.puller.fetch_df('ETH/BTC', '1h', '2020-12-1', '2020-12-5')
+        self.puller.cache = None
+        metrics = Metrics(InMemorySink())
+        self.puller.set_metrics(metrics)
+
+        result = self.puller.fetch_many(['ETH/BTC'], '1h', '2020-12-2', '2020-12-3')
+
+        sink = metrics.sink
+        self.assertEqual(1, sink.get_count('puller.calls'))
+        self.assertEqual(1, sink.get_timing('puller.fetch')['count'])
+        self.assertEqual(1, sink.get_count('retriever.calls'))
+        self.assertEqual(len(result['ETH/BTC']), sink.get_count('retriever.rows'))
+        self.assertEqual(1, sink.get_timing('database.query')['count'])
+
+    def test_sink_interface(self):
+        """verify sinks must implement record"""
+        with self.assertRaises(TypeError):
+            MetricsSink()
+
+    def test_json_lines_sink(self):
+        """verify each event is written as a line of json"""
+        file = Path(self.directory.name) / 'metrics.jsonl'
+        sink = JSONLinesSink(file)
+        metrics = Metrics(sink)
+        metrics.count('retriever.rows', 5, symbol='ETH/BTC')
+        with metrics.timer('database.query'):
+            pass
+        sink.close()
+        events = [json.loads(line) for line in file.read_text().splitlines()]
+        self.assertEqual([('retriever.rows', 'count', 5), ('database.query', 'timing')],
+                         [(event['name'], event['kind'], event['value']) if event['kind'] == 'count' else (event['name'], event['kind']) for event in events])
+        self.assertEqual('ETH/BTC', events[0]['symbol'])
+
+    def test_logging_sink(self):
+        """verify events are logged"""
+        with self.assertLogs('rba_tools.metrics', level=logging.INFO) as logs:
+            Metrics(LoggingSink()).count('puller.cache_hits', symbol='ETH/BTC')
+        self.assertIn('puller.cache_hits count 1 symbol=ETH/BTC', logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Tests for kraken_import"""
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+from zipfile import ZipFile
+import pandas as pd
+from rba_tools.retriever.timeframe import Timeframe
+import rba_tools.retriever.retrievers as retrievers
+import rba_tools.retriever.database_interface as dbi
+import rba_tools.retriever.kraken_import as kraken_import
+
+
+def write_kraken_zip(kraken_file: str, members: dict):
+    """write a zip with members in the headerless kraken csv format from ohlcv dataframes"""
+    with ZipFile(kraken_file, 'w') as kraken_zip:
+        for member_name, data in members.items():
+            kraken_rows = data.drop(columns='Symbol')
+            kraken_rows.index = kraken_rows.index.view('int64') // 10**9
+            kraken_rows['Trades'] = 1
+            kraken_zip.writestr(member_name, kraken_rows.to_csv(header=False))
+
+
+class TestKrakenImport(unittest.TestCase):
+    """class for testing KrakenArchiveImporter"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = dbi.SQLite3OHLCVDatabase(database_file=str(Path(self.directory.name) / 'ohlcv.db'))
+        self.state_file = str(Path(self.directory.name) / 'state.json')
+        self.kraken_file = str(Path(self.directory.name) / 'Kraken_OHLCVT.zip')
+        self.data_1h = pd.read_csv(Path(__file__).parent / 'Kraken_ETCUSD_60.csv', parse_dates=True, index_col='Timestamp')
+        self.data_1d = pd.read_csv(Path(__file__).parent / 'Kraken_ETCUSD_1440.csv', parse_dates=True, index_col='Timestamp')
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_kraken_pair_to_symbol(self):
+        """test converting kraken pairs to symbols"""
+        self.assertEqual('ETH/USD', kraken_import.kraken_pair_to_symbol('ETHUSD'))
+        self.assertEqual('ETH/USDT', kraken_import.kraken_pair_to_symbol('ETHUSDT'))
+        self.assertEqual('ETH/XBT', kraken_import.kraken_pair_to_symbol('ETHXBT'))
+        self.assertEqual(('ETH/USD', Timeframe.from_string('1h')), kraken_import.parse_kraken_member_name('ETHUSD_60.csv'))
+
+    def test_import_archive(self):
+        """verify all members are imported and a second import skips them"""
+        write_kraken_zip(self.kraken_file, {'ETHUSD_60.csv': self.data_1h, 'ETHUSD_1440.csv': self.data_1d})
+        importer = kraken_import.KrakenArchiveImporter(self.database, self.state_file, max_workers=2)
+
+        summary = importer.import_archive(self.kraken_file)
+        repeat_summary = importer.import_archive(self.kraken_file)
+
+        retriever = retrievers.DatabaseRetriever(self.database)
+        result_1h = retriever.fetch_ohlcv('ETH/USD', Timeframe.from_string('1h'), datetime(2020, 12, 1), datetime(2020, 12, 3))
+        result_1d = retriever.fetch_ohlcv('ETH/USD', Timeframe.from_string('1d'), datetime(2020, 12, 1), datetime(2020, 12, 5))
+        self.assertEqual(2, summary['members'])
+        self.assertEqual(len(self.data_1h) + len(self.data_1d), summary['new_rows'])
+        self.assertEqual(0, repeat_summary['members'])
+        pd.testing.assert_frame_equal(self.data_1h, result_1h)
+        pd.testing.assert_frame_equal(self.data_1d, result_1d)
+
+    def test_import_incremental_archive(self):
+        """verify an incremental archive only imports changed members and merges with stored rows"""
+        write_kraken_zip(self.kraken_file, {'ETHUSD_60.csv': self.data_1h.iloc[:40], 'ETHUSD_1440.csv': self.data_1d})
+        importer = kraken_import.KrakenArchiveImporter(self.database, self.state_file, max_workers=1)
+        importer.import_archive(self.kraken_file)
+
+        incremental_file = str(Path(self.directory.name) / 'Kraken_OHLCVT_Q4.zip')
+        write_kraken_zip(incremental_file, {'ETHUSD_60.csv': self.data_1h.iloc[30:], 'ETHUSD_1440.csv': self.data_1d})
+        summary = importer.import_archive(incremental_file, timeframes=['1h', '1d'])
+
+        result = retrievers.DatabaseRetriever(self.database).fetch_ohlcv('ETH/USD', Timeframe.from_string('1h'), datetime(2020, 12, 1), datetime(2020, 12, 3))
+        self.assertEqual(1, summary['members'])
+        self.assertEqual(len(self.data_1h) - 40, summary['new_rows'])
+        pd.testing.assert_frame_equal(self.data_1h, result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Tests for live_updater"""
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+from rba_tools.retriever.timeframe import Timeframe
+import rba_tools.retriever.constants as constants
+import rba_tools.retriever.database_interface as dbi
+import rba_tools.retriever.retrievers as retrievers
+from rba_tools.retriever.live_updater import LiveTailUpdater
+
+
+class FakeExchange:
+    """synchronous exchange serving candles from a dataframe, including the candle that hasn't closed"""
+
+    def __init__(self, data: pd.DataFrame, page_limit: int=24):
+        self.id = 'fake'
+        self.rateLimit = 0
+        self.rows = [[timestamp] + values for timestamp, values in
+                     zip(constants.datetime_index_to_epoch_ms(data.index).tolist(), data[['Open', 'High', 'Low', 'Close', 'Volume']].values.tolist())]
+        self.page_limit = page_limit
+        self.calls = 0
+
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+        self.calls += 1
+        return [row for row in self.rows if row[0] >= since][:limit or self.page_limit]
+
+
+class TestLiveTailUpdater(unittest.TestCase):
+    """class for testing LiveTailUpdater"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = dbi.SQLite3OHLCVDatabase(database_file=str(Path(self.directory.name) / 'ohlcv.db'))
+        self.data = pd.read_csv(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv', parse_dates=True, index_col='Timestamp')
+        self.timeframe = Timeframe.from_string('1h')
+        #half an hour into the 2020-12-03 00:00 candle
+        self.now = (datetime(2020, 12, 3, 0, 30) - datetime(1970, 1, 1)).total_seconds()
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def get_clock(self):
+        return lambda: self.now
+
+    def get_stored(self):
+        return retrievers.DatabaseRetriever(self.database).fetch_ohlcv('ETH/BTC', self.timeframe, datetime(2020, 11, 30), datetime(2020, 12, 20))
+
+    def test_run_once_stores_closed_candles(self):
+        """verify the first poll stores the lookback of closed candles and later polls only add new ones"""
+        exchange = FakeExchange(self.data)
+        updater = LiveTailUpdater(exchange, self.database, ['ETH/BTC'], ['1h'], initial_lookback_bars=48, clock=self.get_clock())
+
+        first_stored = updater.run_once()
+        repeat_stored = updater.run_once()
+        self.now += 2 * 3600
+        later_stored = updater.run_once()
+
+        self.assertEqual(48, first_stored)
+        self.assertEqual(0, repeat_stored)
+        self.assertEqual(2, later_stored)
+        pd.testing.assert_frame_equal(self.data.loc[:'2020-12-03 01:00'], self.get_stored())
+        self.assertEqual([(1606780800000, 1606960800000)], self.database.get_coverage('ETH/BTC', self.timeframe))
+
+    def test_resume_from_stored_data(self):
+        """verify a new updater continues from the newest stored bar"""
+        self.database.store_dataframe(self.data.loc[:'2020-12-01 23:00'], self.timeframe)
+        exchange = FakeExchange(self.data)
+        updater = LiveTailUpdater(exchange, self.database, ['ETH/BTC'], ['1h'], clock=self.get_clock())
+
+        self.assertEqual(24, updater.run_once())
+        pd.testing.assert_frame_equal(self.data.loc[:'2020-12-02 23:00'], self.get_stored())
+
+    def test_start_and_stop(self):
+        """verify the background thread polls and shuts down cleanly"""
+        exchange = FakeExchange(self.data)
+        with LiveTailUpdater(exchange, self.database, ['ETH/BTC'], ['1h'], poll_interval=0.01,
+                             initial_lookback_bars=24, clock=self.get_clock()) as updater:
+            self.assertTrue(updater.is_running())
+            for _ in range(500):
+                if exchange.calls:
+                    break
+                time.sleep(0.01)
+        self.assertFalse(updater.is_running())
+        self.assertGreater(exchange.calls, 0)
+        pd.testing.assert_frame_equal(self.data.loc['2020-12-02':'2020-12-02 23:00'], self.get_stored())
+
+
+if __name__ == "__main__":
+    unittest.main()
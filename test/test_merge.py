@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Tests for merge"""
+import unittest
+from unittest import mock
+from pathlib import Path
+import pandas as pd
+from rba_tools.retriever.merge import merge_ohlcv
+
+
+class TestMerge(unittest.TestCase):
+    """class for testing merge"""
+
+    def setUp(self):
+        self.data = pd.read_csv(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv', parse_dates=True, index_col='Timestamp')
+
+    def test_ordered_pieces_are_not_sorted(self):
+        """verify non-overlapping sorted pieces are put in order without sorting rows"""
+        pieces = [self.data.iloc[100:200], self.data.iloc[:50], self.data.iloc[50:100], self.data.iloc[200:]]
+        with mock.patch('numpy.argsort') as argsort:
+            result = merge_ohlcv(pieces)
+        argsort.assert_not_called()
+        pd.testing.assert_frame_equal(self.data, result)
+
+    def test_overlap_precedence(self):
+        """verify overlapping bars are kept from the first piece or the last piece"""
+        stored = self.data.iloc[:30]
+        fresh = self.data.iloc[20:60].copy()
+        fresh['Close'] = -1.0
+        result = merge_ohlcv([stored, fresh], keep='first')
+        pd.testing.assert_frame_equal(stored, result.iloc[:30])
+        self.assertTrue((result['Close'].iloc[30:] == -1.0).all())
+        self.assertEqual(60, len(result))
+
+        result = merge_ohlcv([stored, fresh], keep='last')
+        pd.testing.assert_frame_equal(stored.iloc[:20], result.iloc[:20])
+        self.assertTrue((result['Close'].iloc[20:] == -1.0).all())
+        self.assertEqual(60, len(result))
+
+    def test_unsorted_and_duplicated_piece(self):
+        """verify rows of an unsorted piece with repeated bars are sorted and de-duplicated"""
+        piece = pd.concat([self.data.iloc[10:20], self.data.iloc[:15]])
+        result = merge_ohlcv([piece, self.data.iloc[20:25]])
+        pd.testing.assert_frame_equal(self.data.iloc[:25], result)
+
+    def test_empty_pieces(self):
+        """verify empty pieces are ignored"""
+        empty = self.data.iloc[:0]
+        pd.testing.assert_frame_equal(self.data.iloc[:5], merge_ohlcv([empty, self.data.iloc[:5], empty]))
+        self.assertTrue(merge_ohlcv([empty, empty]).empty)
+        with self.assertRaises(ValueError):
+            merge_ohlcv([self.data], keep='stored')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Tests for optimize"""
+import unittest
+from unittest.mock import MagicMock
+import backtrader as bt
+import pandas as pd
+from rba_tools.backtest.optimize import ParameterSweep, grid_space, random_space, METRIC_COLUMNS
+from .backtest_helpers import FakeDataPuller
+
+
+class SmaCrossStrategy(bt.Strategy):
+    params = (('fast', 5), ('slow', 20))
+
+    def __init__(self):
+        self.crossover = bt.ind.CrossOver(bt.ind.SMA(period=self.p.fast), bt.ind.SMA(period=self.p.slow))
+
+    def next(self):
+        if not self.position:
+            if self.crossover > 0:
+                self.buy()
+        elif self.crossover < 0:
+            self.close()
+
+
+class TestOptimize(unittest.TestCase):
+    """class for testing optimize"""
+
+    def test_spaces(self):
+        """verify grid spaces hold every combination and random spaces are reproducible"""
+        self.assertEqual([{'fast': 5, 'slow': 20}, {'fast': 5, 'slow': 30}, {'fast': 10, 'slow': 20}, {'fast': 10, 'slow': 30}],
+                         grid_space({'fast': [5, 10], 'slow': [20, 30]}))
+        space = random_space({'fast': (2, 10), 'threshold': (0.5, 1.5), 'slow': [20, 30]}, samples=20, seed=1)
+        self.assertEqual(space, random_space({'fast': (2, 10), 'threshold': (0.5, 1.5), 'slow': [20, 30]}, samples=20, seed=1))
+        self.assertTrue(all(isinstance(params['fast'], int) and 2 <= params['fast'] <= 10 for params in space))
+        self.assertTrue(all(0.5 <= params['threshold'] <= 1.5 and params['slow'] in [20, 30] for params in space))
+
+    def test_sweep(self):
+        """verify a sweep loads data once, returns a row per combination and symbol and matches in a process pool"""
+        puller = FakeDataPuller()
+        puller.fetch_many = MagicMock(wraps=puller.fetch_many)
+        symbols = ['ETH/BTC', 'LTC/BTC']
+        space = grid_space({'fast': [3, 5], 'slow': [10, 20]})
+        sweep = ParameterSweep(SmaCrossStrategy, symbols, '2020-12-1', '2020-12-20', '1h', puller)
+
+        results = sweep.run(space)
+        puller.fetch_many.assert_called_once()
+        self.assertEqual(['symbol', 'fast', 'slow'] + METRIC_COLUMNS, list(results.columns))
+        self.assertEqual(len(space) * len(symbols), len(results))
+        self.assertGreater(results['trades'].sum(), 0)
+        self.assertEqual([len(puller.data), len(puller.data) - 24] * len(space), list(results['bars']))
+
+        sweep.max_workers = 2
+        pd.testing.assert_frame_equal(results, sweep.run(space))
+        puller.fetch_many.assert_called_once()
+
+        summary = sweep.summarize(results)
+        self.assertEqual(len(space), len(summary))
+        self.assertTrue(summary['return_pct'].is_monotonic_decreasing)
+
+    def test_drawdown_pruner(self):
+        """verify runs are stopped once their drawdown passes the limit"""
+        space = grid_space({'fast': [2, 3], 'slow': [10, 20]})
+        sweep = ParameterSweep(SmaCrossStrategy, ['ETH/BTC'], '2020-12-1', '2020-12-20', '1h', FakeDataPuller())
+        results = sweep.run(space)
+        pruned = sweep.run(space, prune_drawdown_pct=lambda params: results['peak_drawdown_pct'].min() / 2)
+        self.assertTrue(pruned['pruned'].all())
+        self.assertTrue((pruned['bars'] < results['bars']).all())
+        self.assertFalse(results['pruned'].any())
+
+    def test_successive_halving(self):
+        """verify candidates are cut at each rung and fewer bars are evaluated than in a full sweep"""
+        space = grid_space({'fast': [2, 3, 5, 8], 'slow': [10, 20, 30]})
+        sweep = ParameterSweep(SmaCrossStrategy, ['ETH/BTC', 'LTC/BTC'], '2020-12-1', '2020-12-20', '1h', FakeDataPuller())
+        search = sweep.successive_halving(space, min_rows=40)
+
+        runs_per_rung = search.results.groupby('rung').size()
+        self.assertEqual([24, 8, 4, 2], list(runs_per_rung))
+        full_history = search.results.loc[search.results['rung'] == search.results['rung'].max()]
+        self.assertEqual([search.best_params], full_history[['fast', 'slow']].drop_duplicates().to_dict('records'))
+        self.assertEqual(len(sweep.load_data()['ETH/BTC']), search.results.loc[search.results['symbol'] == 'ETH/BTC', 'rows'].max())
+        self.assertIn(search.best_params, space)
+        self.assertEqual(int(search.results['bars'].sum()), search.bar_evaluations)
+        self.assertEqual(int(sweep.run(space)['bars'].sum()), search.full_sweep_bar_evaluations)
+        self.assertGreater(search.get_bar_evaluation_ratio(), 2)
+
+        sweep.max_workers = 2
+        pd.testing.assert_frame_equal(search.results, sweep.successive_halving(space, min_rows=40).results)
+
+    def test_successive_halving_rungs(self):
+        """verify the default rungs leave one candidate for the full history whatever the number of candidates"""
+        sweep = ParameterSweep(SmaCrossStrategy, ['ETH/BTC'], '2020-12-1', '2020-12-20', '1h', FakeDataPuller())
+        for fast_values, expected_runs in [([2, 3], [2, 1]), ([2, 3, 4], [3, 1]), ([2, 3, 4, 5, 6, 7, 8, 9, 10], [9, 3, 1])]:
+            search = sweep.successive_halving(grid_space({'fast': fast_values, 'slow': [20]}), min_rows=40)
+            self.assertEqual(expected_runs, list(search.results.groupby('rung').size()))
+            self.assertEqual(len(sweep.load_data()['ETH/BTC']), search.results['rows'].iloc[-1])
+
+    def test_successive_halving_minimize(self):
+        """verify minimize keeps the candidates with the lowest metric"""
+        space = grid_space({'fast': [2, 3, 5, 8], 'slow': [10, 20, 30]})
+        sweep = ParameterSweep(SmaCrossStrategy, ['ETH/BTC'], '2020-12-1', '2020-12-20', '1h', FakeDataPuller())
+        search = sweep.successive_halving(space, metric='peak_drawdown_pct', min_fraction=1.0, minimize=True)
+        summary = sweep.summarize(search.results, metric='peak_drawdown_pct', minimize=True)
+        self.assertEqual(summary.index[0], (search.best_params['fast'], search.best_params['slow']))
+        self.assertEqual(search.results['peak_drawdown_pct'].min(), summary['peak_drawdown_pct'].iloc[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
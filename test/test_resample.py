@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Tests for resample"""
+import unittest
+from pathlib import Path
+import pandas as pd
+from rba_tools.retriever.timeframe import Timeframe
+import rba_tools.retriever.resample as resample
+
+
+class TestResample(unittest.TestCase):
+    """class for testing resample"""
+
+    def setUp(self):
+        self.data_1h = pd.read_csv(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv', parse_dates=True, index_col='Timestamp')
+
+    def test_resample_ohlcv(self):
+        """verify resampled 1h data matches the exchange's 1d data"""
+        expected = pd.read_csv(Path(__file__).parent / 'ETH_BTC_1D_2020-12-1_to_2020-12-20.csv', parse_dates=True, index_col='Timestamp')
+        result = resample.resample_ohlcv(self.data_1h, Timeframe.from_string('1d'))
+        pd.testing.assert_frame_equal(expected, result, check_freq=False)
+
+    def test_resample_weekly_starts_monday(self):
+        """verify weekly bars start on monday"""
+        result = resample.resample_ohlcv(self.data_1h, Timeframe.from_string('1w'))
+        self.assertEqual([pd.Timestamp('2020-11-30'), pd.Timestamp('2020-12-07'), pd.Timestamp('2020-12-14')], list(result.index))
+        self.assertEqual(self.data_1h['Open'].iloc[0], result['Open'].iloc[0])
+        self.assertAlmostEqual(self.data_1h.loc['2020-12-07':'2020-12-13', 'Volume'].sum(), result['Volume'].iloc[1])
+
+    def test_can_derive(self):
+        self.assertTrue(resample.can_derive(Timeframe.from_string('4h'), Timeframe.from_string('1h')))
+        self.assertFalse(resample.can_derive(Timeframe.from_string('1h'), Timeframe.from_string('1h')))
+        self.assertFalse(resample.can_derive(Timeframe.from_string('1h'), Timeframe.from_string('25m')))
+
+
+if __name__ == "__main__":
+    unittest.main()
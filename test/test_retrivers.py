@@ -1,9 +1,16 @@
+import asyncio
+import time
 import unittest
+import tempfile
+from unittest.mock import patch
+from zipfile import ZipFile
+import numpy as np
 import pandas as pd
 from rba_tools.retriever.timeframe import Timeframe
-from datetime import datetime
+from datetime import datetime, timezone
 import os
 from rba_tools.exceptions import KrakenFileNotFoundError
+from rba_tools.retriever.rate_limiter import TokenBucketRateLimiter
 import rba_tools.retriever.get_crypto_data as gcd
 import rba_tools.retriever.retrievers as retrievers
 import rba_tools.retriever.database_interface as dbi
@@ -12,6 +19,51 @@ from pathlib import Path
 PERFORM_API_TESTS = False
 
 
+class FakeAsyncExchange:
+    """in process stand in for a ccxt async exchange serving generated bars up to end_ms"""
+
+    def __init__(self, exchange_id='fake', rate_limit=0, page_limit=24, end_ms=1608508800000, delay=0.01):
+        self.id = exchange_id
+        self.rateLimit = rate_limit
+        self.page_limit = page_limit
+        self.end_ms = end_ms
+        self.delay = delay
+        self.calls = []
+        self.active_calls = 0
+        self.max_active_calls = 0
+        self.close_count = 0
+
+    async def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+        if self.close_count:
+            raise RuntimeError(f'{self.id} instance was closed by the user')
+        self.calls.append((symbol, timeframe, since, limit))
+        self.active_calls += 1
+        self.max_active_calls = max(self.max_active_calls, self.active_calls)
+        await asyncio.sleep(self.delay)
+        self.active_calls -= 1
+        bar_ms = int(Timeframe.from_string(timeframe).get_timeframe_seconds() * 1000)
+        start = -(-since // bar_ms) * bar_ms
+        count = min(limit or self.page_limit, self.page_limit)
+        return [self.bar(symbol, timestamp) for timestamp in range(start, min(start + count * bar_ms, self.end_ms), bar_ms)]
+
+    def bar(self, symbol, timestamp):
+        price = len(symbol) + timestamp / 10**12
+        return [timestamp, price, price + 1, price - 1, price + 0.5, 100.0]
+
+    def expected_df(self, symbol, timeframe, from_datetime, to_datetime):
+        bar_ms = int(timeframe.get_timeframe_seconds() * 1000)
+        start = int(from_datetime.timestamp() * 1000)
+        end = min(int(to_datetime.timestamp() * 1000), self.end_ms)
+        data = [self.bar(symbol, timestamp) for timestamp in range(start, end, bar_ms)]
+        df = pd.DataFrame(data, columns=['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume']).set_index('Timestamp')
+        df.index = pd.to_datetime(df.index, unit='ms')
+        df['Symbol'] = symbol
+        return df
+
+    async def close(self):
+        self.close_count += 1
+
+
 
 class TestRetriever(unittest.TestCase):
 
@@ -36,6 +88,146 @@ class TestRetriever(unittest.TestCase):
 
         pd.testing.assert_frame_equal(expected, result)
     
+    def test_CSVDataRetriever_parse_cache(self):
+        """verify the csv is parsed once for several symbols and reparsed when the file changes"""
+        csv_file = str(Path(__file__).parent / 'ETH_BTC_1D_2020-12-1_to_2020-12-20.csv')
+        expected = pd.read_csv(csv_file, parse_dates=True, index_col='Timestamp')
+        timeframe = Timeframe.from_string('1D')
+
+        with tempfile.TemporaryDirectory() as directory:
+            multi_symbol_file = str(Path(directory) / 'multi_symbol.csv')
+            other_symbol = expected.assign(Symbol='ETH/USD')
+            pd.concat([expected, other_symbol]).to_csv(multi_symbol_file)
+            retriever = retrievers.CSVDataRetriever(multi_symbol_file)
+
+            with patch('rba_tools.retriever.retrievers.pd.read_csv', wraps=pd.read_csv) as read_csv:
+                result = retriever.fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 20))
+                other_result = retriever.fetch_ohlcv('ETH/USD', timeframe, datetime(2020, 12, 5), datetime(2020, 12, 6))
+                missing_result = retriever.fetch_ohlcv('LTC/BTC', timeframe, datetime(2020, 12, 5), datetime(2020, 12, 6))
+                self.assertEqual(1, read_csv.call_count)
+
+                expected.iloc[:5].to_csv(multi_symbol_file)
+                changed_result = retriever.fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 20))
+                self.assertEqual(2, read_csv.call_count)
+
+        pd.testing.assert_frame_equal(expected, result)
+        pd.testing.assert_frame_equal(other_symbol.loc['2020-12-05':'2020-12-06'], other_result)
+        self.assertTrue(missing_result.empty)
+        pd.testing.assert_frame_equal(expected.iloc[:5], changed_result)
+
+    def test_CSVDataRetriever_chunked(self):
+        """verify chunked reads match reading the whole file"""
+        csv_file = str(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv')
+        timeframe = Timeframe.from_string('1h')
+        result = retrievers.CSVDataRetriever(csv_file).fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 3), datetime(2020, 12, 8))
+        chunked_result = retrievers.CSVDataRetriever(csv_file, chunksize=50).fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 3), datetime(2020, 12, 8))
+
+        pd.testing.assert_frame_equal(result, chunked_result)
+
+    def test_CSVDataRetriever_iter_ohlcv(self):
+        """verify streamed chunks are bounded and match a full fetch for cached and chunked reads"""
+        csv_file = str(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv')
+        timeframe = Timeframe.from_string('1h')
+        result = retrievers.CSVDataRetriever(csv_file).fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 3), datetime(2020, 12, 8))
+        chunks = list(retrievers.CSVDataRetriever(csv_file).iter_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 3), datetime(2020, 12, 8), chunksize=25))
+        file_chunks = list(retrievers.CSVDataRetriever(csv_file, chunksize=50).iter_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 3), datetime(2020, 12, 8), chunksize=25))
+
+        self.assertTrue(all(len(chunk) <= 25 for chunk in chunks + file_chunks))
+        pd.testing.assert_frame_equal(result, pd.concat(chunks))
+        pd.testing.assert_frame_equal(result, pd.concat(file_chunks))
+
+    def test_AsyncCCXTDataRetriever_many_symbols(self):
+        """verify many symbols are fetched concurrently and match the generated bars"""
+        exchange = FakeAsyncExchange(exchange_id='fake_many_symbols')
+        retriever = retrievers.AsyncCCXTDataRetriever(exchange, max_concurrency=4)
+        symbols = ['ETH/BTC', 'LTC/BTC', 'XRP/BTC', 'ADA/BTC', 'DOT/BTC', 'LINK/BTC']
+        timeframe = Timeframe.from_string('1h')
+
+        result = retriever.fetch_many_ohlcv(symbols, timeframe, datetime(2020, 12, 1), datetime(2020, 12, 3))
+
+        self.assertEqual(4, exchange.max_active_calls)
+        for symbol in symbols:
+            expected = exchange.expected_df(symbol, timeframe, datetime(2020, 12, 1, tzinfo=timezone.utc), datetime(2020, 12, 4, tzinfo=timezone.utc))
+            pd.testing.assert_frame_equal(expected, result[symbol])
+        self.assertEqual(0, exchange.close_count)
+        retriever.close()
+        self.assertEqual(1, exchange.close_count)
+
+    def test_AsyncCCXTDataRetriever_reused(self):
+        """verify the exchange stays open between calls and is only closed by close()"""
+        exchange = FakeAsyncExchange(exchange_id='fake_reused', end_ms=1606953600000) #12-3-2020
+        retriever = retrievers.AsyncCCXTDataRetriever(exchange)
+        timeframe = Timeframe.from_string('1h')
+
+        first = retriever.fetch_many_ohlcv(['ETH/BTC', 'LTC/BTC'], timeframe, datetime(2020, 12, 1), datetime(2020, 12, 2))
+        second = retriever.fetch_many_ohlcv(['ETH/BTC', 'LTC/BTC'], timeframe, datetime(2020, 12, 1), datetime(2020, 12, 2))
+        for symbol in ['ETH/BTC', 'LTC/BTC']:
+            pd.testing.assert_frame_equal(first[symbol], second[symbol])
+        self.assertEqual(0, exchange.close_count)
+
+        retriever.close()
+        retriever.close()
+        self.assertEqual(1, exchange.close_count)
+        with self.assertRaises(RuntimeError):
+            retriever.fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 2))
+        retriever.close()
+
+    def test_AsyncCCXTDataRetriever_sync_wrapper(self):
+        """verify fetch_ohlcv works from synchronous code and stops at the end of the available data"""
+        exchange = FakeAsyncExchange(exchange_id='fake_sync_wrapper', end_ms=1606953600000) #12-3-2020
+        retriever = retrievers.AsyncCCXTDataRetriever(exchange)
+        timeframe = Timeframe.from_string('1h')
+
+        result = retriever.fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 5))
+
+        expected = exchange.expected_df('ETH/BTC', timeframe, datetime(2020, 12, 1, tzinfo=timezone.utc), datetime(2020, 12, 3, tzinfo=timezone.utc))
+        pd.testing.assert_frame_equal(expected, result)
+
+    def test_AsyncCCXTDataRetriever_windowed(self):
+        """verify a long range is fetched as concurrent windows and stitched together"""
+        exchange = FakeAsyncExchange(exchange_id='fake_windowed')
+        retriever = retrievers.AsyncCCXTDataRetriever(exchange, page_limit=24)
+        timeframe = Timeframe.from_string('1h')
+
+        result = retriever.fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 10))
+
+        expected = exchange.expected_df('ETH/BTC', timeframe, datetime(2020, 12, 1, tzinfo=timezone.utc), datetime(2020, 12, 11, tzinfo=timezone.utc))
+        pd.testing.assert_frame_equal(expected, result)
+        self.assertEqual(10, len(exchange.calls))
+        self.assertGreater(exchange.max_active_calls, 1)
+
+    def test_AsyncCCXTDataRetriever_windowed_short_pages(self):
+        """verify windows are paged through when the exchange returns fewer bars than requested"""
+        exchange = FakeAsyncExchange(exchange_id='fake_short_pages', page_limit=10, end_ms=1607040000000) #12-4-2020
+        retriever = retrievers.AsyncCCXTDataRetriever(exchange, page_limit=24)
+        timeframe = Timeframe.from_string('1h')
+
+        result = retriever.fetch_ohlcv('ETH/BTC', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 5))
+
+        expected = exchange.expected_df('ETH/BTC', timeframe, datetime(2020, 12, 1, tzinfo=timezone.utc), datetime(2020, 12, 4, tzinfo=timezone.utc))
+        pd.testing.assert_frame_equal(expected, result)
+
+    def test_stitch_ccxt_pages(self):
+        """verify pages are sorted, de-duplicated and limited to the range"""
+        pages = [np.array([[30, 3, 3, 3, 3, 3], [40, 4, 4, 4, 4, 4]], dtype=float),
+                 np.array([[10, 1, 1, 1, 1, 1], [20, 2, 2, 2, 2, 2], [30, 9, 9, 9, 9, 9]], dtype=float)]
+        result = retrievers.stitch_ccxt_pages(pages, 20, 30)
+        np.testing.assert_array_equal(np.array([[20, 2, 2, 2, 2, 2], [30, 3, 3, 3, 3, 3]], dtype=float), result)
+
+    def test_TokenBucketRateLimiter(self):
+        """verify the limiter spaces out requests and is shared per exchange"""
+        limiter = TokenBucketRateLimiter(0.05)
+        async def acquire_many():
+            await asyncio.gather(*(limiter.acquire() for _ in range(5)))
+        start = time.monotonic()
+        asyncio.run(acquire_many())
+
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+        self.assertIs(TokenBucketRateLimiter.for_exchange('shared', 100), TokenBucketRateLimiter.for_exchange('shared', 100))
+        slower = TokenBucketRateLimiter.for_exchange('shared', 200, capacity=2)
+        self.assertIsNot(TokenBucketRateLimiter.for_exchange('shared', 100), slower)
+        self.assertEqual((0.2, 2), (slower.interval, slower.capacity))
+
     def test_CCXTDataRetriever_Basic(self):
         """test a simple CCXT single data pull"""
         if not PERFORM_API_TESTS:
@@ -124,6 +316,53 @@ class TestRetriever(unittest.TestCase):
 
         pd.testing.assert_frame_equal(result, expected)
 
+    def test_kraken_retreiver_cache(self):
+        """verify cached kraken fetches match the csv result and don't reparse the zip member"""
+        file = str(Path(__file__).parent / 'Kraken_ETCUSD_60.csv')
+        expected = pd.read_csv(file, parse_dates=True, index_col='Timestamp')
+        kraken_rows = expected.drop(columns='Symbol')
+        kraken_rows.index = kraken_rows.index.view('int64') // 10**9
+        kraken_rows['Trades'] = 1
+
+        with tempfile.TemporaryDirectory() as directory:
+            kraken_file = str(Path(directory) / 'Kraken_OHLCVT.zip')
+            with ZipFile(kraken_file, 'w') as kraken_zip:
+                kraken_zip.writestr('ETHUSD_60.csv', kraken_rows.to_csv(header=False))
+            kraken_retriever = retrievers.KrakenOHLCVTZipRetriever(kraken_file)
+            symbol = 'ETH/USD'
+            timeframe = Timeframe.from_string('1h')
+
+            result = kraken_retriever.fetch_ohlcv(symbol, timeframe, datetime(2020, 12, 1), datetime(2020, 12, 3))
+            with patch('rba_tools.retriever.retrievers.pd.read_csv') as read_csv:
+                partial_result = kraken_retriever.fetch_ohlcv(symbol, timeframe, datetime(2020, 12, 2), datetime(2020, 12, 2))
+                read_csv.assert_not_called()
+            uncached_result = retrievers.KrakenOHLCVTZipRetriever(kraken_file, use_cache=False).fetch_ohlcv(symbol, timeframe, datetime(2020, 12, 1), datetime(2020, 12, 3))
+            self.assertEqual(1, len(list(Path(directory, 'Kraken_OHLCVT.cache').iterdir())))
+
+        pd.testing.assert_frame_equal(expected, result)
+        pd.testing.assert_frame_equal(expected.loc['2020-12-02'], partial_result)
+        pd.testing.assert_frame_equal(expected, uncached_result)
+
+    def test_kraken_retreiver_iter_ohlcv(self):
+        """verify streamed kraken chunks are bounded and match a full fetch with and without the cache"""
+        file = str(Path(__file__).parent / 'Kraken_ETCUSD_60.csv')
+        expected = pd.read_csv(file, parse_dates=True, index_col='Timestamp')
+        kraken_rows = expected.drop(columns='Symbol')
+        kraken_rows.index = kraken_rows.index.view('int64') // 10**9
+        kraken_rows['Trades'] = 1
+
+        with tempfile.TemporaryDirectory() as directory:
+            kraken_file = str(Path(directory) / 'Kraken_OHLCVT.zip')
+            with ZipFile(kraken_file, 'w') as kraken_zip:
+                kraken_zip.writestr('ETHUSD_60.csv', kraken_rows.to_csv(header=False))
+            timeframe = Timeframe.from_string('1h')
+            chunks = list(retrievers.KrakenOHLCVTZipRetriever(kraken_file).iter_ohlcv('ETH/USD', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 3), chunksize=10))
+            uncached_chunks = list(retrievers.KrakenOHLCVTZipRetriever(kraken_file, use_cache=False).iter_ohlcv('ETH/USD', timeframe, datetime(2020, 12, 1), datetime(2020, 12, 3), chunksize=10))
+
+        self.assertTrue(all(len(chunk) <= 10 for chunk in chunks))
+        pd.testing.assert_frame_equal(expected, pd.concat(chunks), check_freq=False)
+        pd.testing.assert_frame_equal(expected, pd.concat(uncached_chunks), check_freq=False)
+
     def test_kraken_retreiver_exception(self):
         """test kraken file not found"""
         self.assertRaises(KrakenFileNotFoundError, retrievers.KrakenOHLCVTZipRetriever, 'badfilename')
@@ -6,8 +6,11 @@ Created on Sat Nov 01 2021
 @author: Avery
 
 """
+import pickle
 import unittest
 from datetime import timedelta
+import numpy as np
+import pandas as pd
 from rba_tools.retriever.timeframe import Timeframe
 
 class TestTimeframe(unittest.TestCase):
@@ -131,6 +134,44 @@ class TestTimeframe(unittest.TestCase):
         """test equals operator"""
         self.assertTrue(Timeframe.from_seconds(60) == Timeframe.from_seconds(60))
 
+    def test_interned_and_hashable(self):
+        """test equal timeframes are the same instance and can be used as dict keys"""
+        self.assertIs(Timeframe.from_string('1h'), Timeframe.from_seconds(3600))
+        self.assertIs(Timeframe.from_string('1h'), pickle.loads(pickle.dumps(Timeframe.from_string('1h'))))
+        self.assertEqual({Timeframe.from_string('60m'): 1}, {Timeframe.from_string('1h'): 1})
+
+    def test_immutable(self):
+        """test attributes can't be changed"""
+        with self.assertRaises(AttributeError):
+            Timeframe.from_string('1h').timeframe = timedelta(seconds=60)
+
+    def test_floor_and_ceil_ms(self):
+        """test flooring and ceiling epoch millisecond arrays to bar boundaries"""
+        timeframe = Timeframe.from_string('4h')
+        hour_ms = 3600000
+        timestamps = np.array([0, 1, 4 * hour_ms, 5 * hour_ms])
+        np.testing.assert_array_equal([0, 0, 4 * hour_ms, 4 * hour_ms], timeframe.floor_ms(timestamps))
+        np.testing.assert_array_equal([0, 4 * hour_ms, 4 * hour_ms, 8 * hour_ms], timeframe.ceil_ms(timestamps))
+
+    def test_weekly_bars_start_monday(self):
+        """test weekly bars are aligned to Monday 00:00 UTC"""
+        timeframe = Timeframe.from_string('1w')
+        wednesday_ms = 1607472000000 #2020-12-09
+        monday_ms = 1607299200000 #2020-12-07
+        self.assertEqual(monday_ms, timeframe.floor_ms(wednesday_ms))
+        self.assertEqual(monday_ms + timeframe.get_bar_ms(), timeframe.ceil_ms(wednesday_ms))
+
+    def test_expected_index(self):
+        """test counting and listing the bars that start in a range"""
+        timeframe = Timeframe.from_string('1h')
+        start_ms = 1606780800000 #2020-12-01
+        end_ms = start_ms + 24 * timeframe.get_bar_ms()
+        self.assertEqual(24, timeframe.count_bars(start_ms, end_ms))
+        self.assertEqual(23, timeframe.count_bars(start_ms + 1, end_ms))
+        self.assertEqual(0, timeframe.count_bars(end_ms, start_ms))
+        expected = pd.date_range('2020-12-01', periods=24, freq='H', name='Timestamp')
+        pd.testing.assert_index_equal(expected, timeframe.get_expected_index(start_ms, end_ms), exact=False, check_names=True)
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Tests for validation"""
+import tempfile
+import unittest
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from rba_tools.retriever.timeframe import Timeframe
+import rba_tools.retriever.database_interface as dbi
+import rba_tools.retriever.get_crypto_data as gcd
+import rba_tools.retriever.retrievers as retrievers
+import rba_tools.retriever.validation as validation
+from rba_tools.exceptions import OHLCVValidationError
+
+DEC_1_MS = 1606780800000
+HOUR_MS = 3600000
+
+
+class TestValidation(unittest.TestCase):
+    """class for testing the ohlcv validator"""
+
+    def setUp(self):
+        self.data = pd.read_csv(Path(__file__).parent / 'ETH_BTC_1H_2020-12-1_to_2020-12-20.csv', parse_dates=True, index_col='Timestamp')
+        self.timeframe = Timeframe.from_string('1h')
+
+    def test_valid_data(self):
+        """verify clean data has no findings"""
+        report = validation.validate_ohlcv(self.data, self.timeframe)
+        self.assertTrue(report.is_valid(allow_gaps=False))
+        self.assertEqual(len(self.data), report.expected_bars)
+        self.assertEqual('ETH/BTC', report.symbol)
+
+    def test_gaps(self):
+        """verify missing bars inside and around the data are reported as gaps"""
+        data = self.data.drop(self.data.loc['2020-12-02 05:00':'2020-12-02 07:00'].index)
+        report = validation.validate_ohlcv(data, self.timeframe, DEC_1_MS - 2 * HOUR_MS, DEC_1_MS + len(self.data) * HOUR_MS)
+
+        self.assertEqual([(DEC_1_MS - 2 * HOUR_MS, DEC_1_MS), (DEC_1_MS + 29 * HOUR_MS, DEC_1_MS + 32 * HOUR_MS)], report.gaps)
+        self.assertEqual(5, report.get_missing_bars())
+        self.assertTrue(report.is_valid())
+        self.assertFalse(report.is_valid(allow_gaps=False))
+
+    def test_invalid_rows(self):
+        """verify duplicated, unsorted, misaligned and invalid bars are reported"""
+        data = self.data.iloc[:48].copy()
+        data.iloc[3, data.columns.get_loc('High')] = data['Low'].iloc[3] / 2
+        data.iloc[4, data.columns.get_loc('Volume')] = np.nan
+        data = pd.concat([data, data.iloc[[10]], data.iloc[[5]].set_axis(data.index[[5]] + pd.Timedelta(minutes=30))])
+        report = validation.validate_ohlcv(data, self.timeframe)
+
+        self.assertFalse(report.is_valid())
+        self.assertEqual([DEC_1_MS + 10 * HOUR_MS], report.duplicates.tolist())
+        self.assertEqual(2, report.unsorted_rows)
+        self.assertEqual([DEC_1_MS + 5 * HOUR_MS + HOUR_MS // 2], report.misaligned.tolist())
+        self.assertEqual([DEC_1_MS + 3 * HOUR_MS, DEC_1_MS + 4 * HOUR_MS], report.invalid_bars.tolist())
+        self.assertEqual([], report.gaps)
+
+    def test_validate_database(self):
+        """verify every stored series is validated for both databases"""
+        with tempfile.TemporaryDirectory() as directory:
+            sqlite_db = dbi.SQLite3OHLCVDatabase(database_file=str(Path(directory) / 'ohlcv.db'))
+            columnar_db = dbi.NumpyColumnarOHLCVDatabase(root_directory=str(Path(directory) / 'columnar'))
+            for database in [sqlite_db, columnar_db]:
+                database.store_dataframe(self.data.drop(self.data.index[30]), self.timeframe)
+                database.store_dataframe(self.data.iloc[:24].assign(Symbol='LTC/BTC'), self.timeframe)
+                reports = {report.symbol: report for report in validation.validate_database(database, timeframes=['1h'])}
+
+                self.assertEqual(['ETH/BTC', 'LTC/BTC'], sorted(reports))
+                self.assertEqual([(DEC_1_MS + 30 * HOUR_MS, DEC_1_MS + 31 * HOUR_MS)], reports['ETH/BTC'].gaps)
+                self.assertTrue(reports['LTC/BTC'].is_valid(allow_gaps=False))
+            sqlite_db.close()
+
+    def test_strict_data_puller(self):
+        """verify a strict puller raises when fetched data has invalid bars"""
+        data = self.data.copy()
+        data.iloc[3, data.columns.get_loc('High')] = data['Low'].iloc[3] / 2
+        with tempfile.TemporaryDirectory() as directory:
+            csv_file = str(Path(directory) / 'bad_data.csv')
+            data.to_csv(csv_file)
+            puller = gcd.DataPuller(online_retriever=retrievers.CSVDataRetriever(csv_file), strict=True)
+            with self.assertRaises(OHLCVValidationError) as context:
+                puller.fetch_df('ETH/BTC', '1h', '12-1-2020', '12-20-2020')
+
+        self.assertEqual([DEC_1_MS + 3 * HOUR_MS], context.exception.report.invalid_bars.tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()